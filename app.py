@@ -1,19 +1,150 @@
+import io
 import os
-import pandas as pd
-from flask import Flask, render_template, request, send_file
+import re
+import csv
+import json
+import time
+import uuid
+import queue
+import posixpath
+import shutil
+import bisect
+import hashlib
+import datetime
+import tempfile
+import threading
+import weakref
+import zipfile
+import importlib
+from flask import Flask, Request, Response, render_template, request, send_file, jsonify, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
 from flask_apscheduler import APScheduler
-from io import BytesIO
+from itertools import islice
+from collections import OrderedDict, namedtuple
 
 
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    The real module then replaces the stand-in under alias in this module's
+    globals, so later lookups cost nothing extra.
+    """
+
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module
+        return getattr(module, attr)
+
+# pandas and numpy are most of the import time and the HTML routes never touch
+# them; they load with the first parse (or the warm-up, see Startup)
+np = LazyModule('numpy', 'np')
+pd = LazyModule('pandas', 'pd')
+
 app = Flask(__name__)
 # === Scheduler config ===
+def parse_dedup_keys(text):
+    """DEDUP_KEYS as {output sheet: [key columns]}.
+
+    A value that is not such a JSON object is reported and ignored, so the app
+    still starts and dedup falls back to matching rows on all columns.
+    """
+    try:
+        keys = json.loads(text)
+    except ValueError as e:
+        print(f"❌ DEDUP_KEYS is not valid JSON ({e}); matching duplicate rows on all columns")
+        return {}
+    if not isinstance(keys, dict):
+        print("❌ DEDUP_KEYS must be a JSON object of output sheet -> list of key columns; "
+              "matching duplicate rows on all columns")
+        return {}
+    valid = {}
+    for sheet_name, columns in keys.items():
+        if isinstance(columns, list) and columns and all(isinstance(column, str) for column in columns):
+            valid[sheet_name] = columns
+        else:
+            print(f"❌ DEDUP_KEYS['{sheet_name}'] must be a list of column names; "
+                  f"matching duplicate rows of that sheet on all columns")
+    return valid
+
 class Config:
     SCHEDULER_API_ENABLED = True
+    # Stream rows straight from the uploads into the output workbook in
+    # fixed-size batches instead of building DataFrames (bounded memory)
+    STREAMING_COMBINE = os.environ.get('STREAMING_COMBINE', '0') == '1'
+    STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '2000'))
+    # 'xlsxwriter' (constant_memory, row streaming) or 'openpyxl'
+    OUTPUT_ENGINE = os.environ.get('OUTPUT_ENGINE', 'xlsxwriter')
+    # Parse-stage workbook reader: 'lean' (streamed sheet XML, projected columns)
+    # or 'openpyxl' (pd.read_excel)
+    READ_ENGINE = os.environ.get('READ_ENGINE', 'lean')
+    # Combined workbooks larger than this are spooled to disk before send_file
+    OUTPUT_SPOOL_MAX_SIZE = int(os.environ.get('OUTPUT_SPOOL_MAX_SIZE', str(8 * 1024 * 1024)))
+    # Worker processes for parsing uploaded sheets in parallel (1 = parse serially)
+    PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', str(os.cpu_count() or 1)))
+    # Combine job queue: 'inprocess' (thread pool in the web process) or 'celery'
+    # (workers started with `celery -A tasks worker`, see tasks.py)
+    JOB_QUEUE = os.environ.get('JOB_QUEUE', 'inprocess')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+    # Job records, uploads and results; with celery this must be storage the web
+    # processes and every worker share (e.g. a mounted network volume)
+    JOBS_DIR = os.environ.get('JOBS_DIR', os.path.abspath("jobs"))
+    CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+    # Finished jobs (and their results) are deleted after this long; queued or
+    # running jobs whose record is not updated for this long are failed
+    JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', str(24 * 3600)))
+    # Cache of parsed sheets keyed by upload content hash (memory LRU + on-disk Feather)
+    PARSE_CACHE_ENABLED = os.environ.get('PARSE_CACHE_ENABLED', '1') == '1'
+    PARSE_CACHE_DIR = os.environ.get('PARSE_CACHE_DIR', os.path.abspath(os.path.join("cache", "parse")))
+    PARSE_CACHE_MEMORY_BYTES = int(os.environ.get('PARSE_CACHE_MEMORY_BYTES', str(256 * 1024 * 1024)))
+    PARSE_CACHE_DISK_BYTES = int(os.environ.get('PARSE_CACHE_DISK_BYTES', str(2 * 1024 * 1024 * 1024)))
+    # Keep a per-plant combined dataset in combined/<plant>/ and only re-parse changed files
+    INCREMENTAL_COMBINE = os.environ.get('INCREMENTAL_COMBINE', '0') == '1'
+    # Uploads are spooled to disk as they arrive; a request or a single file
+    # above these sizes is rejected with 413
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', str(512 * 1024 * 1024)))
+    MAX_UPLOAD_FILE_BYTES = int(os.environ.get('MAX_UPLOAD_FILE_BYTES', str(100 * 1024 * 1024)))
+    UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', tempfile.gettempdir())
+    # Print a line per file and sheet while combining (stage timings go to /metrics either way)
+    COMBINE_VERBOSE_LOG = os.environ.get('COMBINE_VERBOSE_LOG', '0') == '1'
+    # Directory the worker processes of one server share their metrics and schema
+    # mismatches through, so /metrics and /schema/mismatches cover all of them
+    # (gunicorn.conf.py sets it); empty = each process reports only its own
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    # Finished outputs keyed by their inputs, so a repeated request is served from
+    # disk; evicted once unused for the TTL (counted from the last time a result
+    # was served, not from when it was made), then least recently used first
+    # above the size cap
+    RESULT_STORE_ENABLED = os.environ.get('RESULT_STORE_ENABLED', '1') == '1'
+    RESULT_STORE_DIR = os.environ.get('RESULT_STORE_DIR', os.path.abspath(os.path.join("cache", "results")))
+    RESULT_STORE_MAX_BYTES = int(os.environ.get('RESULT_STORE_MAX_BYTES', str(1024 * 1024 * 1024)))
+    RESULT_STORE_TTL_SECONDS = int(os.environ.get('RESULT_STORE_TTL_SECONDS', str(7 * 24 * 3600)))
+    # Drop rows repeated across the uploaded files (cumulative year-to-date exports).
+    # DEDUP_KEEP is 'first' (earliest file's copy wins) or 'latest'; DEDUP_KEYS is a
+    # JSON object of output sheet -> key columns, all columns for sheets not in it
+    DEDUP_ROWS = os.environ.get('DEDUP_ROWS', '0') == '1'
+    DEDUP_KEEP = os.environ.get('DEDUP_KEEP', 'first')
+    DEDUP_KEYS = parse_dedup_keys(os.environ.get('DEDUP_KEYS', '{}'))
+    # Add pre-aggregated rollup sheets: Brushcards by client, defect and production
+    # date, and each Kunshan station sheet by date
+    ROLLUPS = os.environ.get('ROLLUPS', '0') == '1'
+    # Start the scheduled jobs with the first request. Multi-worker servers
+    # (gunicorn.conf.py) turn this off and let the worker holding
+    # SCHEDULER_LOCK_FILE run them
+    SCHEDULER_AUTOSTART = os.environ.get('SCHEDULER_AUTOSTART', '1') == '1'
+    SCHEDULER_LOCK_FILE = os.environ.get('SCHEDULER_LOCK_FILE', os.path.abspath(os.path.join("cache", "scheduler.lock")))
+    # 'background': load the Excel stack in a thread once the app starts serving,
+    # and report it on /ready; 'off': load it with the first combine
+    WARMUP = os.environ.get('WARMUP', 'background')
 
 app.config.from_object(Config())
 scheduler = APScheduler()
 scheduler.init_app(app)
-scheduler.start()
 
 # === Constants ===
 ALLOWED_EXTENSIONS = {'xlsx', 'xlsm', 'xltx', 'xltm'}
@@ -23,375 +154,3271 @@ CLEANUP_DIR = os.path.abspath("combined")
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def delete_excel_temp_files():
-    for foldername, _, filenames in os.walk(CLEANUP_DIR):
-        for filename in filenames:
-            if filename.startswith('~$') and filename.endswith(('.xlsx', '.xlsm')):
-                try:
-                    os.remove(os.path.join(foldername, filename))
-                    print(f"🧹 Deleted temp file: {filename}")
-                except Exception as e:
-                    print(f"❌ Could not delete {filename}: {e}")
+# === Process locks ===
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+def lock_file(file, blocking=True):
+    """Take an exclusive OS lock on an open file; False if blocking is off and another process holds it"""
+    if fcntl:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+    while True:
+        try:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+def unlock_file(file):
+    if fcntl:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+class FileLock:
+    """Exclusive lock shared by the threads of this process and other processes on the host.
+
+    Re-entrant within a process like threading.RLock; the outermost acquire also
+    takes an OS lock on path, held until the matching release. on_acquire, if
+    given, runs after each outermost acquire (e.g. to reload state another
+    process may have changed).
+    """
+
+    def __init__(self, path, on_acquire=None):
+        self.path = path
+        self.on_acquire = on_acquire
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def acquire(self, blocking=True):
+        if not self.lock.acquire(blocking):
+            return False
+        if self.depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self.file = open(self.path, 'a+b')
+                if not lock_file(self.file, blocking):
+                    self.file.close()
+                    self.file = None
+                    self.lock.release()
+                    return False
+                if self.on_acquire:
+                    self.on_acquire()
+            except BaseException:
+                if self.file:
+                    self.file.close()
+                    self.file = None
+                self.lock.release()
+                raise
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            unlock_file(self.file)
+            self.file.close()
+            self.file = None
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+# === Upload spooling ===
+# Uploads are written to UPLOAD_SPOOL_DIR as the multipart body arrives and
+# hashed on the way, so the parser opens a file on disk instead of a bytes copy.
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+Upload = namedtuple('Upload', ['filename', 'path', 'sheet_names', 'digest', 'size', 'temporary'])
+
+class UploadFileTooLarge(RequestEntityTooLarge):
+    pass
+
+def format_limit(limit):
+    """Size limit in whole MB, or in KB / bytes when it is under 1 MB"""
+    if limit >= 1024 * 1024:
+        return f"{limit // (1024 * 1024)} MB"
+    if limit >= 1024:
+        return f"{limit // 1024} KB"
+    return f"{limit} bytes"
+
+def remove_spool_file(file, path):
+    file.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class UploadSpoolFile:
+    """Disk-backed upload stream that enforces a size limit and hashes what is written.
+
+    A plain file from mkstemp rather than NamedTemporaryFile, so the path can be
+    reopened by the parser on every platform. close() deletes it, and so does
+    garbage collection if a failed request never got to close it.
+    """
+
+    def __init__(self, directory, limit):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=directory, prefix='upload-', suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+        self.limit = limit
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.release = weakref.finalize(self, remove_spool_file, self.file, self.name)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit and self.size > self.limit:
+            raise UploadFileTooLarge(f"Each uploaded file must be at most {format_limit(self.limit)}.")
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def digest(self):
+        """SHA-256 of the upload, or None if it was not written in one sequential pass"""
+        self.file.flush()
+        return self.sha256.hexdigest() if os.fstat(self.file.fileno()).st_size == self.size else None
+
+    def close(self):
+        self.release()
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+class SpooledUploadRequest(Request):
+    """Request whose file parts are spooled to disk, each capped at MAX_UPLOAD_FILE_BYTES"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpoolFile(app.config['UPLOAD_SPOOL_DIR'], app.config['MAX_UPLOAD_FILE_BYTES'])
+
+app.request_class = SpooledUploadRequest
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    if isinstance(e, UploadFileTooLarge):
+        return f"Error: {e.description}", 413
+    return f"Error: The upload must be at most {format_limit(app.config['MAX_CONTENT_LENGTH'])} in total.", 413
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: f.read(SPOOL_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def spool_upload(file):
+    """Return (path, digest, size, temporary) for an upload as a file on disk.
+
+    Spooled request uploads and uploads opened from a file are used in place;
+    anything else (an in-memory stream) is copied to the spool directory in
+    chunks, and temporary is True so release_uploads() deletes the copy.
+    """
+    stream = file.stream
+    if isinstance(stream, UploadSpoolFile):
+        digest = stream.digest()
+        return stream.name, digest or file_digest(stream.name), os.path.getsize(stream.name), False
+
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return os.path.abspath(path), file_digest(path), os.path.getsize(path), False
+
+    spool = UploadSpoolFile(app.config['UPLOAD_SPOOL_DIR'], None)
+    try:
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(SPOOL_CHUNK_SIZE), b''):
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    # Keep the file past this object; release_uploads() deletes it
+    spool.release.detach()
+    spool.file.close()
+    return spool.name, spool.sha256.hexdigest(), spool.size, True
+
+def upload_digest(file):
+    """SHA-256 of an upload's content, without copying it anywhere"""
+    stream = file.stream
+    if isinstance(stream, UploadSpoolFile):
+        return stream.digest() or file_digest(stream.name)
+
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return file_digest(path)
+
+    position = stream.tell()
+    sha256 = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(SPOOL_CHUNK_SIZE), b''):
+        sha256.update(chunk)
+    stream.seek(position)
+    return sha256.hexdigest()
+
+def save_upload(file, path):
+    """Persist an upload at path, hard-linking the spooled file instead of copying when possible"""
+    if isinstance(file.stream, UploadSpoolFile) and file.stream.digest():
+        try:
+            os.link(file.stream.name, path)
+            return
+        except OSError:
+            pass
+    file.save(path)
+
+def detach_uploads(uploaded_files):
+    """Copies of the request's uploads that stay readable after the request is closed.
+
+    Streamed responses are written once the view has returned, and Flask closes
+    (and so deletes) the spooled uploads at that point. Close each copy with
+    close_detached_uploads().
+    """
+    detached = []
+    try:
+        for file in uploaded_files:
+            path = os.path.join(app.config['UPLOAD_SPOOL_DIR'], f"upload-{uuid.uuid4().hex}")
+            save_upload(file, path)
+            detached.append(FileStorage(stream=open(path, 'rb'), filename=file.filename))
+    except Exception:
+        close_detached_uploads(detached)
+        raise
+    return detached
+
+def close_detached_uploads(uploaded_files):
+    for file in uploaded_files:
+        remove_spool_file(file.stream, file.stream.name)
+
+def release_uploads(uploads):
+    """Delete the temporary copies spool_upload() made"""
+    for upload in uploads:
+        if upload.temporary:
+            try:
+                os.remove(upload.path)
+            except FileNotFoundError:
+                pass
+
+# === Anhui helpers ===
+CLIENT_NAME_COLUMN = '客户名称\nClient Name'
+
+BRUSHCARD_COLUMNS = [
+    '生产日期\nProduction Date', '检验日期\nInspection Date', '型号\nType',
+    '不良部位\nDefective Part', '不良名称\nDefect Name', '数量\nQuantity',
+    '处理方式\nHandling method', '原因\nCause of defect', '检验站别\nInspection station',
+    '当日检数量\nInspection quantity', '备注\nRemark'
+]
+
+def extract_client_name(filename, sheet_name=None):
+    """Extract client name from filename or sheet name"""
+    # Remove file extension and path
+    base_name = filename.rsplit('.', 1)[0] if '.' in filename else filename
+
+    # For chokes file
+    if 'Quality follow-up Chokes' in base_name or 'choke' in base_name.lower():
+        return 'Chokes'
+
+    # For brushcard files like "Kelier 2025质量汇总表.xlsx"
+    if '质量汇总表' in base_name:
+        # Remove "2025质量汇总表" and "质量汇总表" to get client name
+        client_name = base_name.replace(' 2025质量汇总表', '').strip()
+        client_name = client_name.replace('2025质量汇总表', '').strip()
+        client_name = client_name.replace(' 质量汇总表', '').strip()
+        client_name = client_name.replace('质量汇总表', '').strip()
+        return client_name
+
+    # If sheet name is provided and contains 质量汇总表
+    if sheet_name and '质量汇总表' in sheet_name:
+        client_name = sheet_name.replace('质量汇总表', '').strip()
+        return client_name
+
+    return base_name
+
+# === Schema registry ===
+SchemaLayout = namedtuple('SchemaLayout', ['positions', 'missing', 'unmapped', 'duplicates'])
+
+class ColumnSchema:
+    """Target columns of an output sheet plus the synonym rules that map source headers onto them.
+
+    rules is a list of (target, synonyms) in priority order: a header maps to the
+    first target with a synonym contained in it. The rules are compiled once into
+    a single regex, and resolved layouts are memoized by header tuple, so a repeated
+    supplier layout costs one dictionary lookup.
+    """
+
+    def __init__(self, name, rules):
+        self.name = name
+        self.targets = [target for target, _ in rules]
+        self.exact = set(self.targets)
+        # One lookahead branch per rule, tried in order at the start of the header,
+        # so the first matching rule wins wherever its synonym occurs
+        branches = '|'.join(
+            f"(?=.*?(?:{'|'.join(re.escape(synonym) for synonym in synonyms)}))(?P<rule{index}>)"
+            for index, (_, synonyms) in enumerate(rules)
+        )
+        self.matcher = re.compile(f"(?:{branches})", re.DOTALL)
+        self.layouts = {}
+
+    def match(self, col):
+        """Return the target column a source header maps to, or None"""
+        col_str = str(col).strip()
+
+        # Direct matches
+        if col_str in self.exact:
+            return col_str
+
+        # Fuzzy matching for common variations
+        match = self.matcher.match(col_str.lower())
+        return self.targets[int(match.lastgroup[4:])] if match else None
+
+    def resolve(self, header):
+        """Return the SchemaLayout of a header tuple: the source position of each target"""
+        layout = self.layouts.get(header)
+        if layout is None:
+            if len(self.layouts) >= 4096:
+                self.layouts.clear()
+            layout = self.layouts[header] = self.build_layout(header)
+        return layout
+
+    def build_layout(self, header):
+        positions = dict.fromkeys(self.targets)
+        unmapped = []
+        duplicates = []
+        for position, col in enumerate(header):
+            target = self.match(col)
+            if target is None:
+                unmapped.append(str(col))
+            elif positions[target] is None:
+                positions[target] = position
+            else:
+                # The first source column wins; later ones are reported, not stacked
+                duplicates.append(str(col))
+        missing = [target for target, position in positions.items() if position is None]
+        return SchemaLayout(tuple(positions.values()), tuple(missing), tuple(unmapped), tuple(duplicates))
+
+BRUSHCARD_SCHEMA = ColumnSchema('Brushcards', [
+    ('生产日期\nProduction Date', ['生产日期', 'production date', 'prod date']),
+    ('检验日期\nInspection Date', ['检验日期', 'inspection date', 'inspect date']),
+    ('型号\nType', ['型号', 'type', 'model']),
+    ('不良部位\nDefective Part', ['不良部位', 'defective part', 'defect part']),
+    ('不良名称\nDefect Name', ['不良名称', 'defect name', 'defective name']),
+    ('数量\nQuantity', ['数量', 'quantity', 'qty']),
+    ('处理方式\nHandling method', ['处理方式', 'handling method', 'handling']),
+    ('原因\nCause of defect', ['原因', 'cause', 'reason']),
+    ('检验站别\nInspection station', ['检验站别', 'inspection station', 'station']),
+    ('当日检数量\nInspection quantity', ['当日检数量', 'inspection quantity', 'daily inspection']),
+    ('备注\nRemark', ['备注', 'remark', 'note', 'comment'])
+])
+
+SCHEMA_REGISTRY = {schema.name: schema for schema in [BRUSHCARD_SCHEMA]}
+
+# Header signatures that did not fully match their schema, most recent last
+schema_mismatches = OrderedDict()
+schema_mismatches_lock = threading.Lock()
+
+def schema_mismatch_report(schema, layout):
+    """Describe how a resolved layout deviates from its schema, or None if it matches"""
+    if not layout.missing and not layout.duplicates:
+        return None
+    return {
+        'schema': schema.name,
+        'missing': list(layout.missing),
+        'duplicates': list(layout.duplicates),
+        'unmapped': list(layout.unmapped)
+    }
+
+def record_schema_mismatch(filename, sheet_name, report):
+    print(f"   ⚠️ Header of '{sheet_name}' in {filename} does not match {report['schema']}: "
+          f"missing {report['missing']}, duplicate {report['duplicates']}")
+    signature = json.dumps(report, ensure_ascii=False, sort_keys=True)
+    with schema_mismatches_lock:
+        entry = schema_mismatches.pop(signature, None) or {**report, 'count': 0}
+        entry.update(count=entry['count'] + 1, last_file=filename, last_sheet=sheet_name, last_seen=time.time())
+        schema_mismatches[signature] = entry
+        while len(schema_mismatches) > 200:
+            schema_mismatches.popitem(last=False)
+        if process_snapshots:
+            process_snapshots.write('mismatches', list(schema_mismatches.values()))
+
+def all_schema_mismatches():
+    """Mismatches of every worker process sharing METRICS_DIR (or of this one), most recent first"""
+    if not process_snapshots:
+        with schema_mismatches_lock:
+            return list(reversed(schema_mismatches.values()))
+    merged = {}
+    for entries in process_snapshots.read('mismatches'):
+        for entry in entries:
+            signature = json.dumps({key: entry[key] for key in ('schema', 'missing', 'duplicates', 'unmapped')},
+                                   ensure_ascii=False, sort_keys=True)
+            current = merged.get(signature)
+            if current is None:
+                merged[signature] = dict(entry)
+                continue
+            count = current['count'] + entry['count']
+            if entry['last_seen'] > current['last_seen']:
+                current.update(entry)
+            current['count'] = count
+    return sorted(merged.values(), key=lambda entry: entry['last_seen'], reverse=True)[:200]
+
+def standardize_columns(df, client_name, layout=None):
+    """Project a brushcard sheet onto the standard Brushcards columns.
+
+    Columns are taken by position without copying the frame; targets the header
+    does not provide are left empty and reported in df.attrs['schema_mismatch'].
+    layout, if given, is the resolved layout of the full sheet header and df
+    holds just its mapped columns, in target order.
+    """
+    if layout is None:
+        layout = BRUSHCARD_SCHEMA.resolve(tuple(df.columns))
+        positions = layout.positions
+    else:
+        mapped = iter(range(df.shape[1]))
+        positions = [None if position is None else next(mapped) for position in layout.positions]
+    columns = {
+        target: df.iloc[:, position] if position is not None else None
+        for target, position in zip(BRUSHCARD_COLUMNS, positions)
+    }
+    columns[CLIENT_NAME_COLUMN] = client_name
+    standardized = pd.DataFrame(columns, index=df.index, copy=False)
+
+    report = schema_mismatch_report(BRUSHCARD_SCHEMA, layout)
+    if report:
+        standardized.attrs['schema_mismatch'] = report
+    return standardized
+
+# === Kunshan helpers ===
+# Fixed sheet names mapping
+KUNSHAN_SHEET_MAPPING = {
+    "Date": "WindingStationRodChoke",
+    "Data": ["GluingStationRodChoke", "RodChokeFinalInspection", "FuseChokeFinalInspection"],
+    "Inspection data": "WindingStationFuseChoke"
+}
+
+def kunshan_columns(columns):
+    """Return (position, name) pairs for the Kunshan columns to keep.
+
+    'day' / 'inspect date' headers are renamed to 'date' and 'type' columns are dropped.
+    """
+    kept = []
+    for i, col in enumerate(columns):
+        col_lower = str(col).strip().lower()
+        if col_lower == 'type':
+            continue
+        kept.append((i, 'date' if col_lower in ['day', 'inspect date'] else col))
+    return kept
+
+# === Dtype normalization ===
+# Header rules for the compact dtype of a combined column. Conversions only
+# happen when they are lossless, so a column with stray text keeps object dtype.
+DTYPE_SCHEMA = ColumnSchema('dtypes', [
+    ('datetime', ['日期', 'date']),
+    ('integer', ['数量', 'quantity', 'qty']),
+    ('category', ['客户名称', 'client name', '不良名称', 'defect name', 'defective name',
+                  '检验站别', 'station', 'machine'])
+])
+
+def compact_column(series, kind, infer_integers=False):
+    """Return series converted to the compact dtype of kind, or None if that would lose data"""
+    if series.dtype != object and not (kind == 'integer' and series.dtype.kind == 'f'):
+        return None
+    inferred = pd.api.types.infer_dtype(series, skipna=True)
+    if kind == 'datetime' or inferred in ('datetime', 'datetime64'):
+        if inferred not in ('datetime', 'datetime64', 'date', 'empty'):
+            return None
+        try:
+            return pd.to_datetime(series)
+        except (ValueError, TypeError, OverflowError):
+            # Out of bounds for datetime64
+            return None
+    if kind == 'integer' or infer_integers:
+        if inferred in ('integer', 'empty'):
+            try:
+                return series.astype('Int64')
+            except OverflowError:
+                # Beyond int64
+                return None
+        if inferred in ('floating', 'mixed-integer-float'):
+            values = pd.to_numeric(series)
+            present = values.dropna()
+            if (present % 1 == 0).all() and (present.abs() < 2 ** 63).all():
+                return values.astype('Int64')
+        if kind == 'integer':
+            return None
+    if kind == 'category' and inferred in ('string', 'empty'):
+        return series.astype('category')
+    return None
+
+def normalize_dtypes(df, infer_integers=False):
+    """Convert date, quantity and label columns of df to compact dtypes in place.
+
+    Dates become datetime64, quantities nullable Int64 and client, defect and
+    station names categoricals; with infer_integers every all-integer column
+    becomes Int64 too. Returns (bytes before, bytes after) of the converted
+    columns, which is also kept in df.attrs['dtype_savings'].
+    """
+    before = after = 0
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        converted = compact_column(series, DTYPE_SCHEMA.match(df.columns[position]), infer_integers)
+        if converted is None:
+            continue
+        before += series.memory_usage(deep=True, index=False)
+        after += converted.memory_usage(deep=True, index=False)
+        df.isetitem(position, converted)
+    df.attrs['dtype_savings'] = (before, after)
+    return before, after
+
+def report_dtype_savings(sheet_name, before, after):
+    if after < before:
+        detail(f"   💾 {sheet_name}: typed columns use {after / 2**20:.1f} MiB instead of "
+              f"{before / 2**20:.1f} MiB ({before - after:,} bytes saved)")
 
 # === Scheduled Job ===
 @scheduler.task('interval', id='cleanup_job', minutes=10, misfire_grace_time=300)
 def scheduled_cleanup():
-    print("⏱️ Running scheduled Excel temp file cleanup...")
-    delete_excel_temp_files()
-
-# === Excel Processing Logic ===
-def process_excel_files(uploaded_files, sheet_names_list, new_sheet_names_list=None, plant=None):
-    from openpyxl import load_workbook
-    import pandas as pd
-    from io import BytesIO
-
-    combined_output = BytesIO()
-
-    if plant == "anhui":
-        def extract_client_name(filename, sheet_name=None):
-            """Extract client name from filename or sheet name"""
-            # Remove file extension and path
-            base_name = filename.rsplit('.', 1)[0] if '.' in filename else filename
-
-            # For chokes file
-            if 'Quality follow-up Chokes' in base_name or 'choke' in base_name.lower():
-                return 'Chokes'
-
-            # For brushcard files like "Kelier 2025质量汇总表.xlsx"
-            if '质量汇总表' in base_name:
-                # Remove "2025质量汇总表" and "质量汇总表" to get client name
-                client_name = base_name.replace(' 2025质量汇总表', '').strip()
-                client_name = client_name.replace('2025质量汇总表', '').strip()
-                client_name = client_name.replace(' 质量汇总表', '').strip()
-                client_name = client_name.replace('质量汇总表', '').strip()
-                return client_name
-
-            # If sheet name is provided and contains 质量汇总表
-            if sheet_name and '质量汇总表' in sheet_name:
-                client_name = sheet_name.replace('质量汇总表', '').strip()
-                return client_name
-
-            return base_name
-
-        def standardize_columns(df, client_name):
-            """Standardize column names to match the required format"""
-
-            # Define the target column mapping
-            target_columns = {
-                '生产日期\nProduction Date': '生产日期\nProduction Date',
-                '检验日期\nInspection Date': '检验日期\nInspection Date',
-                '型号\nType': '型号\nType',
-                '不良部位\nDefective Part': '不良部位\nDefective Part',
-                '不良名称\nDefect Name': '不良名称\nDefect Name',
-                '数量\nQuantity': '数量\nQuantity',
-                '处理方式\nHandling method': '处理方式\nHandling method',
-                '原因\nCause of defect': '原因\nCause of defect',
-                '检验站别\nInspection station': '检验站别\nInspection station',
-                '当日检数量\nInspection quantity': '当日检数量\nInspection quantity',
-                '备注\nRemark': '备注\nRemark'
-            }
-
-            # Create a copy of the dataframe
-            df_copy = df.copy()
-
-            # Add client name column
-            df_copy['客户名称\nClient Name'] = client_name
-
-            # Try to map existing columns to target columns
-            column_mapping = {}
-
-            for col in df_copy.columns:
-                col_str = str(col).strip()
+    print("⏱️ Running scheduled cleanup...")
+    store = get_result_store()
+    if store:
+        store.evict()
+    delete_expired_jobs()
+
+SCHEDULER_LEADER_RETRY_SECONDS = 15
+_scheduler_lock = None
+
+def start_scheduler_leader(lock_path=None):
+    """Run the scheduled jobs in exactly one of several worker processes.
+
+    Every worker calls this once after it starts. Whichever takes the lock file
+    starts the scheduler and keeps the lock until it exits; the others keep
+    trying in the background, so the jobs move to another worker when the owner
+    is recycled.
+    """
+    global _scheduler_lock
+    _scheduler_lock = FileLock(lock_path or app.config['SCHEDULER_LOCK_FILE'])
+
+    def claim():
+        while not _scheduler_lock.acquire(blocking=False):
+            time.sleep(SCHEDULER_LEADER_RETRY_SECONDS)
+        print(f"⏱️ Worker {os.getpid()} owns the scheduled jobs")
+        scheduler.start()
+
+    threading.Thread(target=claim, name='scheduler-leader', daemon=True).start()
+
+# === Progress ===
+class CombineProgress:
+    """Counters for a running combine: files and sheets done, rows so far.
+
+    failed counts the files and sheets that could not be read, parsed or
+    written; their rows are missing from the output. callback, if given,
+    receives a snapshot of the counters after every update.
+    """
+    FIELDS = ('files_total', 'files_done', 'sheets_total', 'sheets_done', 'rows', 'failed')
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **deltas):
+        for key, value in deltas.items():
+            self.counts[key] += value
+        if self.callback:
+            self.callback(dict(self.counts))
+
+# === Metrics ===
+# Counters and histograms, served by /metrics in the Prometheus text exposition
+# format. With METRICS_DIR set, every process also writes its samples to its own
+# file there about once a second, and /metrics adds up the files of all processes,
+# those of recycled workers included, so counts don't depend on which worker
+# answers the scrape.
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class ProcessSnapshots:
+    """JSON state files in a directory shared by worker processes, one per process and kind.
+
+    A file is named after the process id and a random token, so a new process
+    that reuses the id of a stopped one never overwrites its counts.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pid = None
+        self.token = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, kind):
+        if self.pid != os.getpid():
+            self.pid, self.token = os.getpid(), uuid.uuid4().hex[:8]
+        return os.path.join(self.directory, f"{kind}-{self.pid}-{self.token}.json")
+
+    def write(self, kind, data):
+        path = self.path(kind)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print(f"❌ Could not write {kind} to {self.directory}: {e}")
+
+    def read(self, kind):
+        """The data every process wrote for kind"""
+        for name in os.listdir(self.directory):
+            if not (name.startswith(kind + '-') and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                # Removed, or replaced while being read; its next write has the counts
+                continue
+
+class MetricsRegistry:
+    """Counters and histograms keyed by label set, rendered as Prometheus text.
+
+    With snapshots, updates only mark the registry dirty; a background thread
+    writes the snapshot every flush_interval seconds. Call flush() before the
+    process exits so its last updates are not lost.
+    """
+
+    def __init__(self, prefix, snapshots=None, flush_interval=1.0):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.metrics = OrderedDict()
+        self.snapshots = snapshots
+        self.flush_interval = flush_interval
+        self.dirty = False
+        self.flusher = None
+
+    def declare(self, name, metric_type, help_text, buckets=None):
+        self.metrics[name] = {'type': metric_type, 'help': help_text, 'buckets': buckets, 'samples': {}}
+
+    def reset(self):
+        """Forget the samples a forked worker inherited from its parent.
+
+        Runs in the new child, where the lock may have been taken by a parent
+        thread that does not exist there, so it gets a new one.
+        """
+        self.lock = threading.Lock()
+        # Only the forking thread survives, so the child starts a flusher of its own
+        self.flusher = None
+        self.dirty = False
+        for metric in self.metrics.values():
+            metric['samples'] = {}
+
+    def share(self):
+        """Mark this process's samples as changed; call with the lock held"""
+        if not self.snapshots:
+            return
+        self.dirty = True
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self.flush_periodically, name='metrics-flush', daemon=True)
+            self.flusher.start()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's samples to its snapshot file if they changed since the last write"""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.snapshots.write('metrics', {
+                name: [[list(labels), sample] for labels, sample in metric['samples'].items()]
+                for name, metric in self.metrics.items()
+            })
 
-                # Direct matches
-                if col_str in target_columns:
-                    column_mapping[col] = target_columns[col_str]
+    def inc(self, name, value=1, **labels):
+        samples = self.metrics[name]['samples']
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples[key] = samples.get(key, 0) + value
+            self.share()
+
+    def observe(self, name, value, **labels):
+        metric = self.metrics[name]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            sample = metric['samples'].get(key)
+            if sample is None:
+                sample = metric['samples'][key] = {'buckets': [0] * len(metric['buckets']), 'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(metric['buckets'], value)
+            if index < len(metric['buckets']):
+                sample['buckets'][index] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+            self.share()
+
+    def total(self, name):
+        """Sum of a counter over all its label sets, in this process"""
+        with self.lock:
+            return sum(self.metrics[name]['samples'].values())
+
+    def collect(self):
+        """{name: {labels: sample}} of this process, or summed over every process sharing the snapshots"""
+        if not self.snapshots:
+            return {name: dict(metric['samples']) for name, metric in self.metrics.items()}
+        merged = {name: {} for name in self.metrics}
+        for snapshot in self.snapshots.read('metrics'):
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None:
                     continue
+                for labels, sample in samples:
+                    key = tuple(tuple(label) for label in labels)
+                    current = merged[name].get(key)
+                    if metric['type'] != 'histogram':
+                        merged[name][key] = (current or 0) + sample
+                    elif current is None:
+                        merged[name][key] = sample
+                    elif len(current['buckets']) == len(sample['buckets']):
+                        current['buckets'] = [a + b for a, b in zip(current['buckets'], sample['buckets'])]
+                        current['sum'] += sample['sum']
+                        current['count'] += sample['count']
+        return merged
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in labels)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+    def render(self):
+        lines = []
+        # Include this process's latest updates in the files collect() reads
+        self.flush()
+        with self.lock:
+            collected = self.collect()
+            for name, metric in self.metrics.items():
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {metric['help']}")
+                lines.append(f"# TYPE {full_name} {metric['type']}")
+                for labels, sample in collected[name].items():
+                    if metric['type'] != 'histogram':
+                        lines.append(f"{full_name}{self.format_labels(labels)} {sample}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric['buckets'], sample['buckets']):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{self.format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{full_name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {sample['count']}")
+                    lines.append(f"{full_name}_sum{self.format_labels(labels)} {sample['sum']}")
+                    lines.append(f"{full_name}_count{self.format_labels(labels)} {sample['count']}")
+        return '\n'.join(lines) + '\n'
+
+process_snapshots = ProcessSnapshots(app.config['METRICS_DIR']) if app.config['METRICS_DIR'] else None
+metrics = MetricsRegistry('excel_combiner', process_snapshots)
+metrics.declare('combines_total', 'counter', 'Combine requests by plant, mode and outcome.')
+metrics.declare('combine_seconds', 'histogram', 'Wall time of a whole combine.', TIME_BUCKETS)
+metrics.declare('stage_seconds', 'histogram', 'Time spent per combine in each stage (read, parse, load, transform, write).', TIME_BUCKETS)
+metrics.declare('file_read_seconds', 'histogram', 'Time to read and index one uploaded workbook.', TIME_BUCKETS)
+metrics.declare('sheet_parse_seconds', 'histogram', 'Time to parse one sheet, or to fetch it from the parse cache.', TIME_BUCKETS)
+metrics.declare('sheet_write_seconds', 'histogram', 'Time to write one output sheet.', TIME_BUCKETS)
+metrics.declare('rows_total', 'counter', 'Data rows parsed or served from the parse cache, by sheet kind.')
+metrics.declare('rows_written_total', 'counter', 'Rows written to combined workbooks.')
+metrics.declare('bytes_in_total', 'counter', 'Bytes of uploaded workbooks read.')
+metrics.declare('bytes_out_total', 'counter', 'Bytes of combined workbooks produced.')
+metrics.declare('duplicate_rows_total', 'counter', 'Rows dropped as repeats of rows in other uploaded files, by output sheet.')
+metrics.declare('warmup_seconds', 'histogram', 'Time to load the Excel stack and parse and write the warm-up workbook, by outcome.', TIME_BUCKETS)
+metrics.declare('result_requests_total', 'counter', 'Combine requests answered from the result store (hit, not_modified) or combined (miss).')
+
+def reset_forked_state():
+    """A forked worker starts its own counts; its parent's stay in the parent's files"""
+    global schema_mismatches_lock
+    metrics.reset()
+    schema_mismatches_lock = threading.Lock()
+    schema_mismatches.clear()
+
+if process_snapshots and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_forked_state)
+
+def detail(message):
+    """Print per-file / per-sheet progress, only when COMBINE_VERBOSE_LOG is on"""
+    if app.config['COMBINE_VERBOSE_LOG']:
+        print(message)
+
+class CombineTimer:
+    """Stage timings, row and byte counts of one combine request.
+
+    finish() records them in the metrics registry and prints a one-line summary.
+    """
+
+    def __init__(self, plant, mode):
+        self.plant = plant
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.rows = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def stage(self, stage, exclude=()):
+        """Time a block as stage, minus what the excluded stages accrue inside it"""
+        return StageTimer(self, stage, exclude)
+
+    def timed(self, iterable, stage):
+        """Yield from iterable, charging the time spent producing each item to stage"""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - started)
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+    def file_read(self, seconds, size):
+        self.bytes_in += size
+        metrics.observe('file_read_seconds', seconds, plant=self.plant)
+
+    def finish(self, status='ok'):
+        total = time.perf_counter() - self.started
+        for stage, seconds in self.stages.items():
+            metrics.observe('stage_seconds', seconds, plant=self.plant, stage=stage)
+        metrics.observe('combine_seconds', total, plant=self.plant, mode=self.mode)
+        metrics.inc('combines_total', plant=self.plant, mode=self.mode, status=status)
+        metrics.inc('bytes_in_total', self.bytes_in, plant=self.plant)
+        metrics.inc('bytes_out_total', self.bytes_out, plant=self.plant)
+        stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stages.items())
+        print(f"⏱️ {self.plant} {self.mode} combine {status} in {total:.2f}s ({stages}); "
+              f"{self.rows} rows, {self.bytes_in:,} bytes in, {self.bytes_out:,} bytes out")
+
+class StageTimer:
+    def __init__(self, timer, stage, exclude=()):
+        self.timer = timer
+        self.stage = stage
+        self.exclude = exclude
+
+    def excluded(self):
+        return sum(self.timer.stages.get(stage, 0.0) for stage in self.exclude)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.excluded_before = self.excluded()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started - (self.excluded() - self.excluded_before)
+        self.timer.add(self.stage, max(0.0, elapsed))
+        return False
+
+class TimedWriter:
+    """Output writer proxy that charges write_frame/append_rows time to the write stage"""
+
+    def __init__(self, writer, timer):
+        self.writer = writer
+        self.timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+    def write_frame(self, sheet_name, df):
+        started = time.perf_counter()
+        self.writer.write_frame(sheet_name, df)
+        elapsed = time.perf_counter() - started
+        self.timer.add('write', elapsed)
+        self.timer.rows += len(df)
+        metrics.observe('sheet_write_seconds', elapsed, plant=self.timer.plant)
+        metrics.inc('rows_written_total', len(df), plant=self.timer.plant)
+
+    def append_rows(self, sheet_name, rows):
+        started = time.perf_counter()
+        self.writer.append_rows(sheet_name, rows)
+        self.timer.add('write', time.perf_counter() - started)
+        self.timer.rows += len(rows)
+        metrics.inc('rows_written_total', len(rows), plant=self.timer.plant)
+
+    def close(self):
+        with self.timer.stage('write'):
+            self.writer.close()
+
+# === Output engines ===
+def new_output_buffer():
+    """Spooled temp file for the combined workbook; rolls over to disk past OUTPUT_SPOOL_MAX_SIZE"""
+    return tempfile.SpooledTemporaryFile(max_size=app.config['OUTPUT_SPOOL_MAX_SIZE'])
+
+class FrameWriterMixin:
+    """write_frame() on top of add_sheet()/append_rows(), one batch of rows at a time"""
+
+    def write_frame(self, sheet_name, df, batch_size=None):
+        batch_size = batch_size or app.config['STREAM_BATCH_SIZE']
+        if sheet_name not in self.sheets:
+            self.add_sheet(sheet_name, [None if pd.isna(col) else col for col in df.columns])
+        for start in range(0, len(df), batch_size):
+            chunk = df.iloc[start:start + batch_size].astype(object)
+            chunk = chunk.where(chunk.notna(), None)
+            self.append_rows(sheet_name, chunk.itertuples(index=False, name=None))
+
+class PandasSheetWriter:
+    """pd.ExcelWriter (openpyxl engine) behind the output writer interface"""
+
+    def __init__(self, output):
+        self.writer = pd.ExcelWriter(output, engine='openpyxl')
+
+    @property
+    def sheets(self):
+        return self.writer.sheets
+
+    def write_frame(self, sheet_name, df):
+        df.to_excel(self.writer, sheet_name=sheet_name, index=False)
+
+    def close(self):
+        self.writer.close()
+
+class XlsxStreamWriter(FrameWriterMixin):
+    """Row-streaming workbook writer backed by XlsxWriter's constant_memory mode.
+
+    Each sheet is flushed to a temp file row by row, so only the current row is held in memory.
+    """
+
+    def __init__(self, output):
+        import xlsxwriter
+        self.workbook = xlsxwriter.Workbook(output, {
+            'constant_memory': True,
+            'strings_to_urls': False,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+        })
+        self.header_format = self.workbook.add_format({
+            'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'
+        })
+        self.sheets = {}
+        self.next_row = {}
+
+    def add_sheet(self, sheet_name, columns):
+        worksheet = self.workbook.add_worksheet(sheet_name[:31])
+        worksheet.write_row(0, 0, list(columns), self.header_format)
+        self.sheets[sheet_name] = worksheet
+        self.next_row[sheet_name] = 1
+
+    def append_rows(self, sheet_name, rows):
+        worksheet = self.sheets[sheet_name]
+        row_index = self.next_row[sheet_name]
+        for row in rows:
+            worksheet.write_row(row_index, 0, row)
+            row_index += 1
+        self.next_row[sheet_name] = row_index
+
+    def close(self):
+        self.workbook.close()
+
+# === Export formats ===
+# For scripts and BI loaders the combined sheets can also be exported as CSV,
+# a zip of per-sheet CSVs, or Parquet, under the same sheet names as the xlsx.
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+OUTPUT_FORMATS = {
+    'xlsx': XLSX_MIMETYPE,
+    'csv': 'text/csv; charset=utf-8',
+    'zip': 'application/zip',
+    'parquet': 'application/vnd.apache.parquet'
+}
+# Accept header media types, in order of preference when the client accepts anything
+ACCEPT_FORMATS = OrderedDict([
+    (XLSX_MIMETYPE, 'xlsx'),
+    ('text/csv', 'csv'),
+    ('application/zip', 'zip'),
+    ('application/vnd.apache.parquet', 'parquet'),
+    ('application/x-parquet', 'parquet')
+])
+# Arrow-friendly inferred types of object columns; anything else is exported as text
+ARROW_OBJECT_TYPES = {'string', 'empty', 'boolean', 'integer', 'floating', 'mixed-integer-float',
+                      'datetime', 'datetime64', 'date', 'time'}
+
+def output_sheet_name(sheet_name):
+    """The name a sheet gets in the output, as Excel limits it to 31 characters"""
+    return sheet_name[:31]
+
+class TextSink:
+    """UTF-8 text adapter over a binary stream, for csv.writer"""
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, text):
+        return self.output.write(text.encode('utf-8'))
+
+class CsvSheetWriter(FrameWriterMixin):
+    """One sheet of the combined result as CSV, written straight to the output stream.
+
+    Every other sheet is accepted and dropped, so the plant logic runs unchanged.
+    """
+
+    def __init__(self, output, sheet):
+        self.csv = csv.writer(TextSink(output))
+        self.sheet = sheet
+        self.sheets = {}
+
+    def add_sheet(self, sheet_name, columns):
+        selected = output_sheet_name(sheet_name) == self.sheet
+        self.sheets[sheet_name] = selected
+        if selected:
+            self.csv.writerow(columns)
+
+    def append_rows(self, sheet_name, rows):
+        if self.sheets[sheet_name]:
+            self.csv.writerows(rows)
+
+    def write_frame(self, sheet_name, df, batch_size=None):
+        if sheet_name not in self.sheets:
+            self.add_sheet(sheet_name, [None if pd.isna(col) else col for col in df.columns])
+        if self.sheets[sheet_name]:
+            super().write_frame(sheet_name, df, batch_size)
+
+    def close(self):
+        if self.sheet not in {output_sheet_name(name) for name, selected in self.sheets.items() if selected}:
+            print(f"⚠️ Sheet '{self.sheet}' was not in the combined result; the CSV is empty")
+
+class ZipCsvWriter(FrameWriterMixin):
+    """Every sheet as <sheet>.csv in a zip archive written to the output stream.
+
+    Zip members can't interleave, so the first sheet streams straight into the
+    archive while later sheets are spooled and added once it is complete.
+    """
+
+    def __init__(self, output):
+        self.archive = zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.sheets = {}
+        self.live = None
+        self.spooled = OrderedDict()
+
+    def add_sheet(self, sheet_name, columns):
+        if self.live is None:
+            self.live = target = self.archive.open(f"{output_sheet_name(sheet_name)}.csv", 'w', force_zip64=True)
+        else:
+            target = self.spooled[sheet_name] = new_output_buffer()
+        self.sheets[sheet_name] = csv.writer(TextSink(target))
+        self.sheets[sheet_name].writerow(columns)
+
+    def append_rows(self, sheet_name, rows):
+        self.sheets[sheet_name].writerows(rows)
+
+    def close(self):
+        if self.live is not None:
+            self.live.close()
+        for sheet_name, spool in self.spooled.items():
+            spool.seek(0)
+            with self.archive.open(f"{output_sheet_name(sheet_name)}.csv", 'w', force_zip64=True) as member:
+                shutil.copyfileobj(spool, member, SPOOL_CHUNK_SIZE)
+            spool.close()
+        self.archive.close()
+
+def column_names(labels):
+    """Unique string column names for Arrow, named like pd.read_excel names blank headers"""
+    names = []
+    seen = set()
+    for i, label in enumerate(labels):
+        name = f"Unnamed: {i}" if label is None or (not isinstance(label, str) and pd.isna(label)) else str(label)
+        while name in seen:
+            name = f"{name}.{i}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+def arrow_table(df):
+    """Arrow table of an output frame: mixed-type object columns as text, categoricals decoded"""
+    import pyarrow as pa
+
+    columns = {}
+    for name, position in zip(column_names(df.columns), range(df.shape[1])):
+        series = df.iloc[:, position]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        elif series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) not in ARROW_OBJECT_TYPES:
+            series = series.map(lambda value: value if pd.isna(value) else str(value))
+        columns[name] = series.reset_index(drop=True)
+    table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index=False).replace_schema_metadata(None)
+    # All-empty columns have no type yet; take them as text so later rows can fill them
+    fields = [pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+              for field in table.schema]
+    return table.cast(pa.schema(fields))
+
+def conform_table(table, schema):
+    """Cast table to the schema of the sheet's first row group, matching columns by name"""
+    import pyarrow as pa
+
+    if table.schema.equals(schema):
+        return table
+    arrays = []
+    for field in schema:
+        if field.name not in table.column_names:
+            arrays.append(pa.nulls(table.num_rows, field.type))
+            continue
+        column = table[field.name]
+        try:
+            arrays.append(column.cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            if not pa.types.is_string(field.type):
+                raise ValueError(f"Column '{field.name}' is {column.type} here but {field.type} "
+                                 "in an earlier file; export this sheet as xlsx or csv")
+            arrays.append(pa.array(column.to_pandas().map(lambda value: value if pd.isna(value) else str(value)),
+                                   type=pa.string()))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+class ParquetSheetWriter:
+    """Sheets as Parquet: one file streamed to the output for a selected sheet,
+    otherwise a zip of <sheet>.parquet files. Each write_frame() is a row group.
+    """
+
+    def __init__(self, output, sheet=None):
+        self.output = output
+        self.sheet = sheet
+        # Parquet pages are already compressed
+        self.archive = None if sheet else zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED)
+        self.sheets = OrderedDict()
+
+    def selected(self, sheet_name):
+        return self.sheet is None or output_sheet_name(sheet_name) == self.sheet
+
+    def add_sheet(self, sheet_name, columns):
+        self.sheets[sheet_name] = {'columns': list(columns), 'writer': None, 'target': None}
+
+    def write_table(self, sheet_name, table):
+        import pyarrow.parquet as pq
+
+        entry = self.sheets[sheet_name]
+        if entry['writer'] is None:
+            entry['target'] = self.output if self.archive is None else new_output_buffer()
+            entry['writer'] = pq.ParquetWriter(entry['target'], table.schema, compression='snappy')
+        else:
+            table = conform_table(table, entry['writer'].schema)
+        entry['writer'].write_table(table)
+
+    def write_frame(self, sheet_name, df):
+        if sheet_name not in self.sheets:
+            self.add_sheet(sheet_name, df.columns)
+        if self.selected(sheet_name):
+            self.write_table(sheet_name, arrow_table(df))
+
+    def append_rows(self, sheet_name, rows):
+        if self.selected(sheet_name):
+            columns = self.sheets[sheet_name]['columns']
+            frame = pd.DataFrame(list(rows), columns=range(len(columns)))
+            frame.columns = columns
+            self.write_table(sheet_name, arrow_table(frame))
+
+    def close(self):
+        for sheet_name, entry in self.sheets.items():
+            if not self.selected(sheet_name):
+                continue
+            if entry['writer'] is None:
+                # A sheet with a header and no rows
+                self.write_table(sheet_name, arrow_table(pd.DataFrame(columns=entry['columns'])))
+            entry['writer'].close()
+            if self.archive is not None:
+                entry['target'].seek(0)
+                with self.archive.open(f"{output_sheet_name(sheet_name)}.parquet", 'w', force_zip64=True) as member:
+                    shutil.copyfileobj(entry['target'], member, SPOOL_CHUNK_SIZE)
+                entry['target'].close()
+        if self.archive is not None:
+            self.archive.close()
+
+class ChunkQueueSink(io.RawIOBase):
+    """Write-only stream whose bytes are handed to a response generator in chunks.
+
+    The queue is bounded, so a slow client slows the combine down instead of
+    letting the output pile up in memory; cancel() makes further writes fail.
+    """
+
+    def __init__(self, chunk_size=64 * 1024, max_chunks=64):
+        super().__init__()
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.position = 0
+        self.cancelled = threading.Event()
+        self.error = None
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= self.chunk_size:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise BrokenPipeError("The client went away")
+            try:
+                self.chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def finish(self):
+        """Hand over what is buffered and mark the end of the stream"""
+        if self.buffer and not self.cancelled.is_set():
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+        self.put(None)
+
+    def fail(self, error):
+        """End the stream without what is buffered; the reader raises error"""
+        self.error = error
+        self.buffer.clear()
+        self.put(None)
+
+    def cancel(self):
+        self.cancelled.set()
+
+def stream_output(produce):
+    """Generator of the bytes produce(output) writes, run in a background thread.
+
+    The first chunks go out while produce() is still combining. An error after
+    that is raised from the generator, so the server aborts the response instead
+    of ending it as if the truncated body were complete.
+    """
+    sink = ChunkQueueSink()
+
+    def run():
+        try:
+            try:
+                produce(sink)
+            except BrokenPipeError:
+                return
+            except Exception as e:
+                print(f"❌ Streamed export failed: {e}")
+                sink.fail(e)
+                return
+            sink.finish()
+        except BrokenPipeError:
+            pass
+
+    worker = threading.Thread(target=run, name='export-stream', daemon=True)
+    worker.start()
+    try:
+        while True:
+            chunk = sink.chunks.get()
+            if chunk is None:
+                if sink.error is not None:
+                    raise sink.error
+                return
+            yield chunk
+    finally:
+        sink.cancel()
+        worker.join()
+
+def create_output_writer(output, engine=None, streaming=False, output_format='xlsx', sheet=None):
+    """Pick the writer for the output format; xlsx uses the configured OUTPUT_ENGINE"""
+    if output_format == 'csv':
+        return CsvSheetWriter(output, sheet)
+    if output_format == 'zip':
+        return ZipCsvWriter(output)
+    if output_format == 'parquet':
+        return ParquetSheetWriter(output, sheet)
+    engine = engine or app.config['OUTPUT_ENGINE']
+    if engine == 'xlsxwriter':
+        return XlsxStreamWriter(output)
+    if streaming:
+        return OpenpyxlStreamWriter(output)
+    return PandasSheetWriter(output)
+
+# === Streaming pipeline ===
+# Rows move from a read-only sheet iterator to the output sheet in fixed-size
+# batches, so memory stays flat regardless of how many files/rows are uploaded.
+class OpenpyxlStreamWriter(FrameWriterMixin):
+    """Row-streaming workbook writer backed by openpyxl's write-only mode"""
+
+    def __init__(self, output):
+        from openpyxl import Workbook
+        self.output = output
+        self.workbook = Workbook(write_only=True)
+        self.sheets = {}
+
+    def add_sheet(self, sheet_name, columns):
+        worksheet = self.workbook.create_sheet(title=sheet_name[:31])
+        worksheet.append(list(columns))
+        self.sheets[sheet_name] = worksheet
+
+    def append_rows(self, sheet_name, rows):
+        worksheet = self.sheets[sheet_name]
+        for row in rows:
+            worksheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.output)
+
+def iter_batches(rows, batch_size):
+    """Group a row iterator into lists of at most batch_size rows"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def header_names(row):
+    """Build column names from a header row the way pd.read_excel does"""
+    names = []
+    seen = {}
+    for i, value in enumerate(clean_row(row)):
+        name = f"Unnamed: {i}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
 
-                # Fuzzy matching for common variations
-                col_lower = col_str.lower()
-
-                if any(x in col_lower for x in ['生产日期', 'production date', 'prod date']):
-                    column_mapping[col] = '生产日期\nProduction Date'
-                elif any(x in col_lower for x in ['检验日期', 'inspection date', 'inspect date']):
-                    column_mapping[col] = '检验日期\nInspection Date'
-                elif any(x in col_lower for x in ['型号', 'type', 'model']):
-                    column_mapping[col] = '型号\nType'
-                elif any(x in col_lower for x in ['不良部位', 'defective part', 'defect part']):
-                    column_mapping[col] = '不良部位\nDefective Part'
-                elif any(x in col_lower for x in ['不良名称', 'defect name', 'defective name']):
-                    column_mapping[col] = '不良名称\nDefect Name'
-                elif any(x in col_lower for x in ['数量', 'quantity', 'qty']):
-                    column_mapping[col] = '数量\nQuantity'
-                elif any(x in col_lower for x in ['处理方式', 'handling method', 'handling']):
-                    column_mapping[col] = '处理方式\nHandling method'
-                elif any(x in col_lower for x in ['原因', 'cause', 'reason']):
-                    column_mapping[col] = '原因\nCause of defect'
-                elif any(x in col_lower for x in ['检验站别', 'inspection station', 'station']):
-                    column_mapping[col] = '检验站别\nInspection station'
-                elif any(x in col_lower for x in ['当日检数量', 'inspection quantity', 'daily inspection']):
-                    column_mapping[col] = '当日检数量\nInspection quantity'
-                elif any(x in col_lower for x in ['备注', 'remark', 'note', 'comment']):
-                    column_mapping[col] = '备注\nRemark'
-
-            # Rename columns
-            df_copy = df_copy.rename(columns=column_mapping)
-
-            # Ensure all target columns exist (add empty ones if missing)
-            all_target_cols = list(target_columns.values()) + ['客户名称\nClient Name']
-            for col in all_target_cols:
-                if col not in df_copy.columns:
-                    df_copy[col] = ''
-
-            # Reorder columns
-            df_copy = df_copy[all_target_cols]
-
-            return df_copy
-
-        brushcard_final = []
-        chokes_final = []
-        sheets_written = 0
+# Cell values pd.read_excel turns into NaN: Excel error codes and its default NA strings
+MISSING_VALUES = frozenset([
+    '', '#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A', '#N/A N/A', '#NA',
+    '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL',
+    'NaN', 'None', 'n/a', 'nan', 'null'
+])
 
-        print(f"🔍 Processing {len(uploaded_files)} files for Anhui plant...")
+def clean_row(row):
+    """Replace missing-value markers with None, matching pd.read_excel"""
+    return tuple(None if isinstance(value, str) and value in MISSING_VALUES else value for value in row)
 
-        for file in uploaded_files:
-            if file and allowed_file(file.filename):
-                try:
-                    filename = file.filename
-                    print(f"📂 Processing file: {filename}")
-                    file_stream = BytesIO(file.read())
-                    xls = pd.ExcelFile(file_stream, engine='openpyxl')
-                    is_choke = "choke" in filename.lower() or "chocke" in filename.lower()
-                    print(f"   📋 Available sheets: {xls.sheet_names}")
-                    print(f"   🔧 Is choke file: {is_choke}")
-
-                    if is_choke:
-                        # Process chokes data
-                        if 'Inspection data' in xls.sheet_names:
-                            try:
-                                df = pd.read_excel(xls, sheet_name='Inspection data', engine='openpyxl')
-                                print(f"   ✅ Loaded {len(df)} rows from Inspection data sheet")
+def is_empty_row(row):
+    return all(value is None for value in row)
 
-                                # Remove empty rows
-                                df = df.dropna(how='all')
+def open_read_only(file):
+    from openpyxl import load_workbook
+    file.stream.seek(0)
+    return load_workbook(file.stream, read_only=True, data_only=True)
+
+def worksheet_names(workbook):
+    # Chartsheets have no cells; pd.ExcelFile.sheet_names leaves them out too
+    return [worksheet.title for worksheet in workbook.worksheets]
+
+def stream_kunshan_files(uploaded_files, writer, batch_size, progress):
+    """Stream the mapped Kunshan sheets into writer, one batch at a time.
+
+    Like the batch path, files that map to the same output sheet follow each
+    other in upload order under the union of their headers, columns matched by
+    name (see align_columns).
+    """
+    # First pass: plan each file's sheets and read only their header rows, so
+    # every output sheet's header is known before any rows are written
+    data_sheet_counter = 0
+    plans = []
+    headers = OrderedDict()
+    files = [file for file in uploaded_files if file and allowed_file(file.filename)]
+    for file in files:
+        filename = file.filename
+        try:
+            workbook = open_read_only(file)
+        except Exception as e:
+            print(f"❌ Error processing file {filename}: {e}")
+            progress.add(failed=1)
+            continue
+
+        try:
+            file_tasks, data_sheet_counter = plan_kunshan_tasks(filename, worksheet_names(workbook), data_sheet_counter)
+            for sheet_name, new_sheet_name in file_tasks:
+                # Skip the two preamble rows and promote the next one to header
+                preamble = list(islice(workbook[sheet_name].iter_rows(values_only=True), 3))
+                if len(preamble) < 3:
+                    detail(f"   ⏭️ Skipping sheet '{sheet_name.strip()}' in {filename} (no header row)")
+                    continue
+                kept = kunshan_columns(clean_row(preamble[2]))
+                slots = column_slots([name for _, name in kept])
+                # Ensure sheet name is within Excel limits (31 characters)
+                header = headers.setdefault(new_sheet_name[:31], OrderedDict())
+                for slot, (_, name) in zip(slots, kept):
+                    header.setdefault(slot, name)
+                plans.append((file, sheet_name, new_sheet_name[:31], dict(zip(slots, (i for i, _ in kept)))))
+        finally:
+            workbook.close()
+
+    for final_sheet_name, header in headers.items():
+        writer.add_sheet(final_sheet_name, list(header.values()))
+    planned_files = {id(plan[0]) for plan in plans}
+    progress.add(files_total=len(files), files_done=len(files) - len(planned_files), sheets_total=len(plans))
+
+    # Second pass: stream the data rows, each file's kept columns placed under the output header
+    workbook = None
+    current_file = None
+    try:
+        for file, sheet_name, final_sheet_name, sources in plans:
+            if file is not current_file:
+                if workbook is not None:
+                    workbook.close()
+                    progress.add(files_done=1)
+                workbook = open_read_only(file)
+                current_file = file
+                detail(f"📂 Streaming file: {file.filename}")
+
+            sheet_name_clean = sheet_name.strip()
+            positions = [sources.get(slot) for slot in headers[final_sheet_name]]
+            try:
+                rows = islice(workbook[sheet_name].iter_rows(values_only=True), 3, None)
+
+                # Hold back blank rows until a non-blank row follows, so trailing
+                # blank rows are dropped like pd.read_excel does
+                pending_blank = []
+                row_count = 0
+                for batch in iter_batches(rows, batch_size):
+                    out = []
+                    for row in batch:
+                        row = clean_row(row)
+                        projected = tuple(row[i] if i is not None and i < len(row) else None for i in positions)
+                        if is_empty_row(row):
+                            pending_blank.append(projected)
+                            continue
+                        if pending_blank:
+                            out.extend(pending_blank)
+                            pending_blank = []
+                        out.append(projected)
+                    writer.append_rows(final_sheet_name, out)
+                    row_count += len(out)
+                    progress.add(rows=len(out))
+
+                detail(f"   ✅ Streamed {row_count} rows into '{final_sheet_name}'")
+            except Exception as e:
+                print(f"   ❌ Error processing sheet '{sheet_name_clean}' in {file.filename}: {e}")
+                progress.add(failed=1)
+            progress.add(sheets_done=1)
+    finally:
+        if workbook is not None:
+            workbook.close()
+            progress.add(files_done=1)
+
+    if not writer.sheets:
+        print("⚠️ No sheets were processed successfully. Creating summary sheet.")
+        writer.add_sheet("Summary", ["Status", "Message", "Expected_Sheets", "Files_Processed"])
+        writer.append_rows("Summary", [(
+            "No Data Processed",
+            "No valid sheets found matching the predefined mapping",
+            "Date, Data (multiple), Inspection data",
+            len(uploaded_files)
+        )])
+
+def stream_anhui_files(uploaded_files, writer, batch_size, progress):
+    """Stream Anhui choke and brushcard rows into the Chokes/Brushcards sheets"""
+    # First pass: resolve which sheets each file contributes and read only their
+    # header rows, so the Chokes header (union of all choke layouts) is known upfront
+    plans = []
+    chokes_columns = []
+    files = [file for file in uploaded_files if file and allowed_file(file.filename)]
+    for file in files:
+        filename = file.filename
+        try:
+            workbook = open_read_only(file)
+        except Exception as e:
+            print(f"❌ Failed to read file {filename}: {e}")
+            progress.add(failed=1)
+            continue
+
+        try:
+            for sheet_name, kind in plan_anhui_tasks(filename, worksheet_names(workbook)):
+                is_choke = kind == 'chokes'
+                header = next(workbook[sheet_name].iter_rows(max_row=1, values_only=True), None)
+                if header is None:
+                    continue
+                columns = header_names(header)
+                plans.append((file, is_choke, sheet_name, columns))
+                if is_choke:
+                    for col in columns + [CLIENT_NAME_COLUMN]:
+                        if col not in chokes_columns:
+                            chokes_columns.append(col)
+        finally:
+            workbook.close()
+
+    writer.add_sheet('Chokes', chokes_columns or [CLIENT_NAME_COLUMN])
+    writer.add_sheet('Brushcards', BRUSHCARD_COLUMNS + [CLIENT_NAME_COLUMN])
+    planned_files = {id(plan[0]) for plan in plans}
+    progress.add(files_total=len(files), files_done=len(files) - len(planned_files), sheets_total=len(plans))
+
+    # Second pass: stream the data rows through the column projection
+    workbook = None
+    current_file = None
+    try:
+        for file, is_choke, sheet_name, columns in plans:
+            if file is not current_file:
+                if workbook is not None:
+                    workbook.close()
+                    progress.add(files_done=1)
+                workbook = open_read_only(file)
+                current_file = file
+                detail(f"📂 Streaming file: {file.filename}")
+
+            client_name = extract_client_name(file.filename, None if is_choke else sheet_name)
+            if is_choke:
+                out_sheet = 'Chokes'
+                source = {col: i for i, col in enumerate(columns)}
+                positions = [source.get(col) for col in chokes_columns]
+                missing = None
+            else:
+                out_sheet = 'Brushcards'
+                layout = BRUSHCARD_SCHEMA.resolve(tuple(columns))
+                report = schema_mismatch_report(BRUSHCARD_SCHEMA, layout)
+                if report:
+                    record_schema_mismatch(file.filename, sheet_name, report)
+                positions = list(layout.positions) + [None]
+                missing = None
+            client_position = (chokes_columns.index(CLIENT_NAME_COLUMN) if is_choke
+                               else len(BRUSHCARD_COLUMNS))
 
-                                # For chokes, keep original columns and just add client name
-                                client_name = extract_client_name(filename)
-                                df['客户名称\nClient Name'] = client_name
+            try:
+                rows = workbook[sheet_name].iter_rows(min_row=2, values_only=True)
+                row_count = 0
+                for batch in iter_batches(rows, batch_size):
+                    out = []
+                    for row in batch:
+                        row = clean_row(row)
+                        if is_empty_row(row):
+                            continue
+                        projected = [row[i] if i is not None and i < len(row) else missing
+                                     for i in positions]
+                        projected[client_position] = client_name
+                        out.append(projected)
+                    writer.append_rows(out_sheet, out)
+                    row_count += len(out)
+                    progress.add(rows=len(out))
+                detail(f"   ✅ Streamed {row_count} rows from sheet '{sheet_name}' into {out_sheet} (Client: {client_name})")
+            except Exception as e:
+                print(f"   ❌ Error processing sheet '{sheet_name}' in {file.filename}: {e}")
+                progress.add(failed=1)
+            progress.add(sheets_done=1)
+    finally:
+        if workbook is not None:
+            workbook.close()
+            progress.add(files_done=1)
+
+def stream_excel_files(uploaded_files, plant=None, batch_size=None, engine=None, progress=None, timer=None,
+                       output=None, output_format='xlsx', sheet=None):
+    """Bounded-memory variant of process_excel_files.
+
+    Nothing is materialized as a DataFrame; peak memory is one batch of rows per sheet.
+    """
+    batch_size = batch_size or app.config['STREAM_BATCH_SIZE']
+    progress = progress or CombineProgress()
+    timer = timer or CombineTimer(plant or 'kunshan', 'streaming')
+    combined_output = output if output is not None else new_output_buffer()
+    writer = TimedWriter(create_output_writer(combined_output, engine, streaming=True,
+                                              output_format=output_format, sheet=sheet), timer)
+
+    print(f"🔍 Streaming {len(uploaded_files)} files for {plant or 'kunshan'} plant (batch size {batch_size})...")
+    for file in uploaded_files:
+        # Uploads are read from their stream in place; its end offset is the size
+        timer.bytes_in += file.stream.seek(0, os.SEEK_END)
+    # Reading and projecting rows is everything append_rows did not take
+    with timer.stage('read', exclude=('write',)):
+        if plant == "anhui":
+            stream_anhui_files(uploaded_files, writer, batch_size, progress)
+        else:
+            stream_kunshan_files(uploaded_files, writer, batch_size, progress)
 
-                                if not df.empty:
-                                    chokes_final.append(df)
-                                    print(f"   📊 Added {len(df)} choke rows (Client: {client_name})")
+    writer.close()
+    timer.bytes_out = combined_output.tell()
+    if output is None:
+        combined_output.seek(0)
+    return combined_output
+
+# === Workbook reader ===
+# A lean .xlsx reader for the parse stage, in place of pd.read_excel's openpyxl
+# machinery. Sheet names come from the workbook manifest; a read parses only
+# the selected worksheet's XML, incrementally, and resolves cells through the
+# shared-strings table and the date styles of the stylesheet. Cell values come
+# out the way pd.read_excel reads them, and a read can skip leading rows and
+# convert only the projected columns.
+WORKBOOK_PART = 'xl/workbook.xml'
+WORKBOOK_RELS_PART = 'xl/_rels/workbook.xml.rels'
+# Parsed manifests, shared strings and date styles of recently read workbooks,
+# keyed by file identity, so the sheets of one upload share one load per process
+WORKBOOK_INFO_CACHE_SIZE = 8
+_workbook_info = OrderedDict()
+_workbook_info_lock = threading.Lock()
+_column_indexes = {}
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def column_index(letters):
+    """0-based index of a column from its letters ('A' -> 0)"""
+    index = _column_indexes.get(letters)
+    if index is None:
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter.upper()) - 64
+        index = _column_indexes[letters] = index - 1
+    return index
+
+def inline_text(element):
+    """Plain text of a shared or inline string: its <t>, then the <t> of each rich-text run"""
+    text = []
+    for child in element:
+        name = local_name(child.tag)
+        if name == 't':
+            text.append(child.text or '')
+        elif name == 'r':
+            for run in child:
+                if local_name(run.tag) == 't':
+                    text.append(run.text or '')
+    return ''.join(text)
+
+class WorkbookInfo:
+    """The parts of a workbook shared by all of its sheets"""
+
+    def __init__(self, archive):
+        import xml.etree.ElementTree as ET
+        from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+
+        parts = {}
+        worksheet_parts = {}
+        for rel in ET.fromstring(archive.read(WORKBOOK_RELS_PART)):
+            target = rel.get('Target', '')
+            target = target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+            rel_type = rel.get('Type', '').rsplit('/', 1)[-1]
+            if rel_type == 'worksheet':
+                worksheet_parts[rel.get('Id')] = target
+            else:
+                parts.setdefault(rel_type, target)
+
+        # Chartsheets have no cells; pd.ExcelFile.sheet_names leaves them out too
+        self.sheets = OrderedDict()
+        self.epoch = CALENDAR_WINDOWS_1900
+        for element in ET.fromstring(archive.read(WORKBOOK_PART)).iter():
+            name = local_name(element.tag)
+            if name == 'workbookPr' and element.get('date1904') not in (None, '', 'false', 'f', '0'):
+                self.epoch = CALENDAR_MAC_1904
+            elif name == 'sheet':
+                rel_id = next((value for key, value in element.attrib.items() if local_name(key) == 'id'), None)
+                if rel_id in worksheet_parts:
+                    self.sheets[element.get('name')] = worksheet_parts[rel_id]
+
+        self.shared_strings_part = parts.get('sharedStrings')
+        self.styles_part = parts.get('styles')
+        self.shared_strings = None
+        self.date_styles = None
+        self.timedelta_styles = None
+
+    def load_shared_strings(self, archive):
+        """The shared-strings table: one string per index, read once per workbook"""
+        if self.shared_strings is None:
+            import xml.etree.ElementTree as ET
+
+            strings = []
+            if self.shared_strings_part and self.shared_strings_part in archive.NameToInfo:
+                with archive.open(self.shared_strings_part) as source:
+                    for _, element in ET.iterparse(source):
+                        if local_name(element.tag) == 'si':
+                            # openpyxl drops the escape of a literal '_x' the same way
+                            strings.append(inline_text(element).replace('x005F_', ''))
+                            element.clear()
+            self.shared_strings = strings
+        return self.shared_strings
+
+    def load_styles(self, archive):
+        """Indexes of the cell styles whose number format is a date (and a duration)"""
+        if self.date_styles is None:
+            import xml.etree.ElementTree as ET
+            from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+
+            date_styles = set()
+            timedelta_styles = set()
+            if self.styles_part and self.styles_part in archive.NameToInfo:
+                root = ET.fromstring(archive.read(self.styles_part))
+                custom = {}
+                cell_formats = []
+                for element in root:
+                    name = local_name(element.tag)
+                    if name == 'numFmts':
+                        custom = {int(fmt.get('numFmtId')): fmt.get('formatCode') for fmt in element}
+                    elif name == 'cellXfs':
+                        cell_formats = [int(xf.get('numFmtId', 0)) for xf in element]
+                for index, format_id in enumerate(cell_formats):
+                    fmt = custom[format_id] if format_id in custom else builtin_format_code(format_id)
+                    if fmt is not None and is_date_format(fmt):
+                        date_styles.add(index)
+                    if fmt is not None and is_timedelta_format(fmt):
+                        timedelta_styles.add(index)
+            self.date_styles = date_styles
+            self.timedelta_styles = timedelta_styles
+        return self.date_styles, self.timedelta_styles
+
+def workbook_info(source, archive):
+    """The WorkbookInfo of an open archive, from the cache when source is a path it has seen"""
+    if not isinstance(source, str):
+        return WorkbookInfo(archive)
+    stat = os.stat(source)
+    key = (source, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _workbook_info_lock:
+        info = _workbook_info.get(key)
+        if info is not None:
+            _workbook_info.move_to_end(key)
+            return info
+    info = WorkbookInfo(archive)
+    with _workbook_info_lock:
+        _workbook_info[key] = info
+        while len(_workbook_info) > WORKBOOK_INFO_CACHE_SIZE:
+            _workbook_info.popitem(last=False)
+    return info
+
+class XlsxReader:
+    """Read-only access to the worksheets of one workbook (a path or a binary file)"""
+
+    def __init__(self, source):
+        self.archive = zipfile.ZipFile(source)
+        try:
+            self.info = workbook_info(source, self.archive)
+        except Exception:
+            self.archive.close()
+            raise
+
+    @property
+    def sheet_names(self):
+        return list(self.info.sheets)
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def iter_rows(self, sheet_name, skip_rows=0, columns=None):
+        """Yield (values, width, blank) for every row of a worksheet, from the first.
+
+        values holds the cells as pd.read_excel reads them, except that empty
+        cells are None: numbers are int when integral, date-formatted numbers
+        datetimes and error cells NaN. Missing rows are yielded as (). width is
+        the position after the last non-empty cell of the whole row (0 for an
+        empty row) and blank is True when the row holds nothing but NA markers.
+
+        The first skip_rows rows are only measured; their values are (). columns,
+        if given, is called with the values of the first row after them and
+        returns the positions to keep: that row is yielded in full, and each
+        later non-empty row as a tuple over those positions, the only cells
+        converted.
+        """
+        import xml.etree.ElementTree as ET
+        from openpyxl.utils.datetime import from_excel, from_ISO8601
+
+        if sheet_name not in self.info.sheets:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+        strings = self.info.load_shared_strings(self.archive)
+        date_styles, timedelta_styles = self.info.load_styles(self.archive)
+        epoch = self.info.epoch
+        nan = np.nan
+        missing_values = MISSING_VALUES
+
+        positions = None
+        row_tag = cell_tag = value_tag = None
+        expected = 1
+        with self.archive.open(self.info.sheets[sheet_name]) as source:
+            for _, row in ET.iterparse(source):
+                if row_tag is None:
+                    if local_name(row.tag) != 'row':
+                        continue
+                    namespace = row.tag[:-3]
+                    row_tag, cell_tag, value_tag = namespace + 'row', namespace + 'c', namespace + 'v'
+                if row.tag != row_tag:
+                    continue
 
-                            except Exception as e:
-                                print(f"   ❌ Error processing 'Inspection data' sheet in {filename}: {e}")
+                number = row.get('r')
+                number = int(float(number)) if number else expected
+                while expected < number:
+                    # Rows without cells are left out of the sheet XML
+                    expected += 1
+                    if skip_rows:
+                        skip_rows -= 1
+                    elif positions is None and columns is not None:
+                        positions = {position: slot for slot, position in enumerate(columns([]))}
+                    yield (), 0, True
+                expected = number + 1
+
+                measure_only = skip_rows > 0
+                values = [] if positions is None else [None] * len(positions)
+                width = 0
+                blank = True
+                column = -1
+                for cell in row:
+                    if cell.tag != cell_tag:
+                        continue
+                    ref = cell.get('r')
+                    column = column_index(ref.rstrip('0123456789')) if ref else column + 1
+                    data_type = cell.get('t', 'n')
+                    if data_type == 'inlineStr':
+                        text = next((inline_text(child) for child in cell if local_name(child.tag) == 'is'), None)
+                    else:
+                        text = cell.findtext(value_tag) or None
+                    if text is None:
+                        continue
+
+                    slot = column if positions is None else positions.get(column)
+                    if measure_only or slot is None:
+                        # Outside the projection: only whether the cell is empty or NA counts
+                        if data_type == 's':
+                            text = strings[int(text)]
+                        if data_type in ('s', 'str', 'inlineStr'):
+                            if text != '':
+                                width = column + 1
+                                blank = blank and text in missing_values
                         else:
-                            # If 'Inspection data' not found, try the first sheet
+                            width = column + 1
+                            blank = blank and data_type == 'e'
+                        continue
+
+                    if data_type == 'n':
+                        value = float(text) if ('.' in text or 'e' in text or 'E' in text) else int(text)
+                        style = int(cell.get('s', 0))
+                        if style in date_styles:
                             try:
-                                df = pd.read_excel(xls, sheet_name=xls.sheet_names[0], engine='openpyxl')
-                                print(f"   ⚠️ 'Inspection data' sheet not found. Using first sheet: {xls.sheet_names[0]}")
-
-                                # Remove empty rows
-                                df = df.dropna(how='all')
-
-                                # For chokes, keep original columns and just add client name
-                                client_name = extract_client_name(filename)
-                                df['客户名称\nClient Name'] = client_name
-
-                                if not df.empty:
-                                    chokes_final.append(df)
-                                    print(f"   📊 Added {len(df)} choke rows (Client: {client_name})")
-
-                            except Exception as e:
-                                print(f"   ❌ Error processing choke file {filename}: {e}")
+                                value = from_excel(value, epoch, timedelta=style in timedelta_styles)
+                            except (OverflowError, ValueError):
+                                value = nan
+                        elif value.__class__ is float and value.is_integer():
+                            value = int(value)
+                    elif data_type == 's':
+                        value = strings[int(text)]
+                    elif data_type == 'b':
+                        value = bool(int(text))
+                    elif data_type == 'e':
+                        value = nan
+                    elif data_type == 'd':
+                        value = from_ISO8601(text)
                     else:
-                        # Process brushcard files
-                        print(f"📁 Processing brushcard file: {filename}")
-
-                        # Look for sheets containing '质量汇总表'
-                        target_sheets = [sheet for sheet in xls.sheet_names if '质量汇总表' in sheet]
-
-                        if not target_sheets:
-                            # If no sheet with '质量汇总表' found, try all sheets
-                            target_sheets = xls.sheet_names
-                            print(f"   ⚠️ No '质量汇总表' sheet found. Processing all sheets: {xls.sheet_names}")
-
-                        processed_sheets = 0
-                        for sheet_name in target_sheets:
-                            try:
-                                print(f"   🎯 Processing sheet: {sheet_name}")
-                                df = pd.read_excel(xls, sheet_name=sheet_name, engine='openpyxl')
-
-                                # Remove empty rows
-                                df = df.dropna(how='all')
-
-                                if len(df) == 0:
-                                    print(f"   ⏭️ Skipping empty sheet: {sheet_name}")
-                                    continue
-
-                                # Extract client name from filename first, then try sheet name
-                                client_name = extract_client_name(filename, sheet_name)
-
-                                # Standardize columns
-                                df_standardized = standardize_columns(df, client_name)
-                                brushcard_final.append(df_standardized)
-                                processed_sheets += 1
-
-                                print(f"   ✅ Added {len(df_standardized)} rows from sheet '{sheet_name}' (Client: {client_name})")
-
-                            except Exception as e:
-                                print(f"   ❌ Error processing sheet '{sheet_name}' in {filename}: {e}")
-                                continue
+                        value = text
+
+                    if value == '':
+                        continue
+                    width = column + 1
+                    if blank and not (value is nan or (value.__class__ is str and value in missing_values)):
+                        blank = False
+                    if positions is None:
+                        values.extend([None] * (column - len(values)))
+                        values.append(value)
+                    else:
+                        values[slot] = value
+                row.clear()
+
+                if measure_only:
+                    skip_rows -= 1
+                    yield (), width, blank
+                elif positions is None and columns is not None:
+                    positions = {position: slot for slot, position in enumerate(columns(values))}
+                    yield values, width, blank
+                elif positions is not None and not width:
+                    yield (), 0, True
+                else:
+                    yield values, width, blank
+
+def read_sheet(reader, sheet_name, header=0, skip_rows=0, columns=None, drop_blank_rows=False):
+    """Read a worksheet into a DataFrame like pd.read_excel(path, sheet_name, header=header, skiprows=skip_rows).
+
+    columns, if given, is called with the column names of the header row and
+    returns the positions of the columns to read, in order. drop_blank_rows drops
+    the rows with nothing but NA markers in any column, like dropna(how='all')
+    on the full sheet would.
+    """
+    from pandas.errors import EmptyDataError
+    from pandas.io.parsers import TextParser
+
+    names = None
+    if columns is not None:
+        def project(row):
+            nonlocal names
+            labels = list(TextParser([['' if value is None else value for value in row]], header=0).read().columns) if row else []
+            positions = columns(labels)
+            names = [labels[position] for position in positions]
+            return positions
+
+    data = []
+    keep = []
+    width = 0
+    last_row = -1
+    for index, (values, row_width, blank) in enumerate(reader.iter_rows(sheet_name, skip_rows, columns and project)):
+        data.append(values)
+        keep.append(not blank)
+        width = max(width, row_width)
+        if row_width:
+            last_row = index
+    # Trailing empty rows are not part of the sheet
+    del data[last_row + 1:], keep[last_row + 1:]
+    if not data:
+        return pd.DataFrame()
+
+    if names is not None:
+        # The header row was read in full; the rows after it only hold the projected columns
+        data, keep = data[skip_rows + 1:], keep[skip_rows + 1:]
+        width = len(names)
+    data = [['' if value is None else value for value in row] + [''] * (width - len(row)) for row in data]
+    try:
+        if names == []:
+            df = pd.DataFrame(index=pd.RangeIndex(len(data)))
+        elif names is not None:
+            df = TextParser(data, header=None, names=names, skip_blank_lines=False).read()
+        else:
+            df = TextParser(data, header=header, skiprows=skip_rows, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+    if drop_blank_rows:
+        if header is not None and names is None:
+            keep = keep[skip_rows + header + 1:]
+        elif names is None:
+            keep = keep[skip_rows:]
+        df = df.take(np.flatnonzero(keep))
+    return df
+
+# === Parse stage ===
+# Each selected sheet is an independent parse task. Tasks are planned in upload
+# order in the main process (including Kunshan's Data sheet numbering) and run
+# either serially or on a process pool; results are always merged in plan order,
+# so both paths produce the same workbook.
+_parse_pool = None
+
+def list_sheet_names(source):
+    """List worksheet names from the workbook manifest without loading any sheet data"""
+    with XlsxReader(source) as reader:
+        return reader.sheet_names
+
+def is_choke_file(filename):
+    return "choke" in filename.lower() or "chocke" in filename.lower()
+
+def plan_anhui_tasks(filename, sheet_names):
+    """Return (sheet_name, kind) parse tasks for one Anhui upload"""
+    if not sheet_names:
+        return []
+
+    if is_choke_file(filename):
+        # Chokes data lives in 'Inspection data'; fall back to the first sheet
+        if 'Inspection data' in sheet_names:
+            return [('Inspection data', 'chokes')]
+        print(f"   ⚠️ 'Inspection data' sheet not found. Using first sheet: {sheet_names[0]}")
+        return [(sheet_names[0], 'chokes')]
+
+    # Look for sheets containing '质量汇总表'
+    target_sheets = [sheet for sheet in sheet_names if '质量汇总表' in sheet]
+    if not target_sheets:
+        # If no sheet with '质量汇总表' found, try all sheets
+        target_sheets = sheet_names
+        print(f"   ⚠️ No '质量汇总表' sheet found in {filename}. Processing all {len(sheet_names)} sheets")
+        detail(f"   📋 Sheets: {sheet_names}")
+    return [(sheet, 'brushcards') for sheet in target_sheets]
+
+def kunshan_sheet_name(filename, sheet_name, data_sheet_counter):
+    """Return (output sheet name or None, updated data_sheet_counter) for one Kunshan sheet"""
+    sheet_name_clean = sheet_name.strip()
+
+    # Determine the new sheet name based on mapping
+    if sheet_name_clean == "Date":
+        return KUNSHAN_SHEET_MAPPING["Date"], data_sheet_counter
+    if sheet_name_clean == "Data":
+        # Handle multiple Data sheets, numbered in upload order across all files
+        if data_sheet_counter < len(KUNSHAN_SHEET_MAPPING["Data"]):
+            new_sheet_name = KUNSHAN_SHEET_MAPPING["Data"][data_sheet_counter]
+            detail(f"   🎯 Mapping Data sheet #{data_sheet_counter + 1} → {new_sheet_name}")
+        else:
+            print(f"   ⚠️ More 'Data' sheets found than expected in {filename}")
+            new_sheet_name = f"Data_{data_sheet_counter + 1}"
+        return new_sheet_name, data_sheet_counter + 1
+    if sheet_name_clean == "Inspection data":
+        return KUNSHAN_SHEET_MAPPING["Inspection data"], data_sheet_counter
+    # Sheets that are not in our mapping are skipped
+    return None, data_sheet_counter
+
+def plan_kunshan_tasks(filename, sheet_names, data_sheet_counter):
+    """Return ((sheet_name, new_sheet_name) tasks, updated data_sheet_counter) for one Kunshan upload"""
+    tasks = []
+    for sheet_name in sheet_names:
+        new_sheet_name, data_sheet_counter = kunshan_sheet_name(filename, sheet_name, data_sheet_counter)
+        if new_sheet_name:
+            tasks.append((sheet_name, new_sheet_name))
+    return tasks, data_sheet_counter
+
+def parse_sheet(task):
+    """Parse and normalize one sheet. Runs in a pool worker, so it only takes picklable input.
+
+    task is (path, filename, sheet_name, kind) where path is the spooled workbook.
+    Returns the normalized DataFrame, or None if the sheet has no usable data;
+    raises if the sheet can't be read.
+    """
+    path, filename, sheet_name, kind = task
+    if app.config['READ_ENGINE'] == 'lean':
+        with XlsxReader(path) as reader:
+            return read_lean_sheet(reader, filename, sheet_name, kind)
+
+    if kind == 'kunshan':
+        df_raw = pd.read_excel(path, sheet_name=sheet_name, engine='openpyxl', header=None)
+        df_trimmed = df_raw.iloc[2:].reset_index(drop=True)
+        df_trimmed.columns = df_trimmed.iloc[0]
+        df = df_trimmed.iloc[1:].reset_index(drop=True)
+
+        # Standardize column names and remove 'type' columns
+        kept = kunshan_columns(df.columns)
+        df = df.iloc[:, [i for i, _ in kept]]
+        df.columns = [name for _, name in kept]
+        normalize_dtypes(df, infer_integers=True)
+        return df
+
+    df = pd.read_excel(path, sheet_name=sheet_name, engine='openpyxl')
+
+    # Remove empty rows
+    df = df.dropna(how='all')
+
+    if kind == 'chokes':
+        # For chokes, keep original columns and just add client name
+        df[CLIENT_NAME_COLUMN] = extract_client_name(filename)
+        if df.empty:
+            return None
+        normalize_dtypes(df)
+        return df
+
+    if len(df) == 0:
+        detail(f"   ⏭️ Skipping empty sheet: {sheet_name}")
+        return None
+
+    # Extract client name from filename first, then try sheet name
+    df = standardize_columns(df, extract_client_name(filename, sheet_name))
+    normalize_dtypes(df)
+    return df
+
+def read_lean_sheet(reader, filename, sheet_name, kind):
+    """parse_sheet on the lean reader: only the rows and columns that are kept get converted"""
+    if kind == 'kunshan':
+        # Skip the two preamble rows; the next row is the header
+        df_raw = read_sheet(reader, sheet_name, header=None, skip_rows=2)
+        df_raw.columns = df_raw.iloc[0]
+        df = df_raw.iloc[1:].reset_index(drop=True)
+
+        kept = kunshan_columns(df.columns)
+        df = df.iloc[:, [i for i, _ in kept]]
+        df.columns = [name for _, name in kept]
+        normalize_dtypes(df, infer_integers=True)
+        return df
+
+    if kind == 'chokes':
+        df = read_sheet(reader, sheet_name, drop_blank_rows=True)
+        df[CLIENT_NAME_COLUMN] = extract_client_name(filename)
+        if df.empty:
+            return None
+        normalize_dtypes(df)
+        return df
+
+    # Brushcards: only the columns the schema maps are read
+    layouts = []
+    def mapped_columns(names):
+        layouts.append(BRUSHCARD_SCHEMA.resolve(tuple(names)))
+        return [position for position in layouts[0].positions if position is not None]
+
+    df = read_sheet(reader, sheet_name, columns=mapped_columns, drop_blank_rows=True)
+    if len(df) == 0:
+        detail(f"   ⏭️ Skipping empty sheet: {sheet_name}")
+        return None
+    df = standardize_columns(df, extract_client_name(filename, sheet_name), layouts[0])
+    normalize_dtypes(df)
+    return df
+
+# Settings parse_sheet reads, handed to each pool worker as they are now
+PARSE_WORKER_SETTINGS = ('READ_ENGINE', 'COMBINE_VERBOSE_LOG')
+
+def init_parse_worker(settings):
+    app.config.update(settings)
+
+def get_parse_pool():
+    global _parse_pool
+    if _parse_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Not fork: the pool is started from a request thread, and a child forked
+        # while another thread (scheduler, warm-up, jobs) holds a lock such as
+        # stdout's or the workbook info cache's can deadlock. Workers start from
+        # a fresh interpreter and import the app themselves.
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=app.config['PARSE_WORKERS'], mp_context=multiprocessing.get_context(method),
+            initializer=init_parse_worker, initargs=({name: app.config[name] for name in PARSE_WORKER_SETTINGS},))
+    return _parse_pool
+
+def timed_parse_sheet(task):
+    """Return (parse_sheet(task), seconds, failed), timed where the parse actually runs.
+
+    A sheet that can't be parsed is reported here and gives (None, seconds, True).
+    """
+    started = time.perf_counter()
+    try:
+        df, failed = parse_sheet(task), False
+    except Exception as e:
+        _, filename, sheet_name, _ = task
+        print(f"   ❌ Error processing sheet '{sheet_name}' in {filename}: {e}")
+        df, failed = None, True
+    return df, time.perf_counter() - started, failed
+
+def parse_pending(tasks):
+    """Yield (df, seconds, failed) parse results in task order, from the process pool or serially"""
+    global _parse_pool
+    done = 0
+    if app.config['PARSE_WORKERS'] > 1 and len(tasks) > 1:
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            for result in get_parse_pool().map(timed_parse_sheet, tasks):
+                done += 1
+                yield result
+            return
+        except BrokenProcessPool:
+            print("❌ Parse pool crashed, falling back to serial parsing")
+            _parse_pool = None
+    for task in tasks[done:]:
+        yield timed_parse_sheet(task)
+
+def run_parse_tasks(tasks, keys=None):
+    """Yield (df, seconds, source) in task order, serving cached sheets from the parse cache.
+
+    keys, if given, holds the parse cache key of each task; only cache misses are
+    parsed. source is 'cache', 'parse' or 'failed' (the parse raised; df is None).
+    """
+    cache = get_parse_cache() if keys else None
+    cached = []
+    for key in (keys if cache else [None] * len(tasks)):
+        started = time.perf_counter()
+        df = cache.get(key) if key else None
+        cached.append((df, time.perf_counter() - started))
+    parsed = parse_pending([task for task, (df, _) in zip(tasks, cached) if df is None])
+
+    for index, (df, seconds) in enumerate(cached):
+        if df is not None:
+            yield df, seconds, 'cache'
+            continue
+        df, seconds, failed = next(parsed)
+        if cache and df is not None:
+            cache.put(keys[index], df)
+        yield df, seconds, 'failed' if failed else 'parse'
+
+def track_parse_results(tasks, file_ends, progress, keys=None):
+    """Yield (task, result) pairs, reporting progress and sheet metrics as each result lands"""
+    for index, (task, (df, seconds, source)) in enumerate(zip(tasks, run_parse_tasks(tasks, keys))):
+        rows = 0 if df is None else len(df)
+        metrics.observe('sheet_parse_seconds', seconds, kind=task[3], source=source)
+        metrics.inc('rows_total', rows, kind=task[3])
+        progress.add(sheets_done=1, rows=rows, files_done=int(index in file_ends), failed=int(source == 'failed'))
+        yield task, df
+
+def read_uploads(uploaded_files, timer=None, progress=None):
+    """Return an Upload for every readable upload, in upload order.
+
+    Workbooks stay on disk; only their manifest is read here. Call
+    release_uploads() once the uploads have been parsed.
+    """
+    sources = []
+    for file in uploaded_files:
+        if file and allowed_file(file.filename):
+            filename = file.filename
+            try:
+                detail(f"📂 Reading file: {filename}")
+                started = time.perf_counter()
+                path, digest, size, temporary = spool_upload(file)
+                try:
+                    sources.append(Upload(filename, path, list_sheet_names(path), digest, size, temporary))
+                except Exception:
+                    release_uploads([Upload(filename, path, [], digest, size, temporary)])
+                    raise
+                if timer:
+                    timer.file_read(time.perf_counter() - started, size)
+            except Exception as e:
+                print(f"❌ Failed to read file {filename}: {e}")
+                if progress:
+                    progress.add(failed=1)
+    return sources
+
+# === Parse cache ===
+# Parsed, normalized sheet frames keyed by the upload's content hash, so an
+# unchanged workbook costs a hash and a columnar load instead of an XML parse.
+# Bump PARSER_VERSION whenever parse_sheet's output changes.
+PARSER_VERSION = 3
+
+# Type tags for values of object columns. Arrow columns are single-typed, so an
+# object column is stored as a tag column plus one typed column per tag present.
+# Integers outside int64 (Excel numbers up to 1E+308 are read as int when
+# integral) are stored as their decimal text under 'n'.
+OBJECT_TAGS = {1: 's', 2: 'i', 3: 'f', 4: 'b', 5: 'd', 6: 't', 7: 'r', 8: 'a', 9: 'n'}
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+# Schema metadata key of the (JSON) column labels and layout encode_frame stores
+FRAME_METADATA_KEY = b'excel_combiner.frame'
+# Stored frames of an older format are parsed again instead of loaded
+FRAME_FORMAT = 2
+
+def parse_cache_key(digest, plant, sheet_name, kind, client_name=''):
+    key = json.dumps([digest, plant, PARSER_VERSION, app.config['READ_ENGINE'], sheet_name, kind, client_name])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def object_tag(value):
+    value_type = type(value)
+    if value_type is str:
+        return 1
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return 0
+    if isinstance(value, (bool, np.bool_)):
+        return 4
+    if isinstance(value, (int, np.integer)):
+        return 2 if INT64_MIN <= value <= INT64_MAX else 9
+    if isinstance(value, (float, np.floating)):
+        return 3
+    if isinstance(value, datetime.datetime):
+        return 5
+    if isinstance(value, datetime.time):
+        return 6
+    if isinstance(value, datetime.timedelta):
+        return 7
+    if isinstance(value, datetime.date):
+        return 8
+    raise TypeError(f"Unsupported cell type {value_type.__name__}")
+
+def encode_label(label):
+    """A column label as JSON: [type, value]"""
+    if isinstance(label, np.generic):
+        label = label.item()
+    if isinstance(label, datetime.datetime):
+        return ['datetime', label.isoformat()]
+    if isinstance(label, datetime.time):
+        return ['time', label.isoformat()]
+    if isinstance(label, float) and label != label:
+        return ['nan', None]
+    if label is None or isinstance(label, (str, bool, int, float)):
+        return ['value', label]
+    raise TypeError(f"Unsupported column label type {type(label).__name__}")
+
+def decode_label(encoded):
+    label_type, value = encoded
+    if label_type == 'datetime':
+        return datetime.datetime.fromisoformat(value)
+    if label_type == 'time':
+        return datetime.time.fromisoformat(value)
+    if label_type == 'nan':
+        return float('nan')
+    return value
+
+def json_scalar(value):
+    """json.dumps default for numpy scalars (e.g. in df.attrs)"""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def encode_frame(df):
+    """Encode a parsed frame as an Arrow table (raises TypeError/ValueError if it can't)"""
+    import pyarrow as pa
+
+    columns = {}
+    object_positions = []
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        if series.dtype != object:
+            columns[str(position)] = series.reset_index(drop=True)
+            continue
+
+        object_positions.append(position)
+        values = series.to_numpy()
+        tags = np.fromiter((object_tag(value) for value in values), dtype=np.int8, count=len(values))
+        columns[f"{position}:tag"] = tags
+        for tag, suffix in OBJECT_TAGS.items():
+            mask = tags == tag
+            if not mask.any():
+                continue
+            typed = np.where(mask, values, None)
+            if suffix == 'i':
+                typed = pd.array(typed, dtype='Int64')
+            elif suffix == 'f':
+                typed = pd.array(typed, dtype='Float64')
+            elif suffix == 'b':
+                typed = pd.array(typed, dtype='boolean')
+            elif suffix in ('d', 'a'):
+                typed = pd.to_datetime(typed)
+            elif suffix == 'r':
+                typed = pd.to_timedelta(typed)
+            elif suffix == 'n':
+                typed = np.array([str(value) if keep else None for value, keep in zip(values, mask)], dtype=object)
+            columns[f"{position}:{suffix}"] = typed
+
+    table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index=False)
+    meta = json.dumps({
+        'labels': [encode_label(label) for label in df.columns],
+        'object_positions': object_positions,
+        'width': df.shape[1],
+        'attrs': dict(df.attrs)
+    }, default=json_scalar)
+    return table.replace_schema_metadata({**table.schema.metadata, FRAME_METADATA_KEY: meta.encode('utf-8')})
+
+def decode_frame(table):
+    """Rebuild the frame encode_frame() stored"""
+    if FRAME_METADATA_KEY not in (table.schema.metadata or {}):
+        raise ValueError("frame was stored by an older version")
+    meta = json.loads(table.schema.metadata[FRAME_METADATA_KEY])
+    labels = [decode_label(label) for label in meta['labels']]
+    width = meta['width']
+    encoded = table.to_pandas()
+    object_positions = set(meta['object_positions'])
+
+    columns = []
+    for position in range(width):
+        if position not in object_positions:
+            columns.append(encoded[str(position)])
+            continue
+        tags = encoded[f"{position}:tag"].to_numpy()
+        values = np.full(len(tags), np.nan, dtype=object)
+        for tag, suffix in OBJECT_TAGS.items():
+            name = f"{position}:{suffix}"
+            if name not in encoded:
+                continue
+            mask = tags == tag
+            typed = encoded[name]
+            if suffix in ('d', 'a', 'r'):
+                # numpy turns datetime64[us] into datetime.datetime objects, datetime64[D]
+                # into datetime.date and timedelta64[us] into datetime.timedelta
+                unit = {'d': 'datetime64[us]', 'a': 'datetime64[D]', 'r': 'timedelta64[us]'}[suffix]
+                typed = pd.Series(typed.to_numpy().astype(unit).astype(object), dtype=object)
+            elif suffix in ('i', 'f', 'b'):
+                typed = typed.astype(object)
+            elif suffix == 'n':
+                typed = pd.Series([None if text is None else int(text) for text in typed], dtype=object)
+            values[mask] = typed.to_numpy()[mask]
+        columns.append(pd.Series(values, dtype=object))
+
+    df = pd.concat(columns, axis=1, ignore_index=True) if columns else pd.DataFrame(index=range(table.num_rows))
+    df.columns = labels
+    df.attrs.update(meta['attrs'])
+    return df
+
+FRAME_EXTENSION = '.feather'
+# Frames used to fall back to pickle, which is never loaded: unpickling a file
+# from the cache directory could run arbitrary code
+LEGACY_FRAME_EXTENSION = '.pkl'
+# Errors of frames (or labels, attrs) that Arrow or the JSON metadata can't hold
+FRAME_ENCODE_ERRORS = (TypeError, ValueError, OverflowError)
+
+def save_frame(base_path, df):
+    """Write df to base_path.feather and return the file name.
+
+    Raises one of FRAME_ENCODE_ERRORS if the frame can't be stored.
+    """
+    from pyarrow import feather
+
+    table = encode_frame(df)
+    path = base_path + FRAME_EXTENSION
+    # Unique temp name: several worker processes may write the same cached frame at once
+    suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        feather.write_feather(table, path + suffix)
+        os.replace(path + suffix, path)
+    except BaseException:
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
+        raise
+    return os.path.basename(path)
+
+def load_frame(base_path):
+    """Return (df, path) for a frame written by save_frame, or (None, None) if there is none"""
+    from pyarrow import feather
+
+    path = base_path + FRAME_EXTENSION
+    try:
+        return decode_frame(feather.read_table(path)), path
+    except FileNotFoundError:
+        return None, None
+
+def delete_frame(base_path):
+    for extension in (FRAME_EXTENSION, LEGACY_FRAME_EXTENSION):
+        try:
+            os.remove(base_path + extension)
+        except FileNotFoundError:
+            pass
+
+class ParseCache:
+    """Two-tier cache of parsed sheet frames.
+
+    An in-memory LRU bounded by frame size sits in front of an on-disk Feather
+    (Arrow IPC) directory bounded by total bytes, evicted least recently used
+    first. Frames with cell types Arrow can't hold are kept in memory only.
+
+    Other processes write to the same directory, so the running total of its
+    size is refreshed by a scan whenever it passes the cap or is older than
+    DISK_SCAN_SECONDS.
+    """
+    DISK_SCAN_SECONDS = 60
+
+    def __init__(self, directory, memory_bytes, disk_bytes):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('memory_hits', 'disk_hits', 'misses', 'stores', 'memory_evictions', 'disk_evictions'), 0)
+        self.disk_used = None
+        self.disk_scanned = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return self.memory[key][0]
+
+        df = self.load(key)
+        with self.lock:
+            if df is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+        self.remember(key, df)
+        return df
+
+    def put(self, key, df):
+        self.remember(key, df)
+        self.store(key, df)
+        with self.lock:
+            self.counters['stores'] += 1
+
+    def remember(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.memory_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memory_used -= self.memory.pop(key)[1]
+            self.memory[key] = (df, size)
+            self.memory_used += size
+            while self.memory_used > self.memory_bytes:
+                _, (_, evicted_size) = self.memory.popitem(last=False)
+                self.memory_used -= evicted_size
+                self.counters['memory_evictions'] += 1
+
+    def load(self, key):
+        base_path = os.path.join(self.directory, key)
+        try:
+            df, path = load_frame(base_path)
+        except Exception as e:
+            print(f"❌ Dropping unreadable parse cache entry {key}: {e}")
+            delete_frame(base_path)
+            return None
+        if df is not None:
+            # Touch the entry so disk eviction sees it as recently used
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return df
+
+    def store(self, key, df):
+        # The disk tier is only an optimization: a frame it can't hold, or a full
+        # or unwritable directory, leaves the sheet cached in memory only
+        try:
+            name = save_frame(os.path.join(self.directory, key), df)
+            size = os.path.getsize(os.path.join(self.directory, name))
+        except FRAME_ENCODE_ERRORS + (OSError,) as e:
+            print(f"   ⚠️ Parsed sheet cached in memory only: {e}")
+            return
+        with self.lock:
+            if self.disk_used is not None:
+                self.disk_used += size
+            due = (self.disk_used is None or self.disk_used > self.disk_bytes
+                   or time.monotonic() - self.disk_scanned >= self.DISK_SCAN_SECONDS)
+        if due:
+            self.evict_disk()
+
+    def evict_disk(self):
+        """Scan the directory, evict least recently used frames above the cap and reset the running total"""
+        entries = []
+        total = 0
+        try:
+            scan = list(os.scandir(self.directory))
+        except OSError as e:
+            print(f"❌ Could not scan the parse cache directory: {e}")
+            with self.lock:
+                self.disk_scanned = time.monotonic()
+            return
+        for entry in scan:
+            if entry.name.endswith(LEGACY_FRAME_EXTENSION):
+                # Never loaded (see LEGACY_FRAME_EXTENSION); just reclaim the space
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            elif entry.name.endswith(FRAME_EXTENSION):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"❌ Could not evict parse cache entry {os.path.basename(path)}: {e}")
+                continue
+            total -= size
+            with self.lock:
+                self.counters['disk_evictions'] += 1
+        with self.lock:
+            self.disk_used = total
+            self.disk_scanned = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': (lookups - self.counters['misses']) / lookups if lookups else 0.0,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_used,
+                'disk_used': self.disk_used
+            }
 
-                        if processed_sheets == 0:
-                            print(f"   ⚠️ No valid sheets processed in {filename}")
-                        else:
-                            print(f"   📊 Processed {processed_sheets} sheets from {filename}")
+_parse_cache = None
+
+def get_parse_cache():
+    """Return the process-wide parse cache, or None when PARSE_CACHE_ENABLED is off"""
+    global _parse_cache
+    if not app.config['PARSE_CACHE_ENABLED']:
+        return None
+    if _parse_cache is None:
+        try:
+            _parse_cache = ParseCache(app.config['PARSE_CACHE_DIR'],
+                                      app.config['PARSE_CACHE_MEMORY_BYTES'],
+                                      app.config['PARSE_CACHE_DISK_BYTES'])
+        except OSError as e:
+            print(f"❌ Parse cache disabled, {app.config['PARSE_CACHE_DIR']} is not usable: {e}")
+            return None
+    return _parse_cache
+
+# === Incremental combined store ===
+class CombinedStore:
+    """Persistent combined dataset of one plant, tracked per source file.
+
+    combined/<plant>/manifest.json lists the source files in arrival order with
+    their content hash and parsed sheets; each parsed sheet is a columnar frame
+    in combined/<plant>/frames/. Re-uploading a file replaces only its own rows.
+
+    Hold lock around any use: it is shared with other worker processes and
+    reloads the manifest whenever one of them may have changed it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.frames_dir = os.path.join(directory, 'frames')
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.lock = FileLock(os.path.join(directory, 'store.lock'), on_acquire=self.load_manifest)
+        os.makedirs(self.frames_dir, exist_ok=True)
+        self.files = []
+        self.manifest_version = None
+        self.unsaved = {}
+
+    def load_manifest(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            self.files, self.manifest_version = [], None
+            return
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if version != self.manifest_version:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.files = json.load(f)['files']
+            self.manifest_version = version
+
+    def write_manifest(self):
+        with open(self.manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+        stat = os.stat(self.manifest_path)
+        self.manifest_version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def find(self, filename):
+        return next((index for index, entry in enumerate(self.files) if entry['filename'] == filename), None)
+
+    def has(self, filename, digest):
+        index = self.find(filename)
+        return (index is not None and self.files[index]['digest'] == digest
+                and self.files[index].get('frame_format') == FRAME_FORMAT)
+
+    def update(self, parsed):
+        """Store freshly parsed sheets ((filename, digest, sheet_name, kind, df) in file order).
+
+        A file already in the store keeps its position; new files are appended.
+        A sheet whose frame can't be written is kept in memory for this combine
+        only, and its file is parsed again the next time it is uploaded.
+        """
+        self.unsaved = {}
+        entry = None
+        for filename, digest, sheet_name, kind, df in parsed:
+            if entry is None or entry['filename'] != filename:
+                if entry is not None:
+                    self.replace(entry)
+                entry = {'filename': filename, 'digest': digest, 'updated': time.time(),
+                         'frame_format': FRAME_FORMAT, 'sheets': []}
+
+            frame = None
+            if df is not None:
+                name = hashlib.sha256(json.dumps([filename, digest, sheet_name, kind]).encode('utf-8')).hexdigest()
+                try:
+                    frame = save_frame(os.path.join(self.frames_dir, name), df)
+                except FRAME_ENCODE_ERRORS + (OSError,) as e:
+                    print(f"   ⚠️ Could not store '{sheet_name}' of {filename} in the combined store ({e}); "
+                          f"it will be parsed again")
+                    self.unsaved[(filename, sheet_name)] = df
+                    entry['frame_format'] = None
+            entry['sheets'].append({
+                'sheet_name': sheet_name, 'kind': kind, 'frame': frame, 'rows': 0 if df is None else len(df)
+            })
+        if entry is not None:
+            self.replace(entry)
+
+    def replace(self, entry):
+        index = self.find(entry['filename'])
+        if index is None:
+            self.files.append(entry)
+            detail(f"   ➕ Added {entry['filename']} to the combined store")
+        else:
+            old_entry = self.files[index]
+            self.files[index] = entry
+            self.delete_frames(old_entry, keep=entry)
+            detail(f"   🔁 Replaced {entry['filename']} in the combined store")
+        self.write_manifest()
+
+    def remove(self, filename):
+        index = self.find(filename)
+        if index is None:
+            return False
+        self.delete_frames(self.files.pop(index))
+        self.write_manifest()
+        return True
+
+    def delete_frames(self, entry, keep=None):
+        kept = {sheet['frame'] for sheet in keep['sheets']} if keep else set()
+        for sheet in entry['sheets']:
+            if sheet['frame'] and sheet['frame'] not in kept:
+                delete_frame(os.path.join(self.frames_dir, sheet['frame'].rsplit('.', 1)[0]))
+
+    def contributions(self):
+        """Yield every stored sheet as (filename, digest, sheet_name, kind, df), loading frames lazily"""
+        for entry in list(self.files):
+            for sheet in entry['sheets']:
+                df = self.unsaved.get((entry['filename'], sheet['sheet_name']))
+                try:
+                    if sheet['frame'] and sheet['frame'].endswith(LEGACY_FRAME_EXTENSION):
+                        raise ValueError("frame was stored pickled, which is no longer loaded")
+                    if sheet['frame']:
+                        df, _ = load_frame(os.path.join(self.frames_dir, sheet['frame'].rsplit('.', 1)[0]))
+                except ValueError as e:
+                    print(f"⚠️ Skipping '{sheet['sheet_name']}' of {entry['filename']} ({e}); upload the file again")
+                yield entry['filename'], entry['digest'], sheet['sheet_name'], sheet['kind'], df
+
+    def summary(self):
+        return [{
+            'filename': entry['filename'],
+            'digest': entry['digest'],
+            'updated': entry['updated'],
+            'sheets': [{key: sheet[key] for key in ('sheet_name', 'kind', 'rows')} for sheet in entry['sheets']]
+        } for entry in self.files]
+
+_combined_stores = {}
+_combined_stores_lock = threading.Lock()
+
+def get_combined_store(plant):
+    with _combined_stores_lock:
+        if plant not in _combined_stores:
+            _combined_stores[plant] = CombinedStore(os.path.join(CLEANUP_DIR, plant))
+        return _combined_stores[plant]
+
+# === Result store ===
+# Combined outputs addressed by a hash of everything that determines their bytes.
+# Bump RESULT_VERSION whenever the combine or the writers change their output.
+RESULT_VERSION = 1
+RESULT_KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+def result_key(plant, uploaded_files, options):
+    """Content address of a combine's output: plant, ordered (filename, hash) of the inputs, options and versions.
+
+    Filenames are part of it because Anhui takes client names from them.
+    """
+    inputs = [[file.filename, upload_digest(file)] for file in uploaded_files if file and allowed_file(file.filename)]
+    key = json.dumps([plant, RESULT_VERSION, PARSER_VERSION, app.config['READ_ENGINE'],
+                      app.config['OUTPUT_ENGINE'], inputs, options], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class TeeStream(io.RawIOBase):
+    """Write-only stream that copies everything written to output into copy as well.
+
+    A failing copy (a full result store disk) only stops the copying, recorded
+    in copy_error; output gets everything regardless.
+    """
+
+    def __init__(self, output, copy):
+        super().__init__()
+        self.output = output
+        self.copy = copy
+        self.copy_error = None
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.output.tell()
+
+    def write(self, data):
+        if self.copy_error is None:
+            try:
+                self.copy.write(data)
+            except OSError as e:
+                self.copy_error = e
+        return self.output.write(data)
+
+class ResultStore:
+    """Finished combine outputs on disk, one file per result key.
+
+    index.json holds the size, creation and last access time of every result,
+    so eviction never has to scan the directory: results not served for
+    ttl_seconds go first, then the least recently used until the total fits
+    max_bytes. A result never goes stale (its key covers every input), so a
+    popular one is kept however old it is.
+    The lock is shared with other worker processes and reloads the index when
+    one of them changed it.
+    """
+
+    def __init__(self, directory, max_bytes, ttl_seconds):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.index_path = os.path.join(directory, 'index.json')
+        self.lock = FileLock(os.path.join(directory, 'index.lock'), on_acquire=self.load_index)
+        self.entries = {}
+        self.index_version = None
+        os.makedirs(directory, exist_ok=True)
+
+    def load_index(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            self.entries, self.index_version = {}, None
+            return
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if version != self.index_version:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.entries = json.load(f)['results']
+            self.index_version = version
+
+    def write_index(self):
+        with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'results': self.entries}, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
+        stat = os.stat(self.index_path)
+        self.index_version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        """Return (entry, open file) for a stored result and mark it used, or (None, None)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, None
+            try:
+                file = open(self.path(key), 'rb')
+            except FileNotFoundError:
+                del self.entries[key]
+                self.write_index()
+                return None, None
+            entry['accessed'] = time.time()
+            self.write_index()
+            return entry, file
+
+    def put(self, key, write, **meta):
+        """Store the result write(file) produces under key and return its entry.
+
+        If write() raises, nothing is stored and the exception propagates; if it
+        returns False (the output is incomplete), nothing is stored and None is
+        returned.
+        """
+        temp_path = f'{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                complete = write(f) is not False
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        if not complete:
+            os.remove(temp_path)
+            return None
+        now = time.time()
+        with self.lock:
+            os.replace(temp_path, self.path(key))
+            entry = self.entries[key] = {
+                'size': os.path.getsize(self.path(key)), 'created': now, 'accessed': now, **meta
+            }
+            self.evict_entries(keep=key)
+            self.write_index()
+        return entry
+
+    def evict(self):
+        with self.lock:
+            if self.evict_entries():
+                self.write_index()
+
+    def evict_entries(self, keep=None):
+        """Drop results unused for the TTL, then least recently used ones past max_bytes; return how many went"""
+        cutoff = time.time() - self.ttl_seconds
+        total = sum(entry['size'] for entry in self.entries.values())
+        evicted = 0
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['accessed']):
+            if key == keep or (total <= self.max_bytes and entry['accessed'] >= cutoff):
+                continue
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # Still open for a download on Windows; try again next time
+                print(f"❌ Could not evict result {key}: {e}")
+                continue
+            del self.entries[key]
+            total -= entry['size']
+            evicted += 1
+        if evicted:
+            print(f"🧹 Evicted {evicted} stored result(s)")
+        return evicted
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': sum(entry['size'] for entry in self.entries.values()),
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds
+            }
 
-                except Exception as e:
-                    print(f"❌ Failed to read file {file.filename}: {e}")
+_result_store = None
+_result_store_lock = threading.Lock()
+
+def get_result_store():
+    """Return the result store, or None when RESULT_STORE_ENABLED is off"""
+    global _result_store
+    if not app.config['RESULT_STORE_ENABLED']:
+        return None
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore(app.config['RESULT_STORE_DIR'],
+                                        app.config['RESULT_STORE_MAX_BYTES'],
+                                        app.config['RESULT_STORE_TTL_SECONDS'])
+        return _result_store
+
+# === Row deduplication ===
+# Plants upload cumulative exports, so the same rows arrive in several files.
+# Rows are matched on a 64-bit hash of their key columns, and the n-th copy of a
+# row in one file only matches the n-th copy in another: rows that legitimately
+# repeat within a file survive, while the overlap between files is dropped.
+DEDUP_POLICIES = {'first': 'first', 'latest': 'last'}
+
+def dedup_key_columns(sheet_name, df):
+    """The columns rows of an output sheet are matched on; empty if none of the configured ones exist"""
+    keys = app.config['DEDUP_KEYS'].get(sheet_name)
+    if not keys:
+        return list(df.columns)
+    missing = [column for column in keys if column not in df.columns]
+    if missing:
+        print(f"⚠️ {sheet_name}: dedup key columns not found: {missing}")
+    return [column for column in keys if column in df.columns]
+
+def drop_duplicate_rows(df, sources, columns, keep='first'):
+    """Drop the rows of df that repeat a row of another source.
+
+    sources holds each row's source number (0, 1, ... in upload order); keep is
+    'first' to keep the copy from the earliest source or 'latest' for the last.
+    Returns the remaining rows and the number dropped per source.
+    """
+    hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    occurrence = pd.Series(hashes).groupby([sources, hashes]).cumcount().to_numpy()
+    duplicate = pd.DataFrame({'row': hashes, 'occurrence': occurrence}).duplicated(keep=DEDUP_POLICIES[keep]).to_numpy()
+    dropped = np.bincount(sources[duplicate], minlength=int(sources.max()) + 1 if len(sources) else 0)
+    if not duplicate.any():
+        return df, dropped
+    return df.take(np.flatnonzero(~duplicate)).reset_index(drop=True), dropped
+
+def number_uploads(contributions):
+    """Yield (upload number, contribution) for contributions in upload order.
+
+    An upload's sheets arrive together and each only once, so the same file
+    naming a sheet again is the next upload of the same workbook.
+    """
+    number = -1
+    current = None
+    seen = set()
+    for contribution in contributions:
+        filename, digest, sheet_name = contribution[:3]
+        if (filename, digest) != current or sheet_name in seen:
+            number += 1
+            current = (filename, digest)
+            seen = set()
+        seen.add(sheet_name)
+        yield number, contribution
+
+def combine_sheet_frames(plant, sheet_name, frames, owners, dedup=None):
+    """Concatenate the frames of one output sheet, dropping rows repeated across files if dedup is a keep policy.
+
+    owners holds the (upload number, filename) each frame came from.
+    """
+    if len(frames) == 1:
+        # Nothing to align or to repeat across files
+        return frames[0]
+    combined = concat_typed(frames)
+    if not dedup:
+        return combined
+    columns = dedup_key_columns(sheet_name, combined)
+    if not columns:
+        return combined
+
+    files = list(OrderedDict.fromkeys(owners))
+    positions = {owner: index for index, owner in enumerate(files)}
+    sources = np.repeat([positions[owner] for owner in owners], [len(df) for df in frames])
+    deduplicated, dropped = drop_duplicate_rows(combined, sources, columns, dedup)
+    deduplicated.attrs = combined.attrs
+    for (_, filename), count in zip(files, dropped):
+        if count:
+            print(f"   🧹 {sheet_name}: dropped {count} rows of {filename} already in "
+                  f"{'an earlier' if dedup == 'first' else 'a later'} file")
+    metrics.inc('duplicate_rows_total', int(dropped.sum()), plant=plant, sheet=sheet_name)
+    return deduplicated
+
+# === Rollups ===
+# Sums over the combined rows, so consumers don't have to pivot hundreds of
+# thousands of rows in Excel. Sums add up across frames, so each source sheet's
+# partial rollup is cached next to its parsed frame and only changed inputs are
+# aggregated again. Bump ROLLUP_VERSION whenever a rollup's content changes.
+ROLLUP_VERSION = 2
+BRUSHCARD_QUANTITY_COLUMN = '数量\nQuantity'
+BRUSHCARD_INSPECTED_COLUMN = '当日检数量\nInspection quantity'
+BRUSHCARD_ROLLUP_KEYS = [CLIENT_NAME_COLUMN, '不良名称\nDefect Name', '不良部位\nDefective Part', '生产日期\nProduction Date']
+DEFECT_RATE_COLUMN = '不良率\nDefect rate'
+BRUSHCARD_ROLLUP_SHEET = 'Brushcards Rollup'
+KUNSHAN_ROLLUP_SUFFIX = ' Daily'
+KUNSHAN_PPM_COLUMN = 'I Total PPM'
+# Kunshan columns that label a row rather than count something, by their whole
+# (lowercased) header: numeric machine or part numbers must not be added up.
+# Defect headers are free text, so every other numeric column is a count,
+# except ratios (PPM, percentages).
+KUNSHAN_LABEL_COLUMNS = {
+    'week', 'month', 'year', 'machine', 'machine no', 'machine number', 'part number', 'part no',
+    'shift', 'line', 'operator', 'station', 'lot', 'lot no', 'batch'
+}
+
+def kunshan_counts_column(column):
+    name = str(column).strip().lower().rstrip('.')
+    return name not in KUNSHAN_LABEL_COLUMNS and 'ppm' not in name and '%' not in name
+
+def rollup_columns(kind, df):
+    """(key columns, summed columns) of a frame's rollup, or None if it lacks the key columns"""
+    if kind == 'kunshan':
+        keys = ['date']
+        measures = [column for column in df.columns
+                    if column != 'date' and df[column].dtype.kind in 'iuf' and kunshan_counts_column(column)]
+    else:
+        keys = BRUSHCARD_ROLLUP_KEYS
+        measures = [BRUSHCARD_QUANTITY_COLUMN, BRUSHCARD_INSPECTED_COLUMN]
+    if not all(column in df.columns for column in keys + measures):
+        return None
+    return keys, measures
+
+def partial_rollup(kind, df):
+    """Sums of df's count columns per rollup key, or None if df has no rollup"""
+    columns = rollup_columns(kind, df)
+    if columns is None:
+        return None
+    keys, measures = columns
+    return df.groupby(keys, observed=True, dropna=False, sort=False)[measures].sum().reset_index()
+
+def cached_partial_rollup(plant, filename, digest, sheet_name, kind, df):
+    """partial_rollup() of a parsed sheet, through the parse cache"""
+    cache = get_parse_cache()
+    key = hashlib.sha256(json.dumps([
+        'rollup', ROLLUP_VERSION, digest, plant, PARSER_VERSION, app.config['READ_ENGINE'], sheet_name, kind, filename
+    ]).encode('utf-8')).hexdigest()
+    partial = cache.get(key) if cache else None
+    if partial is None:
+        partial = partial_rollup(kind, df)
+        if cache and partial is not None:
+            cache.put(key, partial)
+    return partial
+
+def finish_rollup(kind, partials):
+    """Add up partial rollups (or raw frames) into the rollup sheet, with its rate column"""
+    partials = [partial for partial in partials if partial is not None]
+    if not partials:
+        return None
+    combined = pd.concat(partials, ignore_index=True) if len(partials) > 1 else partials[0]
+    columns = rollup_columns(kind, combined)
+    if columns is None:
+        return None
+    keys, measures = columns
+    rollup = combined.groupby(keys, observed=True, dropna=False, sort=False)[measures].sum().reset_index()
+    try:
+        rollup = rollup.sort_values(keys, na_position='last', kind='stable', ignore_index=True)
+    except TypeError:
+        # Keys of mixed types (stray text in a date column) have no order; keep first appearance
+        pass
+
+    if kind == 'kunshan':
+        quantity = next((column for column in measures if str(column).strip().lower().startswith('qty')), None)
+        total = next((column for column in measures if str(column).strip().lower() == 'total final inspection'), None)
+        if quantity is None or total is None:
+            return rollup
+        numerator, denominator, rate_column, scale = rollup[total], rollup[quantity], KUNSHAN_PPM_COLUMN, 1e6
+    else:
+        numerator, denominator = rollup[BRUSHCARD_QUANTITY_COLUMN], rollup[BRUSHCARD_INSPECTED_COLUMN]
+        rate_column, scale = DEFECT_RATE_COLUMN, 1
+
+    numerator = numerator.to_numpy(dtype=float, na_value=np.nan)
+    denominator = denominator.to_numpy(dtype=float, na_value=np.nan)
+    rate = np.full(len(rollup), np.nan)
+    np.divide(numerator * scale, denominator, out=rate, where=denominator > 0)
+    rollup[rate_column] = rate
+    return rollup
+
+def write_rollup(writer, sheet_name, rollup):
+    """Write a rollup sheet, if there is one; False if it failed"""
+    if rollup is None:
+        return True
+    try:
+        writer.write_frame(sheet_name, rollup)
+        print(f"📊 {sheet_name} sheet created with {len(rollup)} rows")
+        return True
+    except Exception as e:
+        print(f"❌ Error creating {sheet_name} sheet: {e}")
+        return False
 
-        # Create the Excel writer here, after we know we have data to write
-        writer = pd.ExcelWriter(combined_output, engine='openpyxl')
+# === Excel Processing Logic ===
+def parse_uploads(sources, plant, progress):
+    """Parse every selected sheet of the given uploads.
+
+    Yields (filename, digest, sheet_name, kind, df) in upload order; df is None
+    for sheets that could not be parsed or had no data.
+    """
+    tasks = []
+    keys = []
+    owners = []
+    # Index of the last parse task of each file, to report files as done
+    file_ends = set()
+    for filename, path, sheet_names, digest, _, _ in sources:
+        if plant == "anhui":
+            file_tasks = plan_anhui_tasks(filename, sheet_names)
+        else:
+            file_tasks = [(sheet_name, 'kunshan') for sheet_name in sheet_names
+                          if sheet_name.strip() in KUNSHAN_SHEET_MAPPING]
+        for sheet_name, kind in file_tasks:
+            tasks.append((path, filename, sheet_name, kind))
+            # Anhui frames carry the client name, which comes from the filename
+            client_name = '' if kind == 'kunshan' else extract_client_name(filename, None if kind == 'chokes' else sheet_name)
+            keys.append(parse_cache_key(digest, plant or 'kunshan', sheet_name, kind, client_name))
+            owners.append(digest)
+        if file_tasks:
+            file_ends.add(len(tasks) - 1)
+    progress.add(files_total=len(sources), files_done=len(sources) - len(file_ends), sheets_total=len(tasks))
+
+    for digest, ((_, filename, sheet_name, kind), df) in zip(owners, track_parse_results(tasks, file_ends, progress, keys)):
+        yield filename, digest, sheet_name, kind, df
+
+def column_slots(columns):
+    """(name, occurrence) of each column label, so repeated header names line up in order"""
+    seen = {}
+    slots = []
+    for label in columns:
+        name = None if not isinstance(label, str) and pd.isna(label) else label
+        occurrence = seen.get(name, 0)
+        seen[name] = occurrence + 1
+        slots.append((name, occurrence))
+    return slots
+
+def align_columns(frames):
+    """Reindex frames to the union of their columns, matched by name in first-seen order.
+
+    Files whose headers differ (reordered, added or missing columns) then stack
+    column for column; a column a file lacks is left empty for its rows.
+    """
+    frame_slots = [column_slots(df.columns) for df in frames]
+    union = list(OrderedDict.fromkeys(slot for slots in frame_slots for slot in slots))
+    templates = {}
+    for df, slots in zip(frames, frame_slots):
+        for position, slot in enumerate(slots):
+            templates.setdefault(slot, (df.columns[position], df.iloc[:0, position]))
+
+    aligned = []
+    for df, slots in zip(frames, frame_slots):
+        if slots == union:
+            aligned.append(df)
+            continue
+        positions = dict(zip(slots, range(len(slots))))
+        # Missing columns are all-missing series of the column's dtype elsewhere
+        columns = {index: df.iloc[:, positions[slot]] if slot in positions else templates[slot][1].reindex(df.index)
+                   for index, slot in enumerate(union)}
+        frame = pd.DataFrame(columns, index=df.index)
+        frame.columns = [templates[slot][0] for slot in union]
+        frame.attrs = df.attrs
+        aligned.append(frame)
+    return aligned
+
+def concat_typed(frames):
+    """Concatenate normalized frames, aligned by column name, and report the memory their typed columns save.
+
+    Categoricals with different categories concatenate to object, so the result
+    is normalized again.
+    """
+    before = sum(df.attrs.get('dtype_savings', (0, 0))[0] for df in frames)
+    after = sum(df.attrs.get('dtype_savings', (0, 0))[1] for df in frames)
+    combined = pd.concat(align_columns(frames), ignore_index=True)
+    normalize_dtypes(combined)
+    combined.attrs['dtype_savings'] = (before, after)
+    return combined
+
+def write_kunshan_sheet(writer, sheet_name, df):
+    """Write one Kunshan output sheet; False if it failed"""
+    try:
+        writer.write_frame(sheet_name, df)
+        detail(f"   ✅ Created sheet '{sheet_name}' with {len(df)} rows")
+        report_dtype_savings(sheet_name, *df.attrs.get('dtype_savings', (0, 0)))
+        return True
+    except Exception as e:
+        print(f"   ❌ Error writing sheet '{sheet_name}': {e}")
+        return False
+
+def write_combined(plant, contributions, writer, files_count, dedup=None, rollups=False):
+    """Merge parsed sheets, in order, into the output sheets of the plant's workbook.
+
+    Every output sheet is written once, with the rows of all the files that map
+    to it in upload order, under the union of their headers (columns matched by
+    name, see align_columns). With dedup ('first' or 'latest'), rows repeated across files are dropped
+    from every output sheet. With rollups, rollup sheets follow the Brushcards
+    and Kunshan station sheets. Returns how many output sheets could not be written.
+    """
+    # Without dedup, rollups are added up from each source sheet's cached partial rollup
+    partial_rollups = rollups and not dedup
+    failed = 0
+    if plant == "anhui":
+        brushcard_final = []
+        chokes_final = []
+        brushcard_owners = []
+        chokes_owners = []
+        brushcard_rollups = []
+        for upload, (filename, digest, sheet_name, kind, df) in number_uploads(contributions):
+            if df is None:
+                continue
+            if kind == 'chokes':
+                chokes_final.append(df)
+                chokes_owners.append((upload, filename))
+            else:
+                brushcard_final.append(df)
+                brushcard_owners.append((upload, filename))
+                if partial_rollups:
+                    brushcard_rollups.append(cached_partial_rollup(plant, filename, digest, sheet_name, kind, df))
+                if 'schema_mismatch' in df.attrs:
+                    record_schema_mismatch(filename, sheet_name, df.attrs['schema_mismatch'])
+            detail(f"   ✅ Added {len(df)} {kind} rows from sheet '{sheet_name}' in {filename}")
 
         # Write outputs
-        print(f"📊 Summary: brushcard_final has {len(brushcard_final)} items, chokes_final has {len(chokes_final)} items")
+        detail(f"📊 Summary: brushcard_final has {len(brushcard_final)} items, chokes_final has {len(chokes_final)} items")
 
         # Write chokes data (keep original structure)
         if chokes_final:
             try:
-                combined_chokes = pd.concat(chokes_final, ignore_index=True)
-                combined_chokes.to_excel(writer, sheet_name='Chokes', index=False)
-                sheets_written += 1
+                combined_chokes = combine_sheet_frames(plant, 'Chokes', chokes_final, chokes_owners, dedup)
+                writer.write_frame('Chokes', combined_chokes)
                 print(f"📊 Chokes sheet created with {len(combined_chokes)} total rows")
-                print(f"📋 Chokes columns: {list(combined_chokes.columns)}")
+                report_dtype_savings('Chokes', *combined_chokes.attrs.get('dtype_savings', (0, 0)))
             except Exception as e:
                 print(f"❌ Error creating Chokes sheet: {e}")
+                failed += 1
         else:
             # Create empty chokes sheet with basic headers
-            empty_chokes_df = pd.DataFrame(columns=['客户名称\nClient Name'])
-            empty_chokes_df.to_excel(writer, sheet_name='Chokes', index=False)
-            sheets_written += 1
+            empty_chokes_df = pd.DataFrame(columns=[CLIENT_NAME_COLUMN])
+            writer.write_frame('Chokes', empty_chokes_df)
             print("📊 Chokes sheet created (empty)")
 
         # Write brushcard data
         if brushcard_final:
             try:
-                combined_brushcard = pd.concat(brushcard_final, ignore_index=True)
-                combined_brushcard.to_excel(writer, sheet_name='Brushcards', index=False)
-                sheets_written += 1
+                combined_brushcard = combine_sheet_frames(plant, 'Brushcards', brushcard_final, brushcard_owners, dedup)
+                writer.write_frame('Brushcards', combined_brushcard)
                 print(f"📊 Brushcards sheet created with {len(combined_brushcard)} total rows")
+                report_dtype_savings('Brushcards', *combined_brushcard.attrs.get('dtype_savings', (0, 0)))
+                if rollups:
+                    failed += not write_rollup(writer, BRUSHCARD_ROLLUP_SHEET, finish_rollup(
+                        'brushcards', brushcard_rollups if partial_rollups else [combined_brushcard]))
             except Exception as e:
                 print(f"❌ Error creating Brushcards sheet: {e}")
+                failed += 1
         else:
             # Create empty brushcard sheet with headers
-            empty_brushcard_df = pd.DataFrame(columns=[
-                '生产日期\nProduction Date', '检验日期\nInspection Date', '型号\nType',
-                '不良部位\nDefective Part', '不良名称\nDefect Name', '数量\nQuantity',
-                '处理方式\nHandling method', '原因\nCause of defect', '检验站别\nInspection station',
-                '当日检数量\nInspection quantity', '备注\nRemark', '客户名称\nClient Name'
-            ])
-            empty_brushcard_df.to_excel(writer, sheet_name='Brushcards', index=False)
-            sheets_written += 1
+            empty_brushcard_df = pd.DataFrame(columns=BRUSHCARD_COLUMNS + [CLIENT_NAME_COLUMN])
+            writer.write_frame('Brushcards', empty_brushcard_df)
             print("📊 Brushcards sheet created (empty)")
 
-        # Close the writer
-        writer.close()
-        print("✅ Excel writer closed successfully")
-
-        combined_output.seek(0)
-        return combined_output
-
     else:
         # === Kunshan logic ===
-        # Create the Excel writer for Kunshan
-        print("🔧 Creating Excel writer for Kunshan...")
-        writer = pd.ExcelWriter(combined_output, engine='openpyxl')
-        print(f"🔧 Writer created successfully: {writer is not None}")
-
-        # Fixed sheet names mapping
-        kunshan_sheet_mapping = {
-            "Date": "WindingStationRodChoke",
-            "Data": ["GluingStationRodChoke", "RodChokeFinalInspection", "FuseChokeFinalInspection"],
-            "Inspection data": "WindingStationFuseChoke"
-        }
-
-        print(f"🔍 Processing {len(uploaded_files)} files for Kunshan plant...")
-
-        # Global counter for Data sheets across all files
+        # Global counter for Data sheets across all files, in arrival order
         data_sheet_counter = 0
+        # Several files can map to the same output sheet, so an output sheet's
+        # frames are collected and written together once all files are in
+        pending = OrderedDict()
+        # Output sheet -> partial rollups of its frames (or the deduplicated frame)
+        kunshan_rollups = OrderedDict()
+        for upload, (filename, digest, sheet_name, kind, df) in number_uploads(contributions):
+            new_sheet_name, data_sheet_counter = kunshan_sheet_name(filename, sheet_name, data_sheet_counter)
+            if df is None:
+                continue
+            # Ensure sheet name is within Excel limits (31 characters)
+            final_sheet_name = new_sheet_name[:31]
+            frames, owners = pending.setdefault(final_sheet_name, ([], []))
+            frames.append(df)
+            owners.append((upload, filename))
+            if partial_rollups:
+                kunshan_rollups.setdefault(final_sheet_name, []).append(
+                    cached_partial_rollup(plant or 'kunshan', filename, digest, sheet_name, kind, df))
+
+        for final_sheet_name, (frames, owners) in pending.items():
+            try:
+                df = combine_sheet_frames(plant, final_sheet_name, frames, owners, dedup)
+            except Exception as e:
+                print(f"   ❌ Error combining sheet '{final_sheet_name}': {e}")
+                failed += 1
+                continue
+            failed += not write_kunshan_sheet(writer, final_sheet_name, df)
+            if rollups and not partial_rollups:
+                kunshan_rollups[final_sheet_name] = [df]
 
-        for file in uploaded_files:
-            if file and allowed_file(file.filename):
-                try:
-                    filename = file.filename
-                    print(f"📂 Processing file: {filename}")
-                    file_stream = BytesIO(file.read())
-                    xls = pd.ExcelFile(file_stream, engine='openpyxl')
-                    print(f"   📋 Available sheets: {xls.sheet_names}")
-
-                    # Process each sheet according to the mapping
-
-                    for sheet_name in xls.sheet_names:
-                        sheet_name_clean = sheet_name.strip()
-                        new_sheet_name = None
-
-                        # Determine the new sheet name based on mapping
-                        if sheet_name_clean == "Date":
-                            new_sheet_name = kunshan_sheet_mapping["Date"]
-                        elif sheet_name_clean == "Data":
-                            # Handle multiple Data sheets
-                            print(f"   📊 Found Data sheet #{data_sheet_counter + 1}")
-                            if data_sheet_counter < len(kunshan_sheet_mapping["Data"]):
-                                new_sheet_name = kunshan_sheet_mapping["Data"][data_sheet_counter]
-                                print(f"   🎯 Mapping Data sheet #{data_sheet_counter + 1} → {new_sheet_name}")
-                                data_sheet_counter += 1
-                            else:
-                                print(f"   ⚠️ More 'Data' sheets found than expected in {filename}")
-                                new_sheet_name = f"Data_{data_sheet_counter + 1}"
-                                data_sheet_counter += 1
-                        elif sheet_name_clean == "Inspection data":
-                            new_sheet_name = kunshan_sheet_mapping["Inspection data"]
-                        else:
-                            # Skip sheets that are not in our mapping
-                            print(f"   ⏭️ Skipping sheet '{sheet_name_clean}' (not in predefined mapping)")
-                            continue
-
-                        if new_sheet_name:
-                            try:
-                                print(f"   🎯 Processing sheet: {sheet_name_clean} → {new_sheet_name}")
-                                print(f"   🔧 Writer object exists: {writer is not None}")
-
-                                df_raw = pd.read_excel(xls, sheet_name=sheet_name_clean, engine='openpyxl', header=None)
-                                df_trimmed = df_raw.iloc[2:].reset_index(drop=True)
-                                df_trimmed.columns = df_trimmed.iloc[0]
-                                df = df_trimmed.iloc[1:].reset_index(drop=True)
-
-                                # Standardize column names
-                                new_columns = {}
-                                for col in df.columns:
-                                    col_lower = str(col).strip().lower()
-                                    if col_lower in ['day', 'inspect date']:
-                                        new_columns[col] = 'date'
-                                df.rename(columns=new_columns, inplace=True)
-
-                                # Remove 'type' columns
-                                df.drop(columns=[col for col in df.columns if str(col).strip().lower() == 'type'], inplace=True)
-
-                                # Ensure sheet name is within Excel limits (31 characters)
-                                final_sheet_name = new_sheet_name[:31]
-                                print(f"   📝 About to write to sheet: {final_sheet_name}")
-                                df.to_excel(writer, sheet_name=final_sheet_name, index=False)
-
-                                print(f"   ✅ Created sheet '{final_sheet_name}' with {len(df)} rows")
-
-                            except Exception as e:
-                                print(f"   ❌ Error processing sheet '{sheet_name_clean}' in {filename}: {e}")
-                                import traceback
-                                traceback.print_exc()
-
-                except Exception as e:
-                    print(f"❌ Error processing file {filename}: {e}")
+        for final_sheet_name, partials in kunshan_rollups.items():
+            failed += not write_rollup(writer, (final_sheet_name + KUNSHAN_ROLLUP_SUFFIX)[:31],
+                                       finish_rollup('kunshan', partials))
 
         # Check if any sheets were created, if not create a summary sheet
         if not writer.sheets:
@@ -400,18 +3427,328 @@ def process_excel_files(uploaded_files, sheet_names_list, new_sheet_names_list=N
                 "Status": ["No Data Processed"],
                 "Message": ["No valid sheets found matching the predefined mapping"],
                 "Expected_Sheets": ["Date, Data (multiple), Inspection data"],
-                "Files_Processed": [len(uploaded_files)]
+                "Files_Processed": [files_count]
             })
-            summary_df.to_excel(writer, sheet_name="Summary", index=False)
-
-        writer.close()
+            writer.write_frame("Summary", summary_df)
+    return failed
+
+def process_excel_files(uploaded_files, sheet_names_list, new_sheet_names_list=None, plant=None, streaming=None, engine=None, progress=None, incremental=None,
+                        output=None, output_format='xlsx', sheet=None, dedup=None, rollups=None):
+    """Combine the uploads into one output and return it.
+
+    The output is an xlsx workbook in a rewound spooled file by default. With
+    output given, the result (in output_format, optionally only one sheet) is
+    written to that stream instead. dedup is 'first', 'latest' or False, and
+    defaults to DEDUP_KEEP when DEDUP_ROWS is on; rollups defaults to ROLLUPS.
+    """
+    if incremental is None:
+        incremental = app.config['INCREMENTAL_COMBINE']
+    if streaming is None:
+        streaming = app.config['STREAMING_COMBINE']
+    if dedup is None:
+        dedup = app.config['DEDUP_KEEP'] if app.config['DEDUP_ROWS'] else False
+    if dedup and dedup not in DEDUP_POLICIES:
+        raise ValueError(f"Unknown dedup policy {dedup!r}; use one of: {', '.join(DEDUP_POLICIES)}")
+    if rollups is None:
+        rollups = app.config['ROLLUPS']
+    progress = progress or CombineProgress()
+    timer = CombineTimer(plant or 'kunshan', 'incremental' if incremental else 'streaming' if streaming else 'batch')
+    export = {'output': output, 'output_format': output_format, 'sheet': sheet}
+    try:
+        # The incremental store is built from parsed frames, so it takes precedence
+        if streaming and not incremental:
+            if dedup or rollups:
+                print("⚠️ Row dedup and rollups need whole frames; the streaming pipeline writes rows unchanged")
+            combined_output = stream_excel_files(uploaded_files, plant=plant, engine=engine, progress=progress,
+                                                 timer=timer, **export)
+        else:
+            combined_output = combine_uploads(uploaded_files, plant, engine, progress, incremental, timer,
+                                              dedup=dedup, rollups=rollups, **export)
+    except Exception:
+        timer.finish('error')
+        raise
+    timer.finish('partial' if progress.counts['failed'] else 'ok')
+    return combined_output
+
+def combine_uploads(uploaded_files, plant, engine, progress, incremental, timer,
+                    output=None, output_format='xlsx', sheet=None, dedup=False, rollups=False):
+    """Parse (or load from the combined store) and write the uploads, timing each stage"""
+    combined_output = output if output is not None else new_output_buffer()
+    with timer.stage('read'):
+        sources = read_uploads(uploaded_files, timer, progress)
+    print(f"🔍 Processing {len(uploaded_files)} files for {(plant or 'kunshan').capitalize()} plant...")
+
+    # write_combined pulls parsed sheets and writes as it goes; the rest of its time is merging
+    merging = ('parse', 'load', 'write')
+    try:
+        if incremental:
+            # Only new or changed files are parsed; everything else comes from the store
+            store = get_combined_store(plant or 'kunshan')
+            with store.lock:
+                changed = [upload for upload in sources if not store.has(upload.filename, upload.digest)]
+                progress.add(files_total=len(sources) - len(changed), files_done=len(sources) - len(changed))
+                with timer.stage('parse'):
+                    store.update(parse_uploads(changed, plant, progress))
+                writer = TimedWriter(create_output_writer(combined_output, engine, output_format=output_format, sheet=sheet), timer)
+                with timer.stage('transform', exclude=merging):
+                    progress.add(failed=write_combined(plant, timer.timed(store.contributions(), 'load'), writer,
+                                                       len(store.files), dedup, rollups))
+        else:
+            writer = TimedWriter(create_output_writer(combined_output, engine, output_format=output_format, sheet=sheet), timer)
+            with timer.stage('transform', exclude=merging):
+                progress.add(failed=write_combined(plant, timer.timed(parse_uploads(sources, plant, progress), 'parse'),
+                                                   writer, len(uploaded_files), dedup, rollups))
+    finally:
+        release_uploads(sources)
+
+    writer.close()
+    timer.bytes_out = combined_output.tell()
+    if output is None:
         combined_output.seek(0)
-        return combined_output
+    return combined_output
+
+# === Combine jobs ===
+# A job persists its uploads and status under JOBS_DIR/<job_id>/, so any process
+# (in-process thread pool or a broker-backed worker) can run it and any web
+# worker can report on it.
+COMBINE_TASK_NAME = 'excel_combiner.run_combine_job'
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+def job_dir(job_id):
+    return os.path.join(app.config['JOBS_DIR'], job_id)
+
+def read_job(job_id):
+    """Return the status record of a job, or None if it does not exist"""
+    if not JOB_ID_PATTERN.fullmatch(job_id):
+        return None
+    try:
+        with open(os.path.join(job_dir(job_id), 'job.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_job(job):
+    # Write then rename, so status readers never see a half-written record
+    path = os.path.join(job_dir(job['id']), 'job.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(path + '.tmp', path)
+
+def create_job(plant, uploaded_files, options):
+    """Persist the uploads of a combine request and return its job record"""
+    job_id = uuid.uuid4().hex
+    upload_dir = os.path.join(job_dir(job_id), 'uploads')
+    os.makedirs(upload_dir)
+
+    filenames = []
+    for index, file in enumerate(uploaded_files):
+        if file and allowed_file(file.filename):
+            save_upload(file, os.path.join(upload_dir, str(index)))
+            filenames.append((str(index), file.filename))
+
+    job = {
+        'id': job_id,
+        'plant': plant,
+        'status': 'queued',
+        'options': options,
+        'files': filenames,
+        'progress': dict.fromkeys(CombineProgress.FIELDS, 0),
+        'error': None,
+        'created': time.time(),
+        'finished': None
+    }
+    write_job(job)
+    return job
+
+def run_combine_job(job_id):
+    """Run a queued combine job to completion; the entry point for every job queue backend"""
+    job = read_job(job_id)
+    if job is None:
+        print(f"❌ Unknown job {job_id}")
+        return
+    job['status'] = 'running'
+    write_job(job)
+
+    last_write = [0.0]
+    def on_progress(counts):
+        # Status is polled, so at most a few writes per second are useful
+        job['progress'] = counts
+        now = time.monotonic()
+        if now - last_write[0] >= 0.5:
+            last_write[0] = now
+            write_job(job)
+
+    upload_dir = os.path.join(job_dir(job_id), 'uploads')
+    uploaded_files = [
+        FileStorage(stream=open(os.path.join(upload_dir, name), 'rb'), filename=filename)
+        for name, filename in job['files']
+    ]
+    try:
+        output = process_excel_files(uploaded_files, [], plant=job['plant'],
+                                     progress=CombineProgress(on_progress), **job['options'])
+        with open(os.path.join(job_dir(job_id), 'result.xlsx'), 'wb') as f:
+            shutil.copyfileobj(output, f)
+        output.close()
+        job['status'] = 'done'
+    except Exception as e:
+        print(f"❌ Job {job_id} failed: {e}")
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    finally:
+        for file in uploaded_files:
+            file.close()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    job['finished'] = time.time()
+    write_job(job)
+
+def delete_expired_jobs():
+    """Delete jobs finished more than JOB_TTL_SECONDS ago.
+
+    A queued or running job writes its record at least on every status change,
+    so one untouched for that long lost its worker: it is failed, and deleted
+    once it has been failed for JOB_TTL_SECONDS as well.
+    """
+    if not os.path.isdir(app.config['JOBS_DIR']):
+        return
+    now = time.time()
+    cutoff = now - app.config['JOB_TTL_SECONDS']
+    for job_id in os.listdir(app.config['JOBS_DIR']):
+        job = read_job(job_id)
+        if not job:
+            continue
+        if job['finished']:
+            if job['finished'] < cutoff:
+                shutil.rmtree(job_dir(job_id), ignore_errors=True)
+                print(f"🧹 Deleted expired job: {job_id}")
+            continue
+        try:
+            updated = os.path.getmtime(os.path.join(job_dir(job_id), 'job.json'))
+        except FileNotFoundError:
+            continue
+        if updated < cutoff:
+            shutil.rmtree(os.path.join(job_dir(job_id), 'uploads'), ignore_errors=True)
+            job['error'] = f"Job was {job['status']} with no progress for {now - updated:.0f}s; its worker is gone"
+            job['status'] = 'failed'
+            job['finished'] = now
+            write_job(job)
+            print(f"🧹 Failed abandoned job: {job_id}")
+
+class InProcessJobQueue:
+    """Runs jobs on a thread pool inside the web process"""
+
+    def __init__(self, max_workers):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='combine-job')
+
+    def submit(self, job_id):
+        self.executor.submit(run_combine_job, job_id)
+
+    def shutdown(self):
+        # Queued jobs live in this process only, so finish them before it exits
+        self.executor.shutdown(wait=True)
+
+class CeleryJobQueue:
+    """Hands jobs to a Celery worker through a broker.
+
+    Pass any Celery app; e.g. one configured with the in-memory broker and
+    task_always_eager stands in for Redis locally.
+    """
+
+    def __init__(self, celery_app):
+        self.task = celery_app.task(name=COMBINE_TASK_NAME)(run_combine_job)
+
+    def submit(self, job_id):
+        self.task.delay(job_id)
+
+    def shutdown(self):
+        pass
+
+def make_celery(broker_url=None):
+    """A Celery app on CELERY_BROKER_URL with the combine job task registered"""
+    from celery import Celery
+    celery_app = Celery('excel_combiner', broker=broker_url or app.config['CELERY_BROKER_URL'])
+    celery_app.task(name=COMBINE_TASK_NAME)(run_combine_job)
+    return celery_app
+
+_job_queue = None
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        if app.config['JOB_QUEUE'] == 'celery':
+            # The same Celery app the workers run, so both sides agree on its configuration
+            from tasks import celery_app
+            _job_queue = CeleryJobQueue(celery_app)
+        else:
+            _job_queue = InProcessJobQueue(app.config['JOB_WORKERS'])
+    return _job_queue
+
+def set_job_queue(queue):
+    """Replace the job queue backend (e.g. with a local stand-in)"""
+    global _job_queue
+    _job_queue = queue
+
+def shutdown_job_queue():
+    """Wait for the jobs this process accepted; for worker processes that are about to exit"""
+    if _job_queue is not None:
+        _job_queue.shutdown()
+
+def job_urls(job_id):
+    return {
+        'status_url': url_for('job_status', job_id=job_id),
+        'download_url': url_for('job_download', job_id=job_id)
+    }
 
 # === Reusable POST Logic ===
+def requested_output_format():
+    """The export format for this request, from ?format= or else the Accept header.
+
+    Returns None when neither names a format we can produce.
+    """
+    output_format = request.values.get('format', '').strip().lower()
+    if output_format:
+        return output_format if output_format in OUTPUT_FORMATS else None
+    if not request.accept_mimetypes:
+        return 'xlsx'
+    best = request.accept_mimetypes.best_match(list(ACCEPT_FORMATS))
+    return ACCEPT_FORMATS[best] if best else None
+
+def export_filename(plant, output_format, sheet):
+    if output_format == 'parquet' and not sheet:
+        return f"{plant}_combined_parquet.zip"
+    name = f"{plant}_combined_{sheet}" if sheet else f"{plant}_combined"
+    return secure_filename(name) + '.' + output_format
+
+def mark_result(response, key):
+    """Tag a combine response with its result key as ETag, and where to fetch it again.
+
+    The ETag is weak: a recombined workbook holds the same data but a new
+    creation timestamp.
+    """
+    if key:
+        response.set_etag(key, weak=True)
+        response.headers['Content-Location'] = url_for('result_download', key=key)
+    return response
+
+def send_result(key, entry, file):
+    response = send_file(file, as_attachment=True, download_name=entry['filename'], mimetype=entry['mimetype'])
+    response.content_length = entry['size']
+    return mark_result(response, key)
+
+def result_not_modified(key):
+    return mark_result(Response(status=304), key)
+
 def handle_post_request(plant):
     uploaded_files = request.files.getlist('files')
 
+    output_format = requested_output_format()
+    if output_format is None:
+        return f"Error: Unsupported output format. Choose one of: {', '.join(OUTPUT_FORMATS)}.", 406
+    sheet = request.values.get('sheet', '').strip() or None
+    if output_format == 'csv' and not sheet:
+        return "Error: CSV output holds one sheet; pass sheet=<name>, or use format=zip for all sheets.", 400
+
     # For Kunshan, we no longer need sheet names input as they are predefined
     if plant == "kunshan":
         sheet_names_input = None
@@ -428,15 +3765,217 @@ def handle_post_request(plant):
     sheet_names_list = [group.strip().split(',') for group in sheet_names_input.strip().split(';')] if sheet_names_input else []
     new_sheet_names_list = [group.strip().split(',') for group in new_sheet_names_input.strip().split(';')] if new_sheet_names_input else None
 
-    output = process_excel_files(uploaded_files, sheet_names_list, new_sheet_names_list, plant=plant)
+    # Per-request opt-in to the bounded-memory streaming pipeline
+    streaming = True if request.form.get('streaming') in ('1', 'true', 'on') else None
+
+    # Per-request opt-in to updating the plant's incremental combined store
+    incremental = True if request.form.get('incremental') in ('1', 'true', 'on') else None
+
+    # Per-request row dedup: dedup=first|latest, or 1/0 for DEDUP_KEEP / no dedup
+    dedup = request.form.get('dedup', '').strip().lower() or None
+    if dedup in ('1', 'true', 'on'):
+        dedup = app.config['DEDUP_KEEP']
+    elif dedup in ('0', 'false', 'off'):
+        dedup = False
+    elif dedup is not None and dedup not in DEDUP_POLICIES:
+        return f"Error: Unknown dedup policy. Choose one of: {', '.join(DEDUP_POLICIES)}.", 400
+
+    # Per-request opt-in to the rollup sheets
+    rollups = True if request.form.get('rollups') in ('1', 'true', 'on') else None
+
+    # Job mode: queue the combine and answer right away with the job id
+    if request.form.get('job') in ('1', 'true', 'on'):
+        if output_format != 'xlsx':
+            return "Error: Background jobs produce xlsx only.", 400
+        job = create_job(plant, uploaded_files, {'streaming': streaming, 'incremental': incremental,
+                                                    'dedup': dedup, 'rollups': rollups})
+        get_job_queue().submit(job['id'])
+        return jsonify({'job_id': job['id'], 'status': job['status'], **job_urls(job['id'])}), 202
+
+    if output_format == 'xlsx':
+        mimetype = XLSX_MIMETYPE
+        filename = f"{plant}_combined.xlsx"
+    else:
+        mimetype = OUTPUT_FORMATS['zip'] if output_format == 'parquet' and not sheet else OUTPUT_FORMATS[output_format]
+        filename = export_filename(plant, output_format, sheet)
+
+    # The same uploads and options always give the same bytes, so they are served
+    # from the result store when possible. The incremental store's output also
+    # depends on earlier uploads, so it is always combined.
+    store = get_result_store()
+    key = None
+    if store and not (app.config['INCREMENTAL_COMBINE'] if incremental is None else incremental):
+        if dedup is None:
+            dedup_policy = app.config['DEDUP_KEEP'] if app.config['DEDUP_ROWS'] else False
+        else:
+            dedup_policy = dedup
+        key = result_key(plant, uploaded_files, {
+            'format': output_format, 'sheet': sheet,
+            'streaming': app.config['STREAMING_COMBINE'] if streaming is None else streaming,
+            'sheet_names': sheet_names_list, 'new_sheet_names': new_sheet_names_list,
+            'dedup': [dedup_policy, app.config['DEDUP_KEYS']] if dedup_policy else False,
+            'rollups': ROLLUP_VERSION if (app.config['ROLLUPS'] if rollups is None else rollups) else False
+        })
+        # The client already holds this result; 304 spares it the upload's answer
+        # (a POST would strictly get 412, which clients treat as a failure)
+        if request.if_none_match.contains_weak(key):
+            metrics.inc('result_requests_total', plant=plant, outcome='not_modified')
+            return result_not_modified(key)
+        entry, file = store.open(key)
+        if entry:
+            metrics.inc('result_requests_total', plant=plant, outcome='hit')
+            return send_result(key, entry, file)
+        metrics.inc('result_requests_total', plant=plant, outcome='miss')
+
+    # A combine that lost a file or sheet to an error is sent but never stored,
+    # so a transient failure isn't served to everyone asking for the same inputs
+    progress = CombineProgress()
+
+    if output_format != 'xlsx':
+        # Other formats are sent while the combine is still writing them
+        detached = detach_uploads(uploaded_files)
+
+        def combine(output):
+            process_excel_files(detached, sheet_names_list, new_sheet_names_list, plant=plant,
+                                streaming=streaming, incremental=incremental, dedup=dedup, rollups=rollups,
+                                progress=progress, output=output, output_format=output_format, sheet=sheet)
+
+        def produce(output):
+            if not key:
+                combine(output)
+                return
+            stages = []
+
+            def write(f):
+                tee = TeeStream(output, f)
+                stages.append('combining')
+                combine(tee)
+                stages.append('combined')
+                if tee.copy_error:
+                    print(f"❌ Could not store result {key}: {tee.copy_error}")
+                return tee.copy_error is None and not progress.counts['failed']
 
-    filename = f"{plant}_combined.xlsx"
-    return send_file(
-        output,
-        as_attachment=True,
-        download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+            try:
+                store.put(key, write, filename=filename, mimetype=mimetype)
+            except OSError as e:
+                # Errors of the store itself; the combine's own are the client's to see
+                if stages == ['combining']:
+                    raise
+                print(f"❌ Could not store result {key}: {e}")
+                if not stages:
+                    combine(output)
+
+        # No ETag: the headers go out before the combine has finished, and a
+        # failed stream is not stored. Asking again serves the stored result with one.
+        response = Response(stream_output(produce), content_type=mimetype,
+                            headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+        # Runs after the stream is closed, which waits for the combine to let go of the files
+        response.call_on_close(lambda: close_detached_uploads(detached))
+        return response
+
+    output = process_excel_files(uploaded_files, sheet_names_list, new_sheet_names_list, plant=plant,
+                                 streaming=streaming, incremental=incremental, dedup=dedup, rollups=rollups,
+                                 progress=progress)
+    if progress.counts['failed']:
+        key = None
+    if key:
+        try:
+            store.put(key, lambda f: shutil.copyfileobj(output, f), filename=filename, mimetype=mimetype)
+        except OSError as e:
+            print(f"❌ Could not store result {key}: {e}")
+        output.seek(0)
+
+    response = send_file(output, as_attachment=True, download_name=filename, mimetype=mimetype)
+    return mark_result(response, key)
+
+# === Startup ===
+# Importing the app only loads Flask; nothing starts until the first request
+# (or the server's own hook) calls start_app_services(). The warm-up then loads
+# pandas and the workbook reader/writers by running a tiny workbook through
+# them, so the first real combine doesn't pay for it, and /ready reports when
+# that is done.
+WARMUP_SHEET = '质量汇总表'
+_warm_up_state = {'status': 'cold', 'seconds': None, 'error': None}
+_warm_up_lock = threading.Lock()
+_warm_up_done = threading.Event()
+_services_lock = threading.Lock()
+_services_started = False
+
+def write_warm_up_workbook(path):
+    """A one-row Brushcards workbook, enough to go through every parse and write step"""
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path)
+    worksheet = workbook.add_worksheet(WARMUP_SHEET)
+    worksheet.write_row(0, 0, BRUSHCARD_COLUMNS)
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    worksheet.write_datetime(1, 0, datetime.datetime(2025, 1, 2), date_format)
+    worksheet.write_datetime(1, 1, datetime.datetime(2025, 1, 3), date_format)
+    worksheet.write_row(1, 2, ['T-1', 'Part', 'Defect', 1, 'Rework', 'Cause', 'Station', 100, ''])
+    workbook.close()
+
+def warm_up(start_pool=True):
+    """Load the Excel stack and parse and write a tiny workbook; safe to call more than once.
+
+    start_pool also starts the parse pool's processes when PARSE_WORKERS > 1; a
+    process that is about to fork (gunicorn's master) must not.
+    """
+    with _warm_up_lock:
+        if _warm_up_state['status'] in ('ready', 'failed'):
+            return
+        _warm_up_state['status'] = 'warming'
+        started = time.perf_counter()
+        fd, path = tempfile.mkstemp(prefix='warmup-', suffix='.xlsx', dir=app.config['UPLOAD_SPOOL_DIR'])
+        os.close(fd)
+        try:
+            write_warm_up_workbook(path)
+            task = (path, f"Warmup {WARMUP_SHEET}.xlsx", list_sheet_names(path)[0], 'brushcards')
+            df = parse_sheet(task)
+            if df is None:
+                raise ValueError("warm-up workbook did not parse")
+            if app.config['STREAMING_COMBINE']:
+                import openpyxl  # noqa: F401 (the streaming path reads with it)
+            if app.config['PARSE_CACHE_ENABLED']:
+                encode_frame(df)
+            writer = create_output_writer(io.BytesIO())
+            writer.write_frame('Brushcards', df)
+            writer.close()
+            if start_pool and app.config['PARSE_WORKERS'] > 1:
+                # Start the pool's processes too; each imports the parse stack once
+                list(get_parse_pool().map(timed_parse_sheet, [task] * app.config['PARSE_WORKERS']))
+            _warm_up_state['status'] = 'ready'
+        except Exception as e:
+            print(f"⚠️ Warm-up failed, the first combine will load the Excel stack: {e}")
+            _warm_up_state.update(status='failed', error=str(e))
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        seconds = time.perf_counter() - started
+        _warm_up_state['seconds'] = round(seconds, 3)
+        metrics.observe('warmup_seconds', seconds, outcome=_warm_up_state['status'])
+        _warm_up_done.set()
+
+def start_warm_up():
+    """Run warm_up() on a background thread unless it has already started"""
+    if _warm_up_state['status'] == 'cold':
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+@app.before_request
+def start_app_services():
+    """Start the scheduler and the warm-up with the first request rather than on import"""
+    global _services_started
+    if _services_started:
+        return
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+    if app.config['SCHEDULER_AUTOSTART'] and not scheduler.running:
+        scheduler.start()
+    if app.config['WARMUP'] == 'background':
+        start_warm_up()
 
 # === Routes ===
 @app.route('/kunshan', methods=['GET', 'POST'])
@@ -457,3 +3996,99 @@ def index():
     if request.method == 'POST':
         return handle_post_request('kunshan')
     return render_template('kunshan.html')
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = read_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'plant': job['plant'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'],
+        **job_urls(job['id'])
+    })
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    job = read_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+    return send_file(
+        os.path.join(job_dir(job_id), 'result.xlsx'),
+        as_attachment=True,
+        download_name=f"{job['plant']}_combined.xlsx",
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+@app.route('/results/<key>')
+def result_download(key):
+    """A stored combine result by its key (the ETag of the response that produced it)"""
+    store = get_result_store()
+    if store is None or not RESULT_KEY_PATTERN.fullmatch(key):
+        return jsonify({'error': 'Unknown result'}), 404
+    if request.if_none_match.contains_weak(key):
+        return result_not_modified(key)
+    entry, file = store.open(key)
+    if entry is None:
+        return jsonify({'error': 'Unknown result'}), 404
+    return send_result(key, entry, file)
+
+@app.route('/cache/stats')
+def cache_stats():
+    cache = get_parse_cache()
+    store = get_result_store()
+    return jsonify({'parse_cache': cache.stats() if cache else None,
+                    'result_store': store.stats() if store else None})
+
+@app.route('/store/<plant>')
+def store_summary(plant):
+    if plant not in ('kunshan', 'anhui'):
+        return jsonify({'error': 'Unknown plant'}), 404
+    store = get_combined_store(plant)
+    with store.lock:
+        files = store.summary()
+    return jsonify({'plant': plant, 'files': files})
+
+@app.route('/store/<plant>/download')
+def store_download(plant):
+    """Regenerate the plant's workbook from the combined store, without any upload"""
+    if plant not in ('kunshan', 'anhui'):
+        return jsonify({'error': 'Unknown plant'}), 404
+    return send_file(
+        process_excel_files([], [], plant=plant, incremental=True),
+        as_attachment=True,
+        download_name=f"{plant}_combined.xlsx",
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+@app.route('/store/<plant>/files/<path:filename>', methods=['DELETE'])
+def store_remove_file(plant, filename):
+    if plant not in ('kunshan', 'anhui'):
+        return jsonify({'error': 'Unknown plant'}), 404
+    store = get_combined_store(plant)
+    with store.lock:
+        removed = store.remove(filename)
+    if not removed:
+        return jsonify({'error': 'Unknown file'}), 404
+    return jsonify({'plant': plant, 'removed': filename})
+
+@app.route('/schema/mismatches')
+def schema_mismatch_list():
+    return jsonify({'mismatches': all_schema_mismatches()})
+
+@app.route('/ready')
+def readiness():
+    """200 once the instance should get traffic: at once with WARMUP off, else when the warm-up has finished"""
+    ready = app.config['WARMUP'] != 'background' or _warm_up_done.is_set()
+    state = dict(_warm_up_state)
+    return jsonify({'ready': ready, 'parser': state['status'],
+                    'warmup_seconds': state['seconds'], 'error': state['error']}), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
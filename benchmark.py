@@ -0,0 +1,503 @@
+"""Benchmark the combine pipeline on synthetic workbooks.
+
+Generates realistic Kunshan and Anhui uploads (cached under benchmarks/data/),
+runs them through the same parse / transform / write stages as
+process_excel_files and reports time, rows/sec and peak RSS per stage.
+
+    python benchmark.py                                   # default matrix
+    python benchmark.py --plant anhui --rows 1000000 --files 100
+    python benchmark.py --save main                       # benchmarks/main.json
+    python benchmark.py --compare main                    # exit 1 on regression
+    python benchmark.py --startup                         # cold start, fresh process per run
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import threading
+import contextlib
+import subprocess
+
+# numpy and xlsxwriter are imported where workbooks are generated, so that
+# --startup runs measure the app's imports and not these
+from werkzeug.datastructures import FileStorage
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+DATA_DIR = os.path.join(BENCHMARK_DIR, "data")
+
+# === Synthetic workbooks ===
+KUNSHAN_DEFECTS = ['Bad Peeling length ', 'Debugging scrap1', 'Peeling incompletely', 'no peeling ',
+                   'Coil deformed1', 'Varnish broken', 'defect burr', 'crack ', 'less tin ',
+                   'excess tin ', 'short leg', 'long leg', 'glue on the body', 'Wrong core ']
+KUNSHAN_DEFECTS_CN = ['剥皮尺寸不良', '调机品', '剥不干净', '未剥皮', '线圈变形', '漆包线破损', '毛刺',
+                      '裂纹', '少锡', '多锡', '短脚', '长脚', '本体沾胶', '磁芯错误']
+KUNSHAN_SHEETS = [('Date', 'Day'), ('Data', 'Day'), ('Inspection data', 'Inspect date')]
+MACHINES = [str(number) for number in range(1601, 1625)]
+PART_NUMBERS = ['809C L', '809C R', '812A', '815B L', '815B R', '820F', '833K', '901X']
+
+CLIENTS = ['Kelier', 'Bosch', 'Valeo', 'Denso', 'Mahle', 'Nidec', 'Brose', 'Johnson']
+BRUSHCARD_HEADERS = ['生产日期\nProduction Date', '检验日期\nInspection Date', '型号\nType',
+                     '不良部位\nDefective Part', '不良名称\nDefect Name', '数量\nQuantity',
+                     '处理方式\nHandling method', '原因\nCause of defect', '检验站别\nInspection station',
+                     '当日检数量\nInspection quantity', '备注\nRemark']
+# Supplier variant of the same layout, resolved through the schema synonyms
+BRUSHCARD_HEADERS_EN = ['Prod Date', 'Inspect Date', 'Model', 'Defect Part', 'Defect Name', 'Qty',
+                        'Handling', 'Reason', 'Station', 'Daily inspection', 'Comment']
+BRUSHCARD_SHEETS = ['绕线质量汇总表', '点胶质量汇总表', '终检质量汇总表']
+DEFECTIVE_PARTS = ['碳刷', '刷握', '弹簧', '端子', '引线', '骨架']
+DEFECT_NAMES = ['碳刷断裂', '刷握变形', '弹簧脱落', '端子氧化', '引线过长', '焊点虚焊', '尺寸超差', '外观脏污']
+HANDLING = ['返工', '报废', '特采', '挑选']
+CAUSES = ['来料不良', '设备异常', '操作不当', '模具磨损', None]
+STATIONS = ['IQC', 'IPQC', 'FQC', 'OQC', '绕线', '点胶']
+
+START_DATE = datetime.datetime(2025, 1, 1)
+
+def split_rows(rows, parts):
+    """Split rows as evenly as possible into parts counts"""
+    base, extra = divmod(rows, parts)
+    return [base + (1 if index < extra else 0) for index in range(parts)]
+
+def random_dates(rng, count):
+    days = rng.integers(0, 365, count)
+    return [START_DATE + datetime.timedelta(days=int(day)) for day in days]
+
+def write_kunshan_sheet(workbook, sheet_name, date_header, rows, rng, formats):
+    """One Kunshan sheet: two preamble rows, the header row, then daily machine counts"""
+    sheet = workbook.add_worksheet(sheet_name)
+    sheet.write_row(0, 8, ['绕线机'] + [None] * (len(KUNSHAN_DEFECTS) - 1))
+    sheet.write_row(1, 8, KUNSHAN_DEFECTS_CN)
+    header = (['Type', 'Week', 'Month', 'Year', 'Machine', date_header, 'Part number', 'Qty产量']
+              + KUNSHAN_DEFECTS + ['Total final inspection', 'I Total PPM'])
+    sheet.write_row(2, 0, header, formats['header'])
+
+    dates = random_dates(rng, rows)
+    machines = rng.integers(0, len(MACHINES), rows)
+    parts = rng.integers(0, len(PART_NUMBERS), rows)
+    quantities = rng.integers(2000, 20000, rows)
+    # Most defect cells are blank, the rest small counts
+    defects = rng.integers(0, 60, (rows, len(KUNSHAN_DEFECTS)))
+    defects[rng.random((rows, len(KUNSHAN_DEFECTS))) < 0.6] = -1
+    for index in range(rows):
+        row = 3 + index
+        day = dates[index]
+        counts = [int(count) if count >= 0 else None for count in defects[index]]
+        total = sum(count for count in counts if count)
+        quantity = int(quantities[index])
+        sheet.write_row(row, 0, ['Winding', int(day.isocalendar()[1]), day.month, day.year,
+                                 MACHINES[machines[index]]])
+        sheet.write_datetime(row, 5, day, formats['date'])
+        sheet.write_row(row, 6, [PART_NUMBERS[parts[index]], quantity] + counts
+                        + [total, round(total / quantity * 1e6, 1)])
+
+def write_choke_sheet(workbook, rows, rng, formats):
+    """Anhui 'Inspection data' choke sheet: header row, then per-machine counts"""
+    sheet = workbook.add_worksheet('Inspection data')
+    header = (['Type', 'Week', 'Month', 'Year', 'Machine', 'Day', 'Part number', 'Qty产量']
+              + KUNSHAN_DEFECTS + ['Total final inspection'])
+    sheet.write_row(0, 0, header, formats['header'])
+    dates = random_dates(rng, rows)
+    machines = rng.integers(0, len(MACHINES), rows)
+    defects = rng.integers(0, 40, (rows, len(KUNSHAN_DEFECTS)))
+    for index in range(rows):
+        day = dates[index]
+        counts = [int(count) for count in defects[index]]
+        sheet.write_row(index + 1, 0, ['Choke', int(day.isocalendar()[1]), day.month, day.year,
+                                       MACHINES[machines[index]]])
+        sheet.write_datetime(index + 1, 5, day, formats['date'])
+        sheet.write_row(index + 1, 6, [PART_NUMBERS[index % len(PART_NUMBERS)],
+                                       int(rng.integers(2000, 20000))] + counts + [sum(counts)])
+
+def write_brushcard_sheet(workbook, sheet_name, header, rows, rng, formats):
+    """Anhui 质量汇总表 sheet with bilingual (or supplier variant) headers"""
+    sheet = workbook.add_worksheet(sheet_name)
+    sheet.write_row(0, 0, header, formats['header'])
+    production = random_dates(rng, rows)
+    lag = rng.integers(0, 4, rows)
+    picks = rng.integers(0, 1 << 30, (rows, 6))
+    quantities = rng.integers(1, 30, rows)
+    inspected = rng.integers(200, 5000, rows)
+    for index in range(rows):
+        row = index + 1
+        pick = picks[index]
+        sheet.write_datetime(row, 0, production[index], formats['date'])
+        sheet.write_datetime(row, 1, production[index] + datetime.timedelta(days=int(lag[index])), formats['date'])
+        sheet.write_row(row, 2, [
+            PART_NUMBERS[pick[0] % len(PART_NUMBERS)],
+            DEFECTIVE_PARTS[pick[1] % len(DEFECTIVE_PARTS)],
+            DEFECT_NAMES[pick[2] % len(DEFECT_NAMES)],
+            int(quantities[index]),
+            HANDLING[pick[3] % len(HANDLING)],
+            CAUSES[pick[4] % len(CAUSES)],
+            STATIONS[pick[5] % len(STATIONS)],
+            int(inspected[index]),
+            '复检' if pick[5] % 50 == 0 else None
+        ])
+
+def new_workbook(path):
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    formats = {'header': workbook.add_format({'bold': True, 'text_wrap': True}),
+               'date': workbook.add_format({'num_format': 'yyyy-mm-dd'})}
+    return workbook, formats
+
+def generate_kunshan(directory, rows, files, rng):
+    paths = []
+    for file_index, file_rows in enumerate(split_rows(rows, files)):
+        path = os.path.join(directory, f"Winding_station_Statistical_list_{file_index + 1:03d}.xlsx")
+        workbook, formats = new_workbook(path)
+        # A sheet the combiner must skip, as in the real statistics workbooks
+        workbook.add_worksheet('Charts').write(0, 0, 'Pareto')
+        for (sheet_name, date_header), sheet_rows in zip(KUNSHAN_SHEETS, split_rows(file_rows, len(KUNSHAN_SHEETS))):
+            write_kunshan_sheet(workbook, sheet_name, date_header, sheet_rows, rng, formats)
+        workbook.close()
+        paths.append(path)
+    return paths
+
+def generate_anhui(directory, rows, files, rng):
+    # About one upload in five is a chokes workbook, always at least one brushcard file
+    choke_files = max(1, files // 5) if files > 1 else 0
+    paths = []
+    for file_index, file_rows in enumerate(split_rows(rows, files)):
+        workbook_path = None
+        if file_index < choke_files:
+            workbook_path = os.path.join(directory, f"Quality follow-up Chokes {file_index + 1:03d}.xlsx")
+            workbook, formats = new_workbook(workbook_path)
+            write_choke_sheet(workbook, file_rows, rng, formats)
+        else:
+            brushcard_index = file_index - choke_files
+            client = CLIENTS[brushcard_index % len(CLIENTS)]
+            if brushcard_index >= len(CLIENTS):
+                client = f"{client}-{brushcard_index // len(CLIENTS) + 1}"
+            workbook_path = os.path.join(directory, f"{client} 2025质量汇总表.xlsx")
+            workbook, formats = new_workbook(workbook_path)
+            for sheet_index, (sheet_name, sheet_rows) in enumerate(zip(BRUSHCARD_SHEETS, split_rows(file_rows, len(BRUSHCARD_SHEETS)))):
+                header = BRUSHCARD_HEADERS_EN if (brushcard_index + sheet_index) % 3 == 2 else BRUSHCARD_HEADERS
+                write_brushcard_sheet(workbook, sheet_name, header, sheet_rows, rng, formats)
+        workbook.close()
+        paths.append(workbook_path)
+    return paths
+
+GENERATORS = {'kunshan': generate_kunshan, 'anhui': generate_anhui}
+
+def synthetic_uploads(plant, rows, files, seed=0):
+    """Return the paths of a generated upload set, generating it on first use"""
+    directory = os.path.join(DATA_DIR, f"{plant}-{rows}r-{files}f-s{seed}")
+    manifest = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest):
+        with open(manifest, encoding='utf-8') as f:
+            return [os.path.join(directory, name) for name in json.load(f)]
+
+    import numpy as np
+    os.makedirs(directory, exist_ok=True)
+    print(f"🧪 Generating {plant} workbooks: {rows:,} rows in {files} files...", file=sys.stderr)
+    paths = GENERATORS[plant](directory, rows, files, np.random.default_rng(seed))
+    with open(manifest, 'w', encoding='utf-8') as f:
+        json.dump([os.path.basename(path) for path in paths], f, ensure_ascii=False)
+    return paths
+
+# === Measurement ===
+def current_rss():
+    """Resident set size of this process in bytes (0 if it can't be read)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is the lifetime peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class StageMeter:
+    """Wall time and peak RSS of a block, sampling RSS from a background thread"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.seconds = 0.0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        self.stopped.set()
+        self.sampler.join()
+        self.peak = max(self.peak, current_rss())
+        return False
+
+class FrameCollector:
+    """Stand-in writer that keeps the frames write_combined produces, in order"""
+
+    def __init__(self):
+        self.frames = []
+        self.sheets = {}
+
+    def write_frame(self, sheet_name, df):
+        self.frames.append((sheet_name, df))
+        self.sheets[sheet_name] = None
+
+# === Runner ===
+def run_scenario(combiner, plant, paths, rows, engine, mode):
+    """Run one upload set through the pipeline and return its per-stage measurements"""
+    def uploads():
+        return [FileStorage(stream=open(path, 'rb'), filename=os.path.basename(path)) for path in paths]
+
+    def result(meter):
+        return {'seconds': round(meter.seconds, 4),
+                'rows_per_sec': round(rows / meter.seconds) if meter.seconds else None,
+                'peak_rss_mb': round(meter.peak / 2**20, 1)}
+
+    files = uploads()
+    stages = {}
+    try:
+        if mode == 'streaming':
+            # The streaming pipeline reads, projects and writes rows in one pass
+            with StageMeter() as meter:
+                output = combiner.stream_excel_files(files, plant=plant, engine=engine)
+            output.close()
+            stages['stream'] = result(meter)
+            return stages
+
+        with StageMeter() as meter:
+            sources = combiner.read_uploads(files)
+            parsed = list(combiner.parse_uploads(sources, plant, combiner.CombineProgress()))
+        stages['parse'] = result(meter)
+
+        collector = FrameCollector()
+        with StageMeter() as meter:
+            combiner.write_combined(plant, parsed, collector, len(files))
+        stages['transform'] = result(meter)
+        del sources, parsed
+
+        with StageMeter() as meter:
+            output = combiner.new_output_buffer()
+            writer = combiner.create_output_writer(output, engine)
+            for sheet_name, df in collector.frames:
+                writer.write_frame(sheet_name, df)
+            writer.close()
+        stages['write'] = result(meter)
+        output.seek(0, os.SEEK_END)
+        stages['write']['output_mb'] = round(output.tell() / 2**20, 2)
+        output.close()
+    finally:
+        for file in files:
+            file.close()
+    return stages
+
+def run_startup(plant, path, rows, warmup):
+    """Start the app in this (fresh) process and measure what a client sees.
+
+    import: importing the app; first_html: the plant's upload page; ready: waiting
+    for /ready after that (background warm-up only); first_combine: combining
+    path through the web route.
+    """
+    def result(meter, rows=None):
+        return {'seconds': round(meter.seconds, 4),
+                'rows_per_sec': round(rows / meter.seconds) if rows and meter.seconds else None,
+                'peak_rss_mb': round(meter.peak / 2**20, 1)}
+
+    stages = {}
+    with StageMeter() as meter:
+        import app as combiner
+    stages['import'] = result(meter)
+    client = combiner.app.test_client()
+
+    with StageMeter() as meter:
+        client.get(f'/{plant}').close()
+    stages['first_html'] = result(meter)
+
+    if warmup == 'background':
+        with StageMeter() as meter:
+            while client.get('/ready').status_code != 200:
+                time.sleep(0.005)
+        stages['ready'] = result(meter)
+
+    with StageMeter() as meter, open(path, 'rb') as f:
+        response = client.post(f'/{plant}', data={'files': [(f, os.path.basename(path))]},
+                               content_type='multipart/form-data')
+        response.get_data()
+        response.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"first combine failed with {response.status_code}")
+    stages['first_combine'] = result(meter, rows)
+    return stages
+
+def startup_child(args):
+    """--startup-child: one run_startup() in this process, printed as JSON on the last line"""
+    plant, path, rows, warmup = args
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        stages = run_startup(plant, path, int(rows), warmup)
+    print(json.dumps(stages))
+    return 0
+
+def measure_startup(plant, path, rows, engine, mode, warmup, verbose):
+    """run_startup() in a new interpreter, so nothing is imported or warm yet"""
+    env = dict(os.environ, WARMUP=warmup, OUTPUT_ENGINE=engine,
+               STREAMING_COMBINE='1' if mode == 'streaming' else '0',
+               RESULT_STORE_ENABLED='0', SCHEDULER_AUTOSTART='0')
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-child',
+                                plant, path, str(rows), warmup],
+                               env=env, capture_output=True, text=True, check=True)
+    if verbose:
+        print(completed.stderr, file=sys.stderr, end='')
+    return json.loads(completed.stdout.splitlines()[-1])
+
+def startup_key(plant, rows, engine, mode, warmup):
+    return f"startup/{plant}/{rows}r/{engine}/{mode}/{warmup}"
+
+def scenario_key(plant, rows, files, engine, mode):
+    return f"{plant}/{rows}r/{files}f/{engine}/{mode}"
+
+def print_result(key, stages):
+    for stage, measured in stages.items():
+        rate = f"{measured['rows_per_sec']:>12,}" if measured['rows_per_sec'] else f"{'-':>12}"
+        print(f"{key:<54} {stage:<10} {measured['seconds']:>9.3f}s {rate} rows/s "
+              f"{measured['peak_rss_mb']:>9.1f} MiB")
+
+def baseline_path(name):
+    return name if name.endswith('.json') else os.path.join(BENCHMARK_DIR, f"{name}.json")
+
+def compare(results, baseline, threshold, min_seconds):
+    """Print time ratios against a saved baseline; return the regressed (key, stage) pairs.
+
+    Stages faster than min_seconds in both runs are too noisy to flag.
+    """
+    regressions = []
+    print(f"\n{'scenario':<54} {'stage':<10} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for key, stages in results.items():
+        previous = baseline['results'].get(key)
+        if previous is None:
+            print(f"{key:<54} (not in baseline)")
+            continue
+        for stage, measured in stages.items():
+            before = previous.get(stage)
+            if not before:
+                continue
+            ratio = measured['seconds'] / before['seconds'] if before['seconds'] else float('inf')
+            flag = ''
+            if max(measured['seconds'], before['seconds']) < min_seconds:
+                pass
+            elif ratio > 1 + threshold:
+                flag = ' ⚠️ slower'
+                regressions.append((key, stage))
+            elif ratio < 1 - threshold:
+                flag = ' 🚀 faster'
+            print(f"{key:<54} {stage:<10} {before['seconds']:>9.3f}s {measured['seconds']:>9.3f}s "
+                  f"{ratio:>6.2f}x{flag}")
+    return regressions
+
+def report(results, args):
+    """Save and/or compare results as asked; returns the exit code"""
+    if args.save:
+        path = baseline_path(args.save)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'cpus': os.cpu_count(),
+                'reader': args.reader,
+                'results': results
+            }, f, indent=2)
+        print(f"💾 Saved baseline to {path}")
+
+    if args.compare:
+        with open(baseline_path(args.compare), encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_seconds)
+        if regressions:
+            print(f"❌ {len(regressions)} stage(s) slower than the baseline by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--plant', choices=['kunshan', 'anhui', 'all'], default='all')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='total data rows per upload set (1k to 1M)')
+    parser.add_argument('--files', type=int, nargs='+', default=[1, 10],
+                        help='number of uploaded workbooks (1 to 100)')
+    parser.add_argument('--engine', choices=['xlsxwriter', 'openpyxl'], default='xlsxwriter')
+    parser.add_argument('--mode', choices=['batch', 'streaming'], default='batch')
+    parser.add_argument('--reader', choices=['lean', 'openpyxl'], default='lean',
+                        help='parse-stage workbook reader (READ_ENGINE); not part of the scenario key, '
+                             'so runs with either reader compare against the same baseline')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per scenario; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='NAME', help='save results as benchmarks/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare with benchmarks/NAME.json')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression (default 0.1)')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='stages faster than this are never reported as regressions')
+    parser.add_argument('--verbose', action='store_true', help="show the combiner's own output")
+    parser.add_argument('--startup', action='store_true',
+                        help='measure cold start instead: import, first page, /ready and first combine '
+                             'of the smallest --rows set, in a fresh process with and without warm-up')
+    parser.add_argument('--startup-child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # Measure parsing itself, not the parse cache or a pool of other processes' RSS
+    os.environ.setdefault('PARSE_CACHE_ENABLED', '0')
+    os.environ.setdefault('PARSE_WORKERS', '1')
+    os.environ['READ_ENGINE'] = args.reader
+    if args.startup_child:
+        return startup_child(args.startup_child)
+    devnull = open(os.devnull, 'w')
+
+    def quiet():
+        return contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+
+    plants = ['kunshan', 'anhui'] if args.plant == 'all' else [args.plant]
+    results = {}
+    if args.startup:
+        rows = min(args.rows)
+        for plant in plants:
+            path = synthetic_uploads(plant, rows, 1, args.seed)[0]
+            for warmup in ('off', 'background'):
+                key = startup_key(plant, rows, args.engine, args.mode, warmup)
+                runs = [measure_startup(plant, path, rows, args.engine, args.mode, warmup, args.verbose)
+                        for _ in range(args.repeat)]
+                best = min(runs, key=lambda stages: sum(measured['seconds'] for measured in stages.values()))
+                results[key] = best
+                print_result(key, best)
+        return report(results, args)
+
+    with quiet():
+        import app as combiner
+
+    # Warm-up run so lazy imports and first-call setup don't count against the first scenario
+    with quiet():
+        for plant in plants:
+            run_scenario(combiner, plant, synthetic_uploads(plant, 1000, 1, args.seed), 1000, args.engine, args.mode)
+
+    for plant in plants:
+        for files in args.files:
+            for rows in args.rows:
+                if files > rows:
+                    continue
+                paths = synthetic_uploads(plant, rows, files, args.seed)
+                key = scenario_key(plant, rows, files, args.engine, args.mode)
+                runs = []
+                for _ in range(args.repeat):
+                    with quiet():
+                        runs.append(run_scenario(combiner, plant, paths, rows, args.engine, args.mode))
+                best = min(runs, key=lambda stages: sum(measured['seconds'] for measured in stages.values()))
+                results[key] = best
+                print_result(key, best)
+    return report(results, args)
+
+if __name__ == '__main__':
+    sys.exit(main())
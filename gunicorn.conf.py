@@ -0,0 +1,86 @@
+"""Production server settings: several worker processes, one scheduler.
+
+Gunicorn reads this file from the working directory on its own, so the plain
+
+    gunicorn app:app
+
+(as App Service starts it) picks it up. Every variable below can be set
+through the environment.
+
+    WEB_WORKERS               worker processes (default: one per core)
+    WEB_THREADS               request threads per worker (default 4), so status
+                              polls and downloads are served during a combine
+    WORKER_MAX_COMBINES       recycle a worker after this many combines, to hand
+                              back memory pandas/openpyxl leave fragmented
+                              (default 50, 0 = never)
+    WORKER_MAX_COMBINES_JITTER  random extra combines per worker, so workers are
+                              not all recycled at once (default 5)
+    WORKER_GRACEFUL_TIMEOUT   seconds a stopping worker gets to finish its
+                              requests and queued jobs (default 300)
+    METRICS_DIR               where each worker writes its metrics and schema
+                              mismatches for /metrics and /schema/mismatches to
+                              add up (default cache/metrics, emptied when the
+                              server starts)
+
+The app is imported once in the master and forked, with SCHEDULER_AUTOSTART
+off; each worker then competes for SCHEDULER_LOCK_FILE and the one holding it
+runs the scheduled cleanup. With WARMUP on (the default) the master also loads
+the Excel stack before forking, so workers, recycled ones included, start warm
+and /ready answers 200 from their first request.
+
+Whichever worker answers /metrics or /schema/mismatches reports the sum over
+all workers, recycled ones included, through METRICS_DIR. /cache/stats is not
+summed: the result store and the parse cache's files are shared, but the parse
+cache's in-memory figures are those of the worker that answered.
+"""
+import glob
+import os
+import random
+
+# Cores are used by worker processes; a parse pool inside each one would oversubscribe them
+os.environ.setdefault('PARSE_WORKERS', '1')
+os.environ.setdefault('SCHEDULER_AUTOSTART', '0')
+os.environ.setdefault('METRICS_DIR', os.path.abspath(os.path.join('cache', 'metrics')))
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_WORKERS', str(os.cpu_count() or 1)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '4'))
+preload_app = True
+graceful_timeout = int(os.environ.get('WORKER_GRACEFUL_TIMEOUT', '300'))
+
+max_combines = int(os.environ.get('WORKER_MAX_COMBINES', '50'))
+max_combines_jitter = int(os.environ.get('WORKER_MAX_COMBINES_JITTER', '5'))
+
+
+def on_starting(server):
+    # Counts start from zero with each server, like a single process's would
+    for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], '*.json')):
+        os.remove(path)
+
+
+def when_ready(server):
+    from app import app, warm_up
+    if app.config['WARMUP'] == 'background':
+        warm_up(start_pool=False)
+
+
+def post_fork(server, worker):
+    from app import start_scheduler_leader
+    worker.max_combines = max_combines + random.randint(0, max_combines_jitter) if max_combines else 0
+    start_scheduler_leader()
+
+
+def post_request(worker, req, environ, resp):
+    from app import metrics
+    if worker.max_combines and worker.alive and metrics.total('combines_total') >= worker.max_combines:
+        # Same mechanism as max_requests: stop accepting, finish in-flight work, exit
+        worker.log.info("Recycling worker %s after %d combines", worker.pid, worker.max_combines)
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    from app import metrics, shutdown_job_queue
+    shutdown_job_queue()
+    # Counts are written to METRICS_DIR about once a second; keep the last ones
+    metrics.flush()
@@ -0,0 +1,13 @@
+"""Celery worker entry point for combine jobs (JOB_QUEUE=celery).
+
+    celery -A tasks worker --loglevel=info
+
+The web app hands jobs to these workers through CELERY_BROKER_URL. A job's
+record, uploads and result live under JOBS_DIR, which the web processes and
+every worker must share (a mounted network volume when they run on
+different hosts).
+"""
+from app import COMBINE_TASK_NAME, make_celery
+
+celery_app = make_celery()
+run_combine_job = celery_app.tasks[COMBINE_TASK_NAME]
@@ -0,0 +1,81 @@
+"""Shared setup: the app is imported with caches, stores and background services off."""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.update(
+    PARSE_CACHE_ENABLED='0',
+    RESULT_STORE_ENABLED='0',
+    PARSE_WORKERS='1',
+    SCHEDULER_AUTOSTART='0',
+    WARMUP='off',
+    UPLOAD_SPOOL_DIR=tempfile.mkdtemp(prefix='combiner-tests-')
+)
+
+import pytest
+import xlsxwriter
+from werkzeug.datastructures import FileStorage
+
+import app as combiner
+
+
+@pytest.fixture
+def config():
+    """app.config, restored after the test"""
+    saved = dict(combiner.app.config)
+    yield combiner.app.config
+    combiner.app.config.clear()
+    combiner.app.config.update(saved)
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    """Factory: write {sheet name: rows} to an xlsx under tmp_path and return its path"""
+    def write(name, sheets):
+        path = str(tmp_path / name)
+        book = xlsxwriter.Workbook(path)
+        date_format = book.add_format({'num_format': 'yyyy-mm-dd'})
+        for sheet_name, rows in sheets.items():
+            worksheet = book.add_worksheet(sheet_name)
+            for row_index, row in enumerate(rows):
+                for column_index, value in enumerate(row):
+                    if value is None:
+                        continue
+                    if hasattr(value, 'year'):
+                        worksheet.write_datetime(row_index, column_index, value, date_format)
+                    else:
+                        worksheet.write(row_index, column_index, value)
+        book.close()
+        return path
+    return write
+
+
+def uploads(*paths):
+    """FileStorage uploads of the given workbooks, under their own file names"""
+    return [FileStorage(stream=open(path, 'rb'), filename=os.path.basename(path)) for path in paths]
+
+
+def kunshan_sheet(header, rows):
+    """A Kunshan sheet: two preamble rows, then the header row and the data"""
+    return [['绕线机'], ['preamble'], header] + rows
+
+
+@pytest.fixture
+def combined_dir(tmp_path, monkeypatch):
+    """The plants' incremental combined stores, under tmp_path"""
+    monkeypatch.setattr(combiner, 'CLEANUP_DIR', str(tmp_path / 'combined'))
+    monkeypatch.setattr(combiner, '_combined_stores', {})
+    return tmp_path / 'combined'
+
+
+@pytest.fixture
+def result_store(config, tmp_path):
+    """The result store, enabled under tmp_path"""
+    config['RESULT_STORE_ENABLED'] = True
+    config['RESULT_STORE_DIR'] = str(tmp_path / 'results')
+    combiner._result_store = None
+    yield combiner.get_result_store()
+    combiner._result_store = None
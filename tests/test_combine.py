@@ -0,0 +1,80 @@
+import io
+import datetime
+import zipfile
+
+import pandas as pd
+import pytest
+
+import app as combiner
+from conftest import uploads, kunshan_sheet
+
+SHEET = 'WindingStationFuseChoke'
+DAY1 = datetime.datetime(2025, 1, 1)
+DAY2 = datetime.datetime(2025, 1, 2)
+
+
+def read_output(output, output_format):
+    """The combined sheet as strings, blanks as ''"""
+    output.seek(0)
+    if output_format == 'xlsx':
+        df = pd.read_excel(output, sheet_name=SHEET)
+    elif output_format == 'csv':
+        df = pd.read_csv(output)
+    elif output_format == 'zip':
+        with zipfile.ZipFile(output) as archive:
+            df = pd.read_csv(archive.open(f"{SHEET}.csv"))
+    else:
+        df = pd.read_parquet(output)
+    return df.drop(columns='date').astype(object).where(df.drop(columns='date').notna(), '').astype(str)
+
+
+@pytest.fixture
+def differing_files(workbook):
+    """Two Kunshan uploads of the same station sheet whose headers differ"""
+    first = workbook('k1.xlsx', {'Inspection data': kunshan_sheet(
+        ['Day', 'Machine', 'Qty产量'],
+        [[DAY1, 'M1', 10], [DAY2, 'M2', 20]])})
+    second = workbook('k2.xlsx', {'Inspection data': kunshan_sheet(
+        ['Day', 'Qty产量', 'Machine', 'Extra'],
+        [[DAY1, 30, 'M3', 'x']])})
+    return first, second
+
+
+@pytest.mark.parametrize('output_format,engine', [
+    ('xlsx', 'xlsxwriter'), ('xlsx', 'openpyxl'), ('csv', None), ('zip', None), ('parquet', None)
+])
+@pytest.mark.parametrize('streaming,dedup', [(False, False), (False, 'first'), (True, False)])
+def test_files_with_differing_columns_align_by_name(differing_files, output_format, engine, streaming, dedup):
+    output = io.BytesIO()
+    files = uploads(*differing_files)
+    try:
+        combiner.process_excel_files(files, [], plant='kunshan', streaming=streaming, engine=engine, output=output,
+                                     output_format=output_format, sheet=None if output_format in ('xlsx', 'zip') else SHEET,
+                                     dedup=dedup)
+    finally:
+        for file in files:
+            file.close()
+
+    df = read_output(output, output_format)
+    assert list(df.columns) == ['Machine', 'Qty产量', 'Extra']
+    assert df.values.tolist() == [['M1', '10', ''], ['M2', '20', ''], ['M3', '30', 'x']]
+
+
+def test_align_columns_matches_repeated_names_in_order():
+    first = pd.DataFrame([[1, 2]], columns=['a', 'a'])
+    second = pd.DataFrame([[3, 4, 5]], columns=['b', 'a', 'a'])
+    aligned = combiner.align_columns([first, second])
+    assert [list(df.columns) for df in aligned] == [['a', 'a', 'b'], ['a', 'a', 'b']]
+    assert aligned[1].iloc[0].tolist() == [4, 5, 3]
+    assert pd.isna(aligned[0].iloc[0, 2])
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"Chokes": ["Part", "Date"]}', {'Chokes': ['Part', 'Date']}),
+    ('{bad json', {}),
+    ('["Chokes"]', {}),
+    ('{"Chokes": "Part", "Brushcards": ["ID"]}', {'Brushcards': ['ID']}),
+])
+def test_parse_dedup_keys_reports_and_ignores_invalid_settings(capsys, text, expected):
+    assert combiner.parse_dedup_keys(text) == expected
+    assert ('❌ DEDUP_KEYS' in capsys.readouterr().out) == (expected != {'Chokes': ['Part', 'Date']})
@@ -0,0 +1,122 @@
+import io
+import datetime
+
+import pandas as pd
+import pytest
+
+import app as combiner
+from conftest import kunshan_sheet, uploads
+
+DAY = datetime.datetime(2025, 1, 1)
+HEADER = ['Day', 'Machine', 'Qty产量']
+SHEET = 'WindingStationFuseChoke'
+
+
+def kunshan_file(workbook, name, machine, rows=2, sheets=('Inspection data',)):
+    return workbook(name, {
+        sheet: kunshan_sheet(HEADER, [[DAY + datetime.timedelta(days=row), machine, row] for row in range(rows)])
+        for sheet in sheets
+    })
+
+
+def combine(*paths):
+    return combiner.process_excel_files(uploads(*paths), [], incremental=True)
+
+
+def machines(output, sheet_name=SHEET):
+    return pd.read_excel(output, sheet_name=sheet_name)['Machine'].tolist()
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """(filename, sheet_name) of every sheet parsed, in order"""
+    calls = []
+    parse_sheet = combiner.parse_sheet
+
+    def counting(task):
+        calls.append(task[1:3])
+        return parse_sheet(task)
+
+    monkeypatch.setattr(combiner, 'parse_sheet', counting)
+    return calls
+
+
+def test_changed_file_replaces_only_its_rows(combined_dir, workbook):
+    first = kunshan_file(workbook, 'a.xlsx', 'A1')
+    second = kunshan_file(workbook, 'b.xlsx', 'B1')
+    assert machines(combine(first, second)) == ['A1', 'A1', 'B1', 'B1']
+
+    # A new version of a.xlsx keeps its place ahead of b.xlsx
+    first = kunshan_file(workbook, 'a.xlsx', 'A2', rows=3)
+    assert machines(combine(first)) == ['A2', 'A2', 'A2', 'B1', 'B1']
+    store = combiner.get_combined_store('kunshan')
+    with store.lock:
+        assert [(entry['filename'], entry['sheets'][0]['rows']) for entry in store.files] == [
+            ('a.xlsx', 3), ('b.xlsx', 2)]
+        assert len(list((combined_dir / 'kunshan' / 'frames').iterdir())) == 2
+
+
+def test_unchanged_files_are_not_parsed_again(combined_dir, workbook, parsed):
+    first = kunshan_file(workbook, 'a.xlsx', 'A1')
+    second = kunshan_file(workbook, 'b.xlsx', 'B1')
+    combine(first, second)
+    assert [filename for filename, _ in parsed] == ['a.xlsx', 'b.xlsx']
+
+    parsed.clear()
+    second = kunshan_file(workbook, 'b.xlsx', 'B2')
+    assert machines(combine(first, second)) == ['A1', 'A1', 'B2', 'B2']
+    assert parsed == [('b.xlsx', 'Inspection data')]
+
+    parsed.clear()
+    assert machines(combine(first, second)) == ['A1', 'A1', 'B2', 'B2']
+    assert parsed == []
+
+
+def test_data_sheets_are_numbered_across_stored_files(combined_dir, workbook):
+    first_names = combiner.KUNSHAN_SHEET_MAPPING['Data']
+    first = kunshan_file(workbook, 'a.xlsx', 'A1', sheets=('Data',))
+    second = kunshan_file(workbook, 'b.xlsx', 'B1', sheets=('Data',))
+    combine(first)
+    # b.xlsx is uploaded on its own, but its Data sheet is the second one in the store
+    output = combine(second)
+    assert machines(output, first_names[0]) == ['A1', 'A1']
+    assert machines(output, first_names[1]) == ['B1', 'B1']
+
+    first = kunshan_file(workbook, 'a.xlsx', 'A2', sheets=('Data',))
+    output = combine(first)
+    assert machines(output, first_names[0]) == ['A2', 'A2']
+    assert machines(output, first_names[1]) == ['B1', 'B1']
+
+
+def test_delete_removes_a_file_from_the_store(combined_dir, workbook):
+    combine(kunshan_file(workbook, 'a.xlsx', 'A1'), kunshan_file(workbook, 'b.xlsx', 'B1'))
+    client = combiner.app.test_client()
+
+    response = client.delete('/store/kunshan/files/a.xlsx')
+    assert response.status_code == 200
+    assert response.get_json() == {'plant': 'kunshan', 'removed': 'a.xlsx'}
+    assert [entry['filename'] for entry in client.get('/store/kunshan').get_json()['files']] == ['b.xlsx']
+    assert len(list((combined_dir / 'kunshan' / 'frames').iterdir())) == 1
+    assert machines(io.BytesIO(client.get('/store/kunshan/download').data)) == ['B1', 'B1']
+
+    assert client.delete('/store/kunshan/files/a.xlsx').status_code == 404
+    assert client.delete('/store/nowhere/files/b.xlsx').status_code == 404
+
+
+@pytest.mark.parametrize('frame_format', [None, 'pickle'])
+def test_entries_of_an_older_frame_format_are_parsed_again(combined_dir, workbook, parsed, frame_format):
+    path = kunshan_file(workbook, 'a.xlsx', 'A1')
+    combine(path)
+    store = combiner.get_combined_store('kunshan')
+    with store.lock:
+        if frame_format is None:
+            del store.files[0]['frame_format']
+        else:
+            store.files[0]['frame_format'] = frame_format
+        store.write_manifest()
+
+    parsed.clear()
+    assert machines(combine(path)) == ['A1', 'A1']
+    assert parsed == [('a.xlsx', 'Inspection data')]
+    with store.lock:
+        assert store.files[0]['frame_format'] == combiner.FRAME_FORMAT
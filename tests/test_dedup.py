@@ -0,0 +1,86 @@
+import shutil
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app as combiner
+from conftest import kunshan_sheet, uploads
+
+DAY1, DAY2, DAY3 = (datetime.datetime(2025, 1, day) for day in (1, 2, 3))
+HEADER = ['Day', 'Machine', 'Qty产量']
+SHEET = 'WindingStationFuseChoke'
+
+
+def kunshan_file(workbook, name, rows):
+    return workbook(name, {'Inspection data': kunshan_sheet(HEADER, rows)})
+
+
+def combine(paths, dedup):
+    output = combiner.process_excel_files(uploads(*paths), [], dedup=dedup)
+    return pd.read_excel(output, sheet_name=SHEET)
+
+
+@pytest.mark.parametrize('keep, kept, dropped', [
+    # source 0 holds x twice and y; source 1 holds x and z
+    ('first', ['x', 'x', 'y', 'z'], [0, 1]),
+    ('latest', ['x', 'y', 'x', 'z'], [1, 0]),
+])
+def test_drop_duplicate_rows_matches_nth_copies_across_sources(keep, kept, dropped):
+    df = pd.DataFrame({'row': ['x', 'x', 'y', 'x', 'z']})
+    sources = np.array([0, 0, 0, 1, 1])
+    remaining, counts = combiner.drop_duplicate_rows(df, sources, ['row'], keep)
+    assert remaining['row'].tolist() == kept
+    assert counts.tolist() == dropped
+
+
+@pytest.mark.parametrize('dedup, quantities', [
+    ('first', [1, 2, 3]),
+    ('latest', [1, 2, 3]),
+    (False, [1, 2, 2, 3]),
+])
+def test_cumulative_exports_overlap_is_dropped(workbook, dedup, quantities):
+    january = kunshan_file(workbook, 'jan.xlsx', [[DAY1, 'M1', 1], [DAY2, 'M1', 2]])
+    to_date = kunshan_file(workbook, 'ytd.xlsx', [[DAY2, 'M1', 2], [DAY3, 'M1', 3]])
+    assert combine([january, to_date], dedup)['Qty产量'].tolist() == quantities
+
+
+def test_rows_repeated_within_one_file_survive(workbook):
+    first = kunshan_file(workbook, 'a.xlsx', [[DAY1, 'M1', 1], [DAY1, 'M1', 1]])
+    second = kunshan_file(workbook, 'b.xlsx', [[DAY1, 'M1', 1], [DAY2, 'M1', 5]])
+    # The row is in a.xlsx twice and b.xlsx once: only b's copy repeats one of a's
+    assert combine([first, second], 'first')['Qty产量'].tolist() == [1, 1, 5]
+
+
+@pytest.mark.parametrize('second_name', ['a.xlsx', 'copy of a.xlsx'])
+def test_same_workbook_uploaded_twice(workbook, tmp_path, second_name):
+    path = kunshan_file(workbook, 'a.xlsx', [[DAY1, 'M1', 1], [DAY1, 'M1', 1], [DAY2, 'M2', 2]])
+    again = str(tmp_path / 'again' / second_name)
+    (tmp_path / 'again').mkdir()
+    shutil.copy(path, again)
+    df = combine([path, again], 'first')
+    assert df['Qty产量'].tolist() == [1, 1, 2]
+    assert len(combine([path, again], False)) == 6
+
+
+@pytest.mark.parametrize('keep, quantities', [('first', [1, 7]), ('latest', [5, 7])])
+def test_dedup_keys_match_rows_on_a_subset_of_columns(config, workbook, keep, quantities):
+    config['DEDUP_KEYS'] = {SHEET: ['date', 'Machine']}
+    first = kunshan_file(workbook, 'a.xlsx', [[DAY1, 'M1', 1]])
+    # Same day and machine, corrected quantity
+    second = kunshan_file(workbook, 'b.xlsx', [[DAY1, 'M1', 5], [DAY2, 'M1', 7]])
+    assert combine([first, second], keep)['Qty产量'].tolist() == quantities
+
+
+def test_dropped_rows_are_reported_per_file(workbook, capsys):
+    first = kunshan_file(workbook, 'a.xlsx', [[DAY1, 'M1', 1], [DAY2, 'M1', 2]])
+    second = kunshan_file(workbook, 'b.xlsx', [[DAY1, 'M1', 1], [DAY2, 'M1', 2], [DAY3, 'M1', 3]])
+    third = kunshan_file(workbook, 'c.xlsx', [[DAY3, 'M1', 3]])
+    before = combiner.metrics.total('duplicate_rows_total')
+    combine([first, second, third], 'first')
+    out = capsys.readouterr().out
+    assert f"{SHEET}: dropped 2 rows of b.xlsx already in an earlier file" in out
+    assert f"{SHEET}: dropped 1 rows of c.xlsx already in an earlier file" in out
+    assert "rows of a.xlsx" not in out
+    assert combiner.metrics.total('duplicate_rows_total') - before == 3
@@ -0,0 +1,80 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app as combiner
+from conftest import kunshan_sheet, uploads
+
+
+def column(*values):
+    return pd.Series(list(values), dtype=object)
+
+
+@pytest.mark.parametrize('kind, values', [
+    ('datetime', [datetime.datetime(2025, 1, 1), 'see note']),
+    ('integer', [3, 'n/a']),
+    ('integer', [3, 2.5]),
+    ('category', ['M1', 3]),
+    ('category', ['M1', datetime.datetime(2025, 1, 1)]),
+])
+def test_mixed_columns_stay_object(kind, values):
+    assert combiner.compact_column(column(*values), kind) is None
+
+
+def test_out_of_range_dates_stay_object():
+    assert combiner.compact_column(column(datetime.datetime(1500, 1, 1), datetime.datetime(2025, 1, 1)),
+                                   'datetime') is None
+
+
+@pytest.mark.parametrize('values', [[10 ** 20, 5], [1e20, np.nan], [2.0 ** 63, 1.0]])
+def test_integers_beyond_int64_stay_as_they_are(values):
+    assert combiner.compact_column(column(*values), 'integer') is None
+    assert combiner.compact_column(pd.Series(values), 'integer', infer_integers=True) is None
+
+
+def test_float_quantities_holding_integers_become_int64():
+    converted = combiner.compact_column(pd.Series([1.0, np.nan, 3.0]), 'integer')
+    assert converted.dtype == 'Int64'
+    assert converted.tolist() == [1, pd.NA, 3]
+
+
+def test_normalize_dtypes_converts_only_lossless_columns():
+    df = pd.DataFrame({
+        'Date': column(datetime.datetime(2025, 1, 1), datetime.datetime(2025, 1, 2)),
+        'Qty': column(1.0, 2.0),
+        'Machine': column('M1', 'M2'),
+        'Remark': column('ok', 'see note'),
+        'Part': column(7, 8),
+        'Quantity': column(1, 'n/a'),
+    })
+    before, after = combiner.normalize_dtypes(df)
+    assert df.dtypes.astype(str).tolist() == ['datetime64[ns]', 'Int64', 'category', 'object', 'object', 'object']
+    assert df.attrs['dtype_savings'] == (before, after)
+    inferred = df.copy()
+    combiner.normalize_dtypes(inferred, infer_integers=True)
+    assert inferred['Part'].dtype == 'Int64'
+    assert inferred['Remark'].dtype == object
+
+
+def test_kunshan_quantities_beyond_int64_are_kept(workbook):
+    path = workbook('k.xlsx', {'Inspection data': kunshan_sheet(
+        ['Day', 'Machine', 'Qty产量'], [[datetime.datetime(2025, 1, 1), 'M1', 1e20],
+                                        [datetime.datetime(2025, 1, 2), 'M2', 'n/a']])})
+    output = combiner.process_excel_files(uploads(path), [])
+    df = pd.read_excel(output, sheet_name='WindingStationFuseChoke')
+    assert df['Machine'].tolist() == ['M1', 'M2']
+    assert df['Qty产量'].iloc[0] == 1e20
+
+
+@pytest.mark.parametrize('verbose, before, after, reported', [
+    (True, 1000, 400, True),
+    (True, 400, 1000, False),
+    (True, 0, 0, False),
+    (False, 1000, 400, False),
+])
+def test_dtype_savings_are_reported_in_detail_only_when_positive(config, capsys, verbose, before, after, reported):
+    config['COMBINE_VERBOSE_LOG'] = verbose
+    combiner.report_dtype_savings('Chokes', before, after)
+    assert ('600 bytes saved' in capsys.readouterr().out) == reported
@@ -0,0 +1,88 @@
+import io
+import os
+import time
+import datetime
+
+import pandas as pd
+import pytest
+from celery import Celery
+from werkzeug.datastructures import FileStorage
+
+import app as combiner
+from conftest import kunshan_sheet
+
+
+@pytest.fixture
+def eager_queue(config, tmp_path):
+    """Celery on the in-memory broker, running each job as it is submitted"""
+    config['JOBS_DIR'] = str(tmp_path / 'jobs')
+    celery_app = Celery('excel_combiner_test', broker='memory://')
+    celery_app.conf.task_always_eager = True
+    combiner.set_job_queue(combiner.CeleryJobQueue(celery_app))
+    yield
+    combiner.set_job_queue(None)
+
+
+def test_job_submit_status_download(eager_queue, workbook):
+    path = workbook('k.xlsx', {'Inspection data': kunshan_sheet(
+        ['Day', 'Machine', 'Qty产量'], [[datetime.datetime(2025, 1, 1), 'M1', 10]])})
+    client = combiner.app.test_client()
+
+    with open(path, 'rb') as f:
+        response = client.post('/kunshan', data={'files': [(f, 'k.xlsx')], 'job': '1'},
+                               content_type='multipart/form-data')
+    assert response.status_code == 202
+    submitted = response.get_json()
+    assert submitted['status'] == 'queued'
+
+    status = client.get(submitted['status_url']).get_json()
+    assert status['status'] == 'done'
+    assert status['progress']['rows'] == 1
+
+    download = client.get(submitted['download_url'])
+    assert download.status_code == 200
+    df = pd.read_excel(io.BytesIO(download.get_data()), sheet_name='WindingStationFuseChoke')
+    assert df['Machine'].tolist() == ['M1']
+    download.close()
+
+
+def test_unknown_job(eager_queue):
+    client = combiner.app.test_client()
+    assert client.get('/jobs/' + '0' * 32).status_code == 404
+    assert client.get('/jobs/not-a-job/download').status_code == 404
+
+
+def test_worker_entry_point_registers_the_task():
+    import tasks
+    assert tasks.run_combine_job.name == combiner.COMBINE_TASK_NAME
+    assert combiner.COMBINE_TASK_NAME in tasks.celery_app.tasks
+
+
+def test_abandoned_jobs_are_failed_then_deleted(config, tmp_path, workbook):
+    config['JOBS_DIR'] = str(tmp_path / 'jobs')
+    config['JOB_TTL_SECONDS'] = 3600
+    path = workbook('k.xlsx', {'Inspection data': kunshan_sheet(['Day'], [[datetime.datetime(2025, 1, 1)]])})
+    with open(path, 'rb') as f:
+        stale, fresh = (combiner.create_job('kunshan', [FileStorage(stream=f, filename='k.xlsx')], {})
+                        for _ in range(2))
+    running = combiner.read_job(stale['id'])
+    running['status'] = 'running'
+    combiner.write_job(running)
+    hours_ago = time.time() - 2 * 3600
+    os.utime(os.path.join(combiner.job_dir(stale['id']), 'job.json'), (hours_ago, hours_ago))
+
+    combiner.delete_expired_jobs()
+    failed = combiner.read_job(stale['id'])
+    assert failed['status'] == 'failed'
+    assert 'running' in failed['error']
+    assert not os.path.exists(os.path.join(combiner.job_dir(stale['id']), 'uploads'))
+    assert combiner.read_job(fresh['id'])['status'] == 'queued'
+
+    # Once failed, the job is kept for status requests like any finished job
+    combiner.delete_expired_jobs()
+    assert combiner.read_job(stale['id'])['status'] == 'failed'
+    failed['finished'] = hours_ago
+    combiner.write_job(failed)
+    combiner.delete_expired_jobs()
+    assert combiner.read_job(stale['id']) is None
+    assert combiner.read_job(fresh['id'])['status'] == 'queued'
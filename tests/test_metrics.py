@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+import app as combiner
+
+
+def registry(snapshots):
+    metrics = combiner.MetricsRegistry('test', snapshots)
+    metrics.declare('combines_total', 'counter', 'Combines.')
+    metrics.declare('combine_seconds', 'histogram', 'Combine time.', (1, 10))
+    return metrics
+
+
+def test_metrics_are_summed_over_processes_sharing_a_directory(tmp_path):
+    # Each ProcessSnapshots writes files of its own, like another worker process would
+    first, second = registry(combiner.ProcessSnapshots(str(tmp_path))), registry(combiner.ProcessSnapshots(str(tmp_path)))
+    first.inc('combines_total', plant='anhui')
+    first.observe('combine_seconds', 0.5, plant='anhui')
+    second.inc('combines_total', 2, plant='anhui')
+    second.inc('combines_total', plant='kunshan')
+    second.observe('combine_seconds', 5, plant='anhui')
+    # Each process writes its updates in the background, or when it renders
+    first.flush()
+    second.flush()
+
+    for metrics in (first, second):
+        text = metrics.render()
+        assert 'test_combines_total{plant="anhui"} 3' in text
+        assert 'test_combines_total{plant="kunshan"} 1' in text
+        assert 'test_combine_seconds_bucket{plant="anhui",le="1"} 1' in text
+        assert 'test_combine_seconds_bucket{plant="anhui",le="10"} 2' in text
+        assert 'test_combine_seconds_count{plant="anhui"} 2' in text
+    # Worker recycling counts this process's combines only
+    assert first.total('combines_total') == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_forked_worker_starts_its_own_counts(tmp_path):
+    metrics = registry(combiner.ProcessSnapshots(str(tmp_path)))
+    metrics.inc('combines_total', plant='anhui')
+    pid = os.fork()
+    if pid == 0:
+        try:
+            metrics.reset()
+            metrics.inc('combines_total', plant='anhui')
+            metrics.flush()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    assert 'test_combines_total{plant="anhui"} 2' in metrics.render()
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_updates_are_written_by_the_flush_thread(tmp_path):
+    metrics = combiner.MetricsRegistry('test', combiner.ProcessSnapshots(str(tmp_path)), flush_interval=0.05)
+    metrics.declare('combines_total', 'counter', 'Combines.')
+    for _ in range(100):
+        metrics.inc('combines_total', plant='anhui')
+    assert os.listdir(tmp_path) == []
+
+    deadline = time.monotonic() + 5
+    while not os.listdir(tmp_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    other = registry(combiner.ProcessSnapshots(str(tmp_path)))
+    assert 'test_combines_total{plant="anhui"} 100' in other.render()
+    assert not metrics.dirty
+
+
+def test_schema_mismatches_are_merged_over_processes(tmp_path, monkeypatch):
+    report = {'schema': 'brushcards', 'missing': ['Remark'], 'duplicates': [], 'unmapped': []}
+    combiner.ProcessSnapshots(str(tmp_path)).write('mismatches', [
+        {**report, 'count': 2, 'last_file': 'old.xlsx', 'last_sheet': 'S', 'last_seen': 1.0}])
+    monkeypatch.setattr(combiner, 'process_snapshots', combiner.ProcessSnapshots(str(tmp_path)))
+    monkeypatch.setattr(combiner, 'schema_mismatches', combiner.OrderedDict())
+    combiner.record_schema_mismatch('new.xlsx', 'S', report)
+
+    mismatches = combiner.app.test_client().get('/schema/mismatches').get_json()['mismatches']
+    assert len(mismatches) == 1
+    assert mismatches[0]['count'] == 3
+    assert mismatches[0]['last_file'] == 'new.xlsx'
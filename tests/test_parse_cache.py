@@ -0,0 +1,117 @@
+import os
+import pickle
+import datetime
+
+import numpy as np
+import pandas as pd
+from pyarrow import feather
+
+import app as combiner
+from conftest import kunshan_sheet, uploads
+
+
+class Exploit:
+    def __reduce__(self):
+        return (os.system, ('touch pwned',))
+
+
+def mixed_frame():
+    df = pd.DataFrame({
+        'text': ['a', np.nan, 'c', 'd'],
+        'mixed': ['x', 3, 2.5, True],
+        'when': [datetime.datetime(2025, 1, 2, 3, 4), datetime.time(7, 30), datetime.date(2025, 5, 6),
+                 datetime.timedelta(hours=36)],
+        'count': pd.array([1, None, 3, 4], dtype='Int64')
+    })
+    df.columns = ['text', float('nan'), datetime.datetime(2025, 1, 1), 7]
+    df.attrs['dtype_savings'] = (np.int64(100), np.int64(40))
+    return df
+
+
+def test_frame_round_trip_keeps_values_labels_and_attrs():
+    df = mixed_frame()
+    decoded = combiner.decode_frame(combiner.encode_frame(df))
+    assert decoded.shape == df.shape
+    assert decoded.columns[0] == 'text' and pd.isna(decoded.columns[1])
+    assert list(decoded.columns[2:]) == [datetime.datetime(2025, 1, 1), 7]
+    for position in range(3):
+        assert [type(value) for value in decoded.iloc[:, position]] == [type(value) for value in df.iloc[:, position]]
+        assert decoded.iloc[:, position].tolist() == df.iloc[:, position].tolist()
+    pd.testing.assert_series_equal(decoded.iloc[:, 3], df.iloc[:, 3])
+    assert list(decoded.attrs['dtype_savings']) == [100, 40]
+
+
+def test_frame_metadata_is_json():
+    table = combiner.encode_frame(mixed_frame())
+    meta = table.schema.metadata[combiner.FRAME_METADATA_KEY]
+    assert meta.startswith(b'{')
+
+
+def test_pickled_entries_are_never_loaded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = combiner.ParseCache(str(tmp_path / 'cache'), 1 << 20, 1 << 20)
+    key = 'a' * 64
+    with open(tmp_path / 'cache' / f'{key}.pkl', 'wb') as f:
+        pickle.dump(Exploit(), f)
+
+    assert cache.get(key) is None
+    cache.evict_disk()
+    assert not (tmp_path / 'pwned').exists()
+    assert not (tmp_path / 'cache' / f'{key}.pkl').exists()
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    frame = pd.DataFrame({'value': range(1000)})
+    cache = combiner.ParseCache(str(tmp_path), 0, 1 << 30)
+    cache.put('old', frame)
+    size = cache.disk_used
+    cache.disk_bytes = int(size * 1.5)
+    os.utime(tmp_path / 'old.feather', (0, 0))
+    cache.put('new', frame)
+    assert sorted(os.listdir(tmp_path)) == ['new.feather']
+    assert cache.disk_used == size
+    assert cache.get('new')['value'].tolist() == list(range(1000))
+
+
+def test_integers_beyond_int64_round_trip():
+    df = pd.DataFrame({'qty': [10 ** 20, 'pending', 3, -2 ** 70]}, dtype=object)
+    decoded = combiner.decode_frame(combiner.encode_frame(df))
+    assert decoded['qty'].tolist() == [10 ** 20, 'pending', 3, -2 ** 70]
+    assert [type(value) for value in decoded['qty']] == [int, str, int, int]
+
+
+def test_incremental_combine_keeps_sheets_it_cannot_store(combined_dir, workbook, monkeypatch):
+    path = workbook('k.xlsx', {'Inspection data': kunshan_sheet(
+        ['Day', 'Machine', 'Qty产量'], [['2025-01-01', 'M1', 1e20], ['2025-01-02', 'M2', 'pending']])})
+    output = combiner.process_excel_files(uploads(path), [], incremental=True)
+    df = pd.read_excel(output, sheet_name='WindingStationFuseChoke')
+    assert df['Qty产量'].tolist() == [1e20, 'pending']
+
+    def unwritable(base_path, df):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(combiner, 'save_frame', unwritable)
+    changed = workbook('k.xlsx', {'Inspection data': kunshan_sheet(
+        ['Day', 'Machine', 'Qty产量'], [['2025-01-03', 'M3', 5]])})
+    output = combiner.process_excel_files(uploads(changed), [], incremental=True)
+    assert pd.read_excel(output, sheet_name='WindingStationFuseChoke')['Machine'].tolist() == ['M3']
+    store = combiner.get_combined_store('kunshan')
+    with store.lock:
+        assert not store.has('k.xlsx', store.files[0]['digest'])
+
+
+def test_disk_errors_leave_sheets_cached_in_memory(tmp_path, monkeypatch):
+    cache = combiner.ParseCache(str(tmp_path), memory_bytes=1 << 30, disk_bytes=1 << 30)
+
+    def full(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(feather, 'write_feather', full)
+    df = pd.DataFrame({'a': [1, 2]})
+    cache.put('k', df)
+    assert cache.get('k') is df
+    assert os.listdir(tmp_path) == []
+
+    monkeypatch.setattr(combiner.os, 'scandir', full)
+    cache.evict_disk()
+    assert cache.stats()['disk_evictions'] == 0
@@ -0,0 +1,84 @@
+import datetime
+import zipfile
+
+import pytest
+
+import app as combiner
+from conftest import uploads, kunshan_sheet
+
+DAY = datetime.datetime(2025, 3, 1)
+
+
+@pytest.fixture
+def plant_files(workbook):
+    kunshan_header = ['Type', 'Week', 'Machine', 'Day', 'Part number', 'Qty产量', 'crack ', 'I Total PPM']
+    kunshan = [
+        workbook(f'kunshan{number}.xlsx', {
+            sheet: kunshan_sheet(kunshan_header, [
+                ['A', 9, f'16{number}{row}', DAY + datetime.timedelta(days=row), '812A', 1000 + row, row or None, 0.5]
+                for row in range(4)
+            ])
+            for sheet in ('Date', 'Data', 'Inspection data')
+        })
+        for number in range(2)
+    ]
+    brushcards = [
+        workbook(f'{client} 2025质量汇总表.xlsx', {
+            '绕线质量汇总表': [combiner.BRUSHCARD_COLUMNS] + [
+                [DAY, DAY, 'T-1', '碳刷', '碳刷断裂', row + 1, '返工', None, 'IQC', 100, None] for row in range(3)
+            ],
+            '点胶质量汇总表': [combiner.BRUSHCARD_COLUMNS] + [[DAY, DAY, 'T-2', '端子', '端子氧化', 2, '报废', '来料不良', 'FQC', 50, '复检']]
+        })
+        for client in ('Kelier', 'Bosch')
+    ]
+    chokes = workbook('Quality follow-up Chokes.xlsx', {
+        'Inspection data': [['Date', 'Part', 'Qty']] + [[DAY, f'P{row}', row] for row in range(5)]
+    })
+    return {'kunshan': kunshan, 'anhui': brushcards + [chokes]}
+
+
+def sheet_xml(output):
+    """The worksheet and shared-string parts of an xlsx, which hold all of its cell data"""
+    with zipfile.ZipFile(output) as archive:
+        return {name: archive.read(name) for name in archive.namelist()
+                if name.startswith('xl/worksheets/') or name == 'xl/sharedStrings.xml'}
+
+
+def combine(plant, paths):
+    files = uploads(*paths)
+    try:
+        return sheet_xml(combiner.process_excel_files(files, [], plant=plant, streaming=False))
+    finally:
+        for file in files:
+            file.close()
+
+
+@pytest.mark.parametrize('plant', ['kunshan', 'anhui'])
+def test_parse_pool_output_matches_serial(plant_files, config, plant):
+    config['PARSE_WORKERS'] = 1
+    serial = combine(plant, plant_files[plant])
+
+    config['PARSE_WORKERS'] = 2
+    try:
+        pooled = combine(plant, plant_files[plant])
+        assert combiner._parse_pool is not None
+        # Forked workers can inherit locks other threads held at the time
+        assert combiner._parse_pool._mp_context.get_start_method() in ('forkserver', 'spawn')
+    finally:
+        if combiner._parse_pool is not None:
+            combiner._parse_pool.shutdown()
+            combiner._parse_pool = None
+
+    assert pooled == serial
+
+
+def test_parse_pool_workers_use_the_current_settings(config):
+    config['PARSE_WORKERS'] = 2
+    config['READ_ENGINE'] = 'openpyxl'
+    try:
+        pool = combiner.get_parse_pool()
+        settings = pool.submit(combiner.app.config.get, 'READ_ENGINE').result()
+    finally:
+        combiner._parse_pool.shutdown()
+        combiner._parse_pool = None
+    assert settings == 'openpyxl'
@@ -0,0 +1,90 @@
+import os
+import time
+import datetime
+
+import pandas as pd
+import pytest
+
+import app as combiner
+from conftest import kunshan_sheet, uploads
+
+
+def test_ttl_counts_from_last_access(tmp_path):
+    store = combiner.ResultStore(str(tmp_path), max_bytes=1 << 30, ttl_seconds=3600)
+    for key in ('used', 'unused'):
+        store.put(key, lambda f: f.write(b'result'), filename='r.xlsx', mimetype='x')
+    long_ago = time.time() - 7200
+    with store.lock:
+        for entry in store.entries.values():
+            entry['created'] = entry['accessed'] = long_ago
+        store.write_index()
+
+    entry, file = store.open('used')
+    file.close()
+    store.evict()
+
+    assert set(store.entries) == {'used'}
+    assert store.open('unused') == (None, None)
+
+
+@pytest.fixture
+def two_files(workbook):
+    rows = [[datetime.datetime(2025, 1, 1), 'M1', 10]]
+    return [workbook(name, {'Inspection data': kunshan_sheet(['Day', 'Machine', 'Qty产量'], rows)})
+            for name in ('a.xlsx', 'b.xlsx')]
+
+
+def post(paths, **form):
+    files = [(open(path, 'rb'), os.path.basename(path)) for path in paths]
+    try:
+        return combiner.app.test_client().post('/kunshan', data={'files': files, **form},
+                                               content_type='multipart/form-data')
+    finally:
+        for f, _ in files:
+            f.close()
+
+
+def fail_for(filename, parse_sheet=combiner.parse_sheet):
+    def parse(task):
+        if task[1] == filename:
+            raise MemoryError()
+        return parse_sheet(task)
+    return parse
+
+
+@pytest.mark.parametrize('form', [{}, {'format': 'csv', 'sheet': 'WindingStationFuseChoke'}])
+def test_combine_with_a_failed_sheet_is_not_stored(result_store, two_files, monkeypatch, form):
+    monkeypatch.setattr(combiner, 'parse_sheet', fail_for('b.xlsx'))
+    response = post(two_files, **form)
+    response.get_data()
+    response.close()
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert result_store.stats()['entries'] == 0
+
+    monkeypatch.undo()
+    response = post(two_files, **form)
+    response.get_data()
+    response.close()
+    assert result_store.stats()['entries'] == 1
+
+
+def test_failed_sheets_are_counted(two_files, monkeypatch):
+    monkeypatch.setattr(combiner, 'parse_sheet', fail_for('b.xlsx'))
+    progress = combiner.CombineProgress()
+    output = combiner.process_excel_files(uploads(*two_files), [], progress=progress)
+    assert progress.counts['failed'] == 1
+    assert pd.read_excel(output, sheet_name='WindingStationFuseChoke')['Machine'].tolist() == ['M1']
+
+
+@pytest.mark.parametrize('form', [{}, {'format': 'csv', 'sheet': 'WindingStationFuseChoke'}])
+def test_store_errors_still_send_the_result(result_store, two_files, monkeypatch, form):
+    def full(*args, **kwargs):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(combiner.ResultStore, 'put', full)
+    response = post(two_files, **form)
+    body = response.get_data()
+    response.close()
+    assert response.status_code == 200
+    assert b'M1' in body or body.startswith(b'PK')
@@ -0,0 +1,85 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+import app as combiner
+from conftest import kunshan_sheet, uploads
+
+DAY1, DAY2 = datetime.datetime(2025, 3, 1), datetime.datetime(2025, 3, 2)
+KUNSHAN_HEADER = ['Week', 'Machine', 'Day', 'Part number', 'Qty产量', 'mix parts', 'Total final inspection', 'I Total PPM']
+BRUSHCARD_HEADER = ['生产日期', '不良部位', '不良名称', '数量\nQuantity', '当日检数量\nInspection quantity']
+
+
+def kunshan_file(workbook, name, rows):
+    return workbook(name, {'Inspection data': kunshan_sheet(KUNSHAN_HEADER, rows)})
+
+
+def read_rollup(output, sheet_name):
+    return pd.read_excel(output, sheet_name=sheet_name)
+
+
+def test_kunshan_daily_rollup_sums_counts_only(workbook):
+    path = kunshan_file(workbook, 'k.xlsx', [
+        [9, 1601, DAY1, 1609, 1000, 1, 2, 2000],
+        [9, 1602, DAY1, 9, 3000, 0, 4, 1333],
+        [9, 1601, DAY2, 1609, 500, 2, 1, 2000],
+    ])
+    output = combiner.process_excel_files(uploads(path), [], rollups=True)
+    rollup = read_rollup(output, 'WindingStationFuseChoke Daily')
+
+    assert list(rollup.columns) == ['date', 'Qty产量', 'mix parts', 'Total final inspection', 'I Total PPM']
+    assert rollup['date'].tolist() == [DAY1, DAY2]
+    assert rollup['Qty产量'].tolist() == [4000, 500]
+    assert rollup['mix parts'].tolist() == [1, 2]
+    assert rollup['Total final inspection'].tolist() == [6, 1]
+    assert rollup['I Total PPM'].tolist() == pytest.approx([1500, 2000])
+
+
+def test_brushcard_rollup_sums_per_key_with_defect_rate(workbook):
+    path = workbook('ClientA 质量汇总表.xlsx', {'质量汇总表': [
+        BRUSHCARD_HEADER,
+        [DAY1, 'Brush', 'Crack', 2, 100],
+        [DAY1, 'Brush', 'Crack', 3, 100],
+        [DAY1, 'Spring', 'Bent', 1, 0],
+        [DAY2, 'Brush', 'Crack', 4, 50],
+    ]})
+    output = combiner.process_excel_files(uploads(path), [], plant='anhui', rollups=True)
+    rollup = read_rollup(output, combiner.BRUSHCARD_ROLLUP_SHEET)
+
+    # One row per client, defect name, part and production date, in that order
+    assert rollup['不良名称\nDefect Name'].tolist() == ['Bent', 'Crack', 'Crack']
+    assert rollup[combiner.BRUSHCARD_QUANTITY_COLUMN].tolist() == [1, 5, 4]
+    assert rollup[combiner.BRUSHCARD_INSPECTED_COLUMN].tolist() == [0, 200, 50]
+    rate = rollup[combiner.DEFECT_RATE_COLUMN].tolist()
+    assert pd.isna(rate[0]) and rate[1:] == pytest.approx([0.025, 0.08])
+
+
+@pytest.fixture
+def parse_cache(config, tmp_path):
+    config['PARSE_CACHE_ENABLED'] = True
+    config['PARSE_CACHE_DIR'] = str(tmp_path / 'parse')
+    combiner._parse_cache = None
+    yield
+    combiner._parse_cache = None
+
+
+def test_partial_rollups_are_reused_for_unchanged_inputs(parse_cache, workbook, tmp_path, monkeypatch):
+    computed = []
+    partial_rollup = combiner.partial_rollup
+
+    def counting(kind, df):
+        computed.append(df['Qty产量'].tolist())
+        return partial_rollup(kind, df)
+
+    monkeypatch.setattr(combiner, 'partial_rollup', counting)
+    first = kunshan_file(workbook, 'a.xlsx', [[9, 1601, DAY1, 1, 100, 1, 1, 0]])
+    second = kunshan_file(workbook, 'b.xlsx', [[9, 1602, DAY1, 2, 200, 0, 2, 0]])
+    output = combiner.process_excel_files(uploads(first, second), [], rollups=True)
+    assert read_rollup(output, 'WindingStationFuseChoke Daily')['Qty产量'].tolist() == [300]
+    assert computed == [[100], [200]]
+
+    changed = kunshan_file(workbook, 'b.xlsx', [[9, 1602, DAY1, 2, 700, 0, 2, 0]])
+    output = combiner.process_excel_files(uploads(first, changed), [], rollups=True)
+    assert read_rollup(output, 'WindingStationFuseChoke Daily')['Qty产量'].tolist() == [800]
+    assert computed == [[100], [200], [700]]
@@ -0,0 +1,51 @@
+import datetime
+
+import pytest
+
+import app as combiner
+from conftest import kunshan_sheet
+
+
+def test_stream_output_yields_everything_written():
+    def produce(output):
+        output.write(b'a' * 100 * 1024)
+        output.write(b'tail')
+
+    assert b''.join(combiner.stream_output(produce)) == b'a' * 100 * 1024 + b'tail'
+
+
+def test_stream_output_raises_when_produce_fails_midway():
+    def produce(output):
+        output.write(b'a' * 100 * 1024)
+        output.write(b'buffered')
+        raise ValueError("combine failed")
+
+    chunks = []
+    with pytest.raises(ValueError, match="combine failed"):
+        for chunk in combiner.stream_output(produce):
+            chunks.append(chunk)
+    assert b''.join(chunks) == b'a' * 100 * 1024
+
+
+def test_streamed_export_has_etag_only_once_stored(result_store, workbook):
+    path = workbook('k.xlsx', {'Inspection data': kunshan_sheet(
+        ['Day', 'Machine', 'Qty产量'], [[datetime.datetime(2025, 1, 1), 'M1', 10]])})
+    client = combiner.app.test_client()
+
+    def post():
+        with open(path, 'rb') as f:
+            return client.post('/kunshan', data={'files': [(f, 'k.xlsx')], 'format': 'csv',
+                                                 'sheet': 'WindingStationFuseChoke'},
+                               content_type='multipart/form-data')
+
+    streamed = post()
+    body = streamed.get_data()
+    streamed.close()
+    assert streamed.status_code == 200
+    assert 'ETag' not in streamed.headers
+    assert b'M1' in body
+
+    stored = post()
+    assert stored.headers['ETag'].startswith('W/')
+    assert stored.get_data() == body
+    stored.close()
@@ -0,0 +1,24 @@
+import io
+
+import pytest
+
+import app as combiner
+
+
+@pytest.mark.parametrize('limit, expected', [
+    (100 * 1024 * 1024, '100 MB'),
+    (1024 * 1024, '1 MB'),
+    (512 * 1024, '512 KB'),
+    (1000, '1000 bytes'),
+])
+def test_format_limit(limit, expected):
+    assert combiner.format_limit(limit) == expected
+
+
+def test_file_over_a_limit_under_one_mb(config):
+    config['MAX_UPLOAD_FILE_BYTES'] = 64 * 1024
+    client = combiner.app.test_client()
+    response = client.post('/kunshan', data={'files': [(io.BytesIO(b'x' * (65 * 1024)), 'big.xlsx')]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 413
+    assert 'at most 64 KB' in response.get_data(as_text=True)
@@ -0,0 +1,135 @@
+"""The lean reader against pd.read_excel(engine='openpyxl') on the same workbooks."""
+import datetime
+import zipfile
+
+import pandas as pd
+import pytest
+import xlsxwriter
+
+import app as combiner
+from conftest import kunshan_sheet
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>"""
+
+ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>"""
+
+# Inline strings, a row number gap, column letters with gaps, cells without
+# a reference, an empty inline string and trailing rows with no values
+INLINE_SHEET = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetData>
+<row r="1"><c r="A1" t="inlineStr"><is><t>Name</t></is></c><c r="C1" t="inlineStr"><is><r><t>Qty</t></r><r><t> (pcs)</t></r></is></c><c r="F1" t="inlineStr"><is><t>Note</t></is></c></row>
+<row r="2"><c r="A2" t="inlineStr"><is><t>alpha</t></is></c><c r="C2"><v>3</v></c><c r="F2" t="inlineStr"><is><t></t></is></c></row>
+<row r="4"><c r="A4" t="inlineStr"><is><t>gamma</t></is></c><c r="C4"><v>2.5</v></c><c r="F4" t="str"><v>formula text</v></c></row>
+<row r="5"><c t="inlineStr"><is><t>delta</t></is></c><c t="inlineStr"><is><t>NA</t></is></c><c><v>7</v></c></row>
+<row r="6"><c r="B6" t="inlineStr"><is><t></t></is></c></row>
+<row r="7"/>
+</sheetData>
+</worksheet>"""
+
+
+def inline_string_workbook(path):
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        archive.writestr('xl/workbook.xml', WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        archive.writestr('xl/worksheets/sheet1.xml', INLINE_SHEET)
+    return path
+
+
+@pytest.fixture
+def typed_workbook(tmp_path):
+    """Dates, times, booleans, errors, NA markers, column gaps and formatted trailing blank rows"""
+    path = str(tmp_path / 'typed.xlsx')
+    book = xlsxwriter.Workbook(path)
+    date_format = book.add_format({'num_format': 'yyyy-mm-dd'})
+    time_format = book.add_format({'num_format': 'hh:mm:ss'})
+    border = book.add_format({'border': 1})
+    sheet = book.add_worksheet('Data')
+    sheet.write_row(0, 0, ['Day', 'Machine', 'Qty', 'Passed'])
+    sheet.write(0, 5, 'Shift start')
+    sheet.write_datetime(1, 0, datetime.datetime(2025, 1, 2), date_format)
+    sheet.write_row(1, 1, ['M1', 10, True])
+    sheet.write_datetime(1, 5, datetime.datetime(1899, 12, 31, 6, 30), time_format)
+    sheet.write_datetime(2, 0, datetime.datetime(2025, 1, 3, 14, 15), date_format)
+    sheet.write(2, 1, 'N/A')
+    sheet.write(2, 2, 1.5)
+    sheet.write_formula(2, 3, '=1/0', None, '#DIV/0!')
+    # Row 4 is left out entirely; row 5 has a value past the last header column
+    sheet.write(4, 1, 'M2')
+    sheet.write(4, 2, 3.0)
+    sheet.write(4, 7, 'stray')
+    # Formatted cells without values: trailing rows that are not part of the data
+    for row in range(5, 9):
+        sheet.write_blank(row, 0, None, border)
+    book.close()
+    return path
+
+
+@pytest.mark.parametrize('header, skip_rows', [(0, 0), (None, 0), (0, 2), (None, 1)])
+def test_read_sheet_matches_read_excel(typed_workbook, header, skip_rows):
+    expected = pd.read_excel(typed_workbook, sheet_name='Data', engine='openpyxl',
+                             header=header, skiprows=skip_rows)
+    with combiner.XlsxReader(typed_workbook) as reader:
+        df = combiner.read_sheet(reader, 'Data', header=header, skip_rows=skip_rows)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+@pytest.mark.parametrize('header, skip_rows', [(0, 0), (None, 0), (0, 3)])
+def test_read_sheet_matches_read_excel_on_inline_strings(tmp_path, header, skip_rows):
+    path = inline_string_workbook(str(tmp_path / 'inline.xlsx'))
+    expected = pd.read_excel(path, sheet_name='Sheet1', engine='openpyxl', header=header, skiprows=skip_rows)
+    with combiner.XlsxReader(path) as reader:
+        df = combiner.read_sheet(reader, 'Sheet1', header=header, skip_rows=skip_rows)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+@pytest.mark.parametrize('make', ['typed', 'inline'])
+def test_drop_blank_rows_and_projection_match_read_excel(typed_workbook, tmp_path, make):
+    path = typed_workbook if make == 'typed' else inline_string_workbook(str(tmp_path / 'inline.xlsx'))
+    sheet_name = 'Data' if make == 'typed' else 'Sheet1'
+    full = pd.read_excel(path, sheet_name=sheet_name, engine='openpyxl').dropna(how='all')
+    with combiner.XlsxReader(path) as reader:
+        df = combiner.read_sheet(reader, sheet_name, drop_blank_rows=True)
+        projected = combiner.read_sheet(reader, sheet_name, columns=lambda names: [2, 0], drop_blank_rows=True)
+    pd.testing.assert_frame_equal(df, full)
+    pd.testing.assert_frame_equal(projected, full.iloc[:, [2, 0]])
+
+
+@pytest.mark.parametrize('kind, sheets', [
+    ('kunshan', {'Inspection data': kunshan_sheet(
+        ['Day', 'Machine', 'Qty产量', 'Type'],
+        [[datetime.datetime(2025, 1, 1), 'M1', 10, 'a'], [None, None, None, None],
+         [datetime.datetime(2025, 1, 2), 'M2', 2.5, 'b']])}),
+    ('chokes', {'Inspection data': [
+        ['Date', 'Part', 'Result'], [datetime.datetime(2025, 2, 1), 'P1', 'OK'],
+        [None, None, None], [datetime.datetime(2025, 2, 2), None, 'NG']]}),
+])
+def test_lean_parse_matches_openpyxl_parse(config, workbook, kind, sheets):
+    path = workbook('Client Chokes.xlsx', sheets)
+    task = (path, 'Client Chokes.xlsx', 'Inspection data', kind)
+    config['READ_ENGINE'] = 'openpyxl'
+    expected = combiner.parse_sheet(task)
+    config['READ_ENGINE'] = 'lean'
+    df = combiner.parse_sheet(task)
+    pd.testing.assert_frame_equal(df, expected)